@@ -0,0 +1,302 @@
+from __future__ import annotations
+from typing import Any, Optional, List
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from src.config import settings
+from src.util import logger
+
+
+class SourceAggregate:
+    """
+    Running aggregates of one source.
+
+    counts is a ring of `buckets` time buckets by class id; a slot is
+    cleared when a newer bucket claims it, so the ring always holds the
+    last `buckets` buckets. heatmaps holds one grid per class counting
+    where box centres fell, in frame-relative cells.
+    """
+
+    def __init__(self, buckets: int, grid: int, classes: int = 80) -> None:
+        self.counts = np.zeros((buckets, classes), dtype=np.int64)
+        self.frames = np.zeros(buckets, dtype=np.int64)
+        # Absolute bucket number held by each slot, -1 if empty
+        self.bucket_ids = np.full(buckets, -1, dtype=np.int64)
+        self.grid = grid
+        self.heatmaps: dict[int, np.ndarray] = {}
+
+    def _slot(self, bucket: int) -> Optional[int]:
+        slot = bucket % len(self.bucket_ids)
+        if self.bucket_ids[slot] > bucket:
+            # Older than the window
+            return None
+        if self.bucket_ids[slot] != bucket:
+            self.bucket_ids[slot] = bucket
+            self.counts[slot] = 0
+            self.frames[slot] = 0
+        return slot
+
+    def add(
+        self,
+        bucket: int,
+        classes: np.ndarray,
+        centers: Optional[np.ndarray]
+    ) -> None:
+        slot = self._slot(bucket)
+        if slot is not None:
+            if len(classes) and classes.max() >= self.counts.shape[1]:
+                grown = np.zeros(
+                    (self.counts.shape[0], int(classes.max()) + 1),
+                    dtype=np.int64
+                )
+                grown[:, :self.counts.shape[1]] = self.counts
+                self.counts = grown
+            np.add.at(self.counts[slot], classes, 1)
+            self.frames[slot] += 1
+
+        if centers is None:
+            return
+        cells = np.clip((centers * self.grid).astype(np.int64), 0, self.grid - 1)
+        for class_id in np.unique(classes):
+            heatmap = self.heatmaps.get(int(class_id))
+            if heatmap is None:
+                heatmap = self.heatmaps[int(class_id)] = np.zeros(
+                    (self.grid, self.grid), dtype=np.int64
+                )
+            mask = classes == class_id
+            np.add.at(heatmap, (cells[mask, 1], cells[mask, 0]), 1)
+
+    def window(self, last_bucket: int, count: int) -> tuple[np.ndarray, np.ndarray]:
+        """(counts[count, classes], frames[count]) for the `count` buckets
+        ending at `last_bucket`, oldest first; missing buckets are zero."""
+        wanted = np.arange(last_bucket - count + 1, last_bucket + 1)
+        slots = wanted % len(self.bucket_ids)
+        present = self.bucket_ids[slots] == wanted
+        counts = np.where(present[:, None], self.counts[slots], 0)
+        frames = np.where(present, self.frames[slots], 0)
+        return counts, frames
+
+
+class Aggregator:
+    """
+    In-process analytics fed by DetectionDb.insert_detection.
+
+    Every stored frame adds its objects to per-source, per-class counters
+    in fixed time buckets and to per-class occupancy grids, so queries
+    cost the size of the window and grid, never a scan of history. The
+    aggregates are snapshotted to disk every `snapshot_interval` seconds
+    and reloaded at startup, which warms them up after a restart.
+    """
+    NAME = "ANALYTICS"
+
+    def __init__(
+        self,
+        enabled: bool = settings.ANALYTICS_ENABLED,
+        bucket_seconds: int = settings.ANALYTICS_BUCKET_SECONDS,
+        buckets: int = settings.ANALYTICS_BUCKETS,
+        grid: int = settings.ANALYTICS_GRID_SIZE,
+        snapshot_path: str = settings.ANALYTICS_SNAPSHOT_PATH,
+        snapshot_interval: float = settings.ANALYTICS_SNAPSHOT_INTERVAL
+    ) -> None:
+        self.enabled = enabled
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self.grid = grid
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.sources: dict[str, SourceAggregate] = {}
+        self.names: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if enabled:
+            self.load()
+
+    def _source(self, source: str) -> SourceAggregate:
+        aggregate = self.sources.get(source)
+        if aggregate is None:
+            aggregate = self.sources[source] = SourceAggregate(self.buckets, self.grid)
+        return aggregate
+
+    def record(
+        self,
+        detection_data: Any,
+        ts: float,
+        source: Optional[str] = None,
+        image_size: Optional[tuple[int, int]] = None
+    ) -> None:
+        """Add one stored frame. image_size is the (height, width) its
+        boxes refer to; without it only the counters are updated."""
+        if not self.enabled or not isinstance(detection_data, list):
+            return
+        objects = [
+            obj for obj in detection_data
+            if isinstance(obj, dict) and "class" in obj
+        ]
+        classes = np.array([obj["class"] for obj in objects], dtype=np.int64)
+
+        centers = None
+        height, width = image_size or (0, 0)
+        if height > 0 and width > 0 and objects:
+            # Boxes mapped back onto the camera frame when it was scaled
+            boxes = np.array([
+                [box["x1"], box["y1"], box["x2"], box["y2"]]
+                for box in (obj.get("original_box") or obj["box"] for obj in objects)
+            ], dtype=np.float64)
+            centers = np.stack([
+                (boxes[:, 0] + boxes[:, 2]) / (2 * width),
+                (boxes[:, 1] + boxes[:, 3]) / (2 * height)
+            ], axis=1)
+
+        with self._lock:
+            for obj in objects:
+                if "name" in obj:
+                    self.names[obj["class"]] = obj["name"]
+            self._source(source or "default").add(
+                int(ts // self.bucket_seconds),
+                classes,
+                centers
+            )
+            self._dirty = True
+
+    def _class_id(self, class_name: Optional[str]) -> Optional[int]:
+        # Callers hold the lock
+        for class_id, name in self.names.items():
+            if name == class_name:
+                return class_id
+        return None
+
+    def _selected(self, source: Optional[str]) -> List[SourceAggregate]:
+        if source is None:
+            return list(self.sources.values())
+        return [self.sources[source]] if source in self.sources else []
+
+    def counts(
+        self,
+        source: Optional[str] = None,
+        buckets: int = 60,
+        now: Optional[float] = None
+    ) -> dict[str, Any]:
+        """Per-class object counts per bucket over the last `buckets` buckets."""
+        buckets = max(1, min(buckets, self.buckets))
+        last = int((now or time.time()) // self.bucket_seconds)
+        with self._lock:
+            windows = [agg.window(last, buckets) for agg in self._selected(source)]
+            names = dict(self.names)
+        width = max((counts.shape[1] for counts, _ in windows), default=0)
+        counts = np.zeros((buckets, width), dtype=np.int64)
+        frames = np.zeros(buckets, dtype=np.int64)
+        for window_counts, window_frames in windows:
+            counts[:, :window_counts.shape[1]] += window_counts
+            frames += window_frames
+
+        seen = np.flatnonzero(counts.sum(axis=0))
+        return {
+            "bucket_seconds": self.bucket_seconds,
+            "buckets": [
+                (last - buckets + 1 + i) * self.bucket_seconds for i in range(buckets)
+            ],
+            "frames": frames.tolist(),
+            "counts": {
+                names.get(int(class_id), str(class_id)): counts[:, class_id].tolist()
+                for class_id in seen
+            },
+            "totals": {
+                names.get(int(class_id), str(class_id)): int(counts[:, class_id].sum())
+                for class_id in seen
+            }
+        }
+
+    def heatmap(
+        self,
+        source: Optional[str] = None,
+        class_name: Optional[str] = None
+    ) -> Optional[np.ndarray]:
+        """Occupancy grid (rows are y) of one class or of all classes;
+        None if the class has never been seen."""
+        total = np.zeros((self.grid, self.grid), dtype=np.int64)
+        with self._lock:
+            # names is written by record() under the lock
+            class_id = None
+            if class_name is not None:
+                class_id = self._class_id(class_name)
+                if class_id is None:
+                    return None
+            for aggregate in self._selected(source):
+                for heatmap_class, heatmap in aggregate.heatmaps.items():
+                    if class_id is None or heatmap_class == class_id:
+                        total += heatmap
+        return total
+
+    def save(self) -> None:
+        """Write a snapshot of all aggregates, atomically."""
+        with self._lock:
+            if not self._dirty:
+                return
+            arrays: dict[str, np.ndarray] = {}
+            manifest = {
+                "bucket_seconds": self.bucket_seconds,
+                "buckets": self.buckets,
+                "grid": self.grid,
+                "names": {str(k): v for k, v in self.names.items()},
+                "sources": []
+            }
+            for i, (source, aggregate) in enumerate(self.sources.items()):
+                manifest["sources"].append({
+                    "source": source,
+                    "heatmaps": list(aggregate.heatmaps)
+                })
+                arrays[f"counts_{i}"] = aggregate.counts.copy()
+                arrays[f"frames_{i}"] = aggregate.frames.copy()
+                arrays[f"bucket_ids_{i}"] = aggregate.bucket_ids.copy()
+                for class_id, heatmap in aggregate.heatmaps.items():
+                    arrays[f"heatmap_{i}_{class_id}"] = heatmap.copy()
+            self._dirty = False
+
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, manifest=np.array(json.dumps(manifest)), **arrays)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def load(self) -> None:
+        """Restore a snapshot written with the same bucket and grid settings."""
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with np.load(self.snapshot_path) as data:
+                manifest = json.loads(str(data["manifest"]))
+                if (
+                    manifest["bucket_seconds"] != self.bucket_seconds
+                    or manifest["buckets"] != self.buckets
+                    or manifest["grid"] != self.grid
+                ):
+                    logger.warning(f"[{self.NAME}]: Snapshot settings differ, starting empty")
+                    return
+                self.names = {int(k): v for k, v in manifest["names"].items()}
+                for i, entry in enumerate(manifest["sources"]):
+                    aggregate = self._source(entry["source"])
+                    aggregate.counts = data[f"counts_{i}"].copy()
+                    aggregate.frames = data[f"frames_{i}"].copy()
+                    aggregate.bucket_ids = data[f"bucket_ids_{i}"].copy()
+                    for class_id in entry["heatmaps"]:
+                        aggregate.heatmaps[class_id] = data[f"heatmap_{i}_{class_id}"].copy()
+            logger.info(f"[{self.NAME}]: Loaded aggregates of {len(self.sources)} source(s)")
+        except Exception as e:
+            logger.warning(f"[{self.NAME}]: Could not load snapshot: {e}")
+            self.sources = {}
+
+    def _snapshot_loop(self) -> None:
+        while True:
+            time.sleep(self.snapshot_interval)
+            try:
+                self.save()
+            except Exception as e:
+                logger.warning(f"[{self.NAME}]: Snapshot failed: {e}")
+
+    def start(self) -> None:
+        if self.enabled:
+            threading.Thread(target=self._snapshot_loop, daemon=True).start()
@@ -8,6 +8,14 @@ class Settings:
     BASE_DIR: str = "/app"
 
     CACHE_DB_PATH: str = os.path.join(BASE_DIR, "cache", "detection.db")
+    CACHE_MAX_ROWS: int = int(os.getenv("CACHE_MAX_ROWS", 10000))
+    CACHE_MMAP_SIZE: int = int(os.getenv("CACHE_MMAP_SIZE", 64 * 1024 * 1024))
+
+    # Read-through cache for /detection/{id} and /detections
+    DETECTION_CACHE_MAX_ENTRIES: int = int(os.getenv("DETECTION_CACHE_MAX_ENTRIES", 1024))
+    DETECTION_CACHE_MAX_BYTES: int = int(os.getenv("DETECTION_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+    DETECTION_CACHE_REDIS: bool = os.getenv("DETECTION_CACHE_REDIS", "1") == "1"
+    DETECTION_CACHE_TTL: int = int(os.getenv("DETECTION_CACHE_TTL", 300))
     IMAGE_DIR: str = os.path.join(BASE_DIR, "images")
     LOG_DIR: str = shared_settings.LOG_DIR
 
@@ -18,6 +26,15 @@ class Settings:
     MINIO_ROOT_USER: str = shared_settings.MINIO_ROOT_USER
     MINIO_ROOT_PASSWORD: str = shared_settings.MINIO_ROOT_PASSWORD
     MINIO_BUCKET: str = shared_settings.MINIO_BUCKET
+    # Parallel MinIO requests; also the size of the HTTP connection pool
+    MINIO_MAX_CONCURRENCY: int = int(os.getenv("MINIO_MAX_CONCURRENCY", 16))
+    MINIO_MULTIPART_THRESHOLD: int = int(os.getenv("MINIO_MULTIPART_THRESHOLD", 8 * 1024 * 1024))
+    MINIO_MULTIPART_CHUNKSIZE: int = int(os.getenv("MINIO_MULTIPART_CHUNKSIZE", 8 * 1024 * 1024))
+
+    # Image delivery for /detection/{id}
+    IMAGE_STREAM_CHUNK_SIZE: int = int(os.getenv("IMAGE_STREAM_CHUNK_SIZE", 64 * 1024))
+    IMAGE_CACHE_DIR: str = os.path.join(BASE_DIR, "cache", "images")
+    IMAGE_CACHE_MAX_BYTES: int = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
 
     POSTGRES_TABLE_NAME: str = shared_settings.POSTGRES_TABLE_NAME
     POSTGRES_HOST: str = shared_settings.POSTGRES_HOST
@@ -26,6 +43,23 @@ class Settings:
     POSTGRES_USER: str = shared_settings.POSTGRES_USER
     POSTGRES_PASSWORD: str = shared_settings.POSTGRES_PASSWORD
     POSTGRES_DSN: str = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    POSTGRES_POOL_MIN: int = int(os.getenv("POSTGRES_POOL_MIN", 1))
+    POSTGRES_POOL_MAX: int = int(os.getenv("POSTGRES_POOL_MAX", 8))
+    # Group commit: merge concurrent inserts into one multi-row INSERT
+    POSTGRES_GROUP_COMMIT: bool = os.getenv("POSTGRES_GROUP_COMMIT", "1") == "1"
+    POSTGRES_GROUP_COMMIT_WINDOW_MS: float = float(os.getenv("POSTGRES_GROUP_COMMIT_WINDOW_MS", 5))
+    POSTGRES_GROUP_COMMIT_MAX_BATCH: int = int(os.getenv("POSTGRES_GROUP_COMMIT_MAX_BATCH", 64))
+    # Rows replayed from the SQLite cache per multi-row upsert
+    SYNC_BATCH_SIZE: int = int(os.getenv("SYNC_BATCH_SIZE", 500))
+    # Day partitions created ahead of time
+    POSTGRES_PARTITION_PREMAKE_DAYS: int = int(os.getenv("POSTGRES_PARTITION_PREMAKE_DAYS", 2))
+    # Detections and their images older than this are deleted; 0 keeps everything
+    RETENTION_DAYS: float = float(os.getenv("RETENTION_DAYS", 0))
+    RETENTION_INTERVAL: float = float(os.getenv("RETENTION_INTERVAL", 3600))
+    RETENTION_DELETE_BATCH_SIZE: int = int(os.getenv("RETENTION_DELETE_BATCH_SIZE", 1000))
+    # Frames per transaction when indexing objects of pre-existing rows
+    OBJECT_BACKFILL_BATCH_SIZE: int = int(os.getenv("OBJECT_BACKFILL_BATCH_SIZE", 1000))
+    DETECTIONS_PAGE_MAX: int = int(os.getenv("DETECTIONS_PAGE_MAX", 500))
 
     REDIS_HOST: str = shared_settings.REDIS_HOST
     REDIS_PORT: int = shared_settings.REDIS_PORT
@@ -35,6 +69,40 @@ class Settings:
     REDIS_MODEL_REQUEST_QUEUE: str = shared_settings.REDIS_MODEL_REQUEST_QUEUE
     REDIS_MODEL_RESULT_QUEUE: str = shared_settings.REDIS_MODEL_RESULT_QUEUE
     REDIS_STORAGE_QUEUE: str = shared_settings.REDIS_STORAGE_QUEUE
+    REDIS_MODEL_INFO_KEY: str = shared_settings.REDIS_MODEL_INFO_KEY
+
+    # Frames popped from the task queue but not yet persisted
+    STREAM_MAX_IN_FLIGHT: int = int(os.getenv("STREAM_MAX_IN_FLIGHT", 16))
+    STREAM_PERSIST_WORKERS: int = int(os.getenv("STREAM_PERSIST_WORKERS", 4))
+    MODEL_RESULT_TIMEOUT: float = float(os.getenv("MODEL_RESULT_TIMEOUT", 30))
+
+    # Content-hash cache of inference results, skips duplicate images
+    RESULT_CACHE_ENABLED: bool = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+    RESULT_CACHE_TTL: int = int(os.getenv("RESULT_CACHE_TTL", 3600))
+    RESULT_CACHE_MAX_ENTRIES: int = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 10000))
+
+    # Per-source object tracking; only frames where a track starts, ends or
+    # moves are stored
+    TRACKER_ENABLED: bool = os.getenv("TRACKER_ENABLED", "0") == "1"
+    TRACKER_IOU_THRESHOLD: float = float(os.getenv("TRACKER_IOU_THRESHOLD", 0.3))
+    TRACKER_MAX_AGE: float = float(os.getenv("TRACKER_MAX_AGE", 5.0))
+    TRACKER_MIN_HITS: int = int(os.getenv("TRACKER_MIN_HITS", 2))
+    # A track is stored again once its IoU with the last stored box drops below this
+    TRACKER_CHANGE_IOU: float = float(os.getenv("TRACKER_CHANGE_IOU", 0.6))
+    TRACKER_HISTORY: int = int(os.getenv("TRACKER_HISTORY", 1000))
+
+    # Per-frame hop timelines behind /trace; the last TRACE_HISTORY are kept
+    TRACE_ENABLED: bool = os.getenv("TRACE_ENABLED", "1") == "1"
+    TRACE_HISTORY: int = int(os.getenv("TRACE_HISTORY", 5000))
+
+    # In-process per-class counters and occupancy grids behind /analytics
+    ANALYTICS_ENABLED: bool = os.getenv("ANALYTICS_ENABLED", "1") == "1"
+    ANALYTICS_BUCKET_SECONDS: int = int(os.getenv("ANALYTICS_BUCKET_SECONDS", 60))
+    # Buckets kept per source, one day of minutes by default
+    ANALYTICS_BUCKETS: int = int(os.getenv("ANALYTICS_BUCKETS", 1440))
+    ANALYTICS_GRID_SIZE: int = int(os.getenv("ANALYTICS_GRID_SIZE", 32))
+    ANALYTICS_SNAPSHOT_PATH: str = os.path.join(BASE_DIR, "cache", "analytics.npz")
+    ANALYTICS_SNAPSHOT_INTERVAL: float = float(os.getenv("ANALYTICS_SNAPSHOT_INTERVAL", 60))
 
     # class Config:
     #     env_file = [".env", ".env.private"]
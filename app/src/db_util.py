@@ -1,14 +1,25 @@
 from __future__ import annotations
-from typing import Any, Optional, List
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, List
+import asyncio
+import base64
+import calendar
 import json
+import re
 import time
+import uuid
 import sqlite3
 import threading
 from src.util import logger
 import psycopg2
-from psycopg2.extras import RealDictCursor, Json
+from psycopg2.extras import RealDictCursor, Json, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from src.config import settings
+from src.detection_cache import DetectionCache
+from src.analytics import Aggregator
 from psycopg2 import OperationalError
+from psycopg2.errors import UndefinedTable
 
 class BaseDb:
     """Base class storing common SQL strings and helper logic."""
@@ -18,22 +29,38 @@ class BaseDb:
     COL_DETECTION_DATA = "detection_data"
     COL_CREATED_AT = "created_at"
     COL_SYNCED = "synced"
+    COL_UUID = "detection_uuid"
+    COL_SOURCE = "source"
 
     SQL_INSERT = (
         "INSERT INTO {table} ({image_col}, {data_col}, {ts_col}) "
         "VALUES (%s, %s, %s) RETURNING id"
     )
+    # Upsert keyed on the client-generated uuid, so replaying a row returns
+    # the id it already has instead of inserting it twice. xmax is 0 only
+    # for rows this statement inserted.
+    SQL_UPSERT_MANY = (
+        "INSERT INTO {table} ({uuid_col}, {image_col}, {data_col}, {ts_col}, {source_col}) "
+        "VALUES %s "
+        "ON CONFLICT ({uuid_col}, {ts_col}) DO UPDATE SET {uuid_col}=EXCLUDED.{uuid_col} "
+        "RETURNING id, {uuid_col}, (xmax = 0) AS inserted"
+    )
     SQL_SELECT_BY_ID = "SELECT * FROM {table} WHERE id=%s"
     SQL_SELECT_ALL = "SELECT * FROM {table}"
     SQL_SELECT_RECENT = "SELECT * FROM {table} ORDER BY {ts_col} DESC LIMIT %s"
 
-    def _format_query(self, sql: str, table: str) -> str:
+    def _format_query(self, sql: str, table: str, **names: str) -> str:
         """Format SQL string with actual table/column names."""
         return sql.format(
+            **names,
             table=table,
+            id_col=self.COL_ID,
             image_col=self.COL_IMAGE_PATH,
             data_col=self.COL_DETECTION_DATA,
-            ts_col=self.COL_CREATED_AT
+            ts_col=self.COL_CREATED_AT,
+            uuid_col=self.COL_UUID,
+            source_col=self.COL_SOURCE,
+            objects=f"{table}_objects"
         )
 
     def insert_detection(
@@ -64,18 +91,53 @@ class SqliteDb(BaseDb):
             {BaseDb.COL_IMAGE_PATH} TEXT NOT NULL,
             {BaseDb.COL_DETECTION_DATA} TEXT NOT NULL,
             {BaseDb.COL_CREATED_AT} REAL NOT NULL,
-            {BaseDb.COL_SYNCED} INTEGER DEFAULT 0
+            {BaseDb.COL_SYNCED} INTEGER DEFAULT 0,
+            {BaseDb.COL_UUID} TEXT,
+            {BaseDb.COL_SOURCE} TEXT
         )
     """
 
+    SQL_ADD_UUID_COLUMN = f"""
+        ALTER TABLE {SQLITE_TABLE_NAME} ADD COLUMN {BaseDb.COL_UUID} TEXT
+    """
+
+    SQL_ADD_SOURCE_COLUMN = f"""
+        ALTER TABLE {SQLITE_TABLE_NAME} ADD COLUMN {BaseDb.COL_SOURCE} TEXT
+    """
+
+    # Rows cached before detection_uuid existed get a random one
+    SQL_BACKFILL_UUID = f"""
+        UPDATE {SQLITE_TABLE_NAME} SET {BaseDb.COL_UUID}=lower(hex(randomblob(16)))
+        WHERE {BaseDb.COL_UUID} IS NULL
+    """
+
+    SQL_CREATE_UUID_INDEX = f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS {SQLITE_TABLE_NAME}_uuid_idx
+        ON {SQLITE_TABLE_NAME} ({BaseDb.COL_UUID})
+    """
+
     SQL_SELECT_UNSYNCED = f"""
         SELECT * FROM {SQLITE_TABLE_NAME} WHERE {BaseDb.COL_SYNCED}=0
         ORDER BY {BaseDb.COL_CREATED_AT} ASC
+        LIMIT ?
     """
 
     SQL_UPDATE_SYNCED = f"""
         UPDATE {SQLITE_TABLE_NAME} SET {BaseDb.COL_ID}=?, {BaseDb.COL_SYNCED}=1
-        WHERE rowid=?
+        WHERE {BaseDb.COL_UUID}=?
+    """
+
+    # Frees an id taken over from Postgres: an unsynced row holding it moves
+    # to a fresh local id, a stale synced copy is dropped
+    SQL_RELOCATE_CONFLICT = f"""
+        UPDATE {SQLITE_TABLE_NAME}
+        SET {BaseDb.COL_ID}=(SELECT MAX({BaseDb.COL_ID}) + 1 FROM {SQLITE_TABLE_NAME})
+        WHERE {BaseDb.COL_ID}=? AND {BaseDb.COL_UUID}<>? AND {BaseDb.COL_SYNCED}=0
+    """
+
+    SQL_DELETE_CONFLICT = f"""
+        DELETE FROM {SQLITE_TABLE_NAME}
+        WHERE {BaseDb.COL_ID}=? AND {BaseDb.COL_UUID}<>? AND {BaseDb.COL_SYNCED}=1
     """
 
     SQL_INSERT = f"""
@@ -83,20 +145,25 @@ class SqliteDb(BaseDb):
             {BaseDb.COL_IMAGE_PATH},
             {BaseDb.COL_DETECTION_DATA},
             {BaseDb.COL_CREATED_AT},
-            {BaseDb.COL_SYNCED}
+            {BaseDb.COL_SYNCED},
+            {BaseDb.COL_UUID},
+            {BaseDb.COL_SOURCE}
         )
-        VALUES (?, ?, ?, 0)
+        VALUES (?, ?, ?, 0, ?, ?)
     """
 
+    # Caches a Postgres row under its own id, unless a local row holds it
     SQL_INSERT_WITH_ID = f"""
-        INSERT INTO {SQLITE_TABLE_NAME} (
+        INSERT OR IGNORE INTO {SQLITE_TABLE_NAME} (
             {BaseDb.COL_ID},
             {BaseDb.COL_IMAGE_PATH},
             {BaseDb.COL_DETECTION_DATA},
             {BaseDb.COL_CREATED_AT},
-            {BaseDb.COL_SYNCED}
+            {BaseDb.COL_SYNCED},
+            {BaseDb.COL_UUID},
+            {BaseDb.COL_SOURCE}
         )
-        VALUES (?, ?, ?, ?, 1)
+        VALUES (?, ?, ?, ?, 1, ?, ?)
     """
 
     SQL_SELECT_BY_ID = f"""
@@ -112,39 +179,98 @@ class SqliteDb(BaseDb):
         LIMIT ?
     """
 
+    SQL_CREATE_INDEXES = f"""
+        CREATE INDEX IF NOT EXISTS {SQLITE_TABLE_NAME}_created_at_idx
+        ON {SQLITE_TABLE_NAME} ({BaseDb.COL_CREATED_AT});
+        CREATE INDEX IF NOT EXISTS {SQLITE_TABLE_NAME}_unsynced_idx
+        ON {SQLITE_TABLE_NAME} ({BaseDb.COL_CREATED_AT})
+        WHERE {BaseDb.COL_SYNCED}=0;
+    """
+
+    # created_at of the N-th newest row; everything older is prunable
+    SQL_PRUNE_CUTOFF = f"""
+        SELECT {BaseDb.COL_CREATED_AT}
+        FROM {SQLITE_TABLE_NAME}
+        ORDER BY {BaseDb.COL_CREATED_AT} DESC
+        LIMIT 1 OFFSET ?
+    """
+
+    # Never prunes unsynced rows, they are still waiting for Postgres
     SQL_PRUNE = f"""
         DELETE FROM {SQLITE_TABLE_NAME}
-        WHERE {BaseDb.COL_ID} NOT IN (
-            SELECT {BaseDb.COL_ID}
+        WHERE rowid IN (
+            SELECT rowid
             FROM {SQLITE_TABLE_NAME}
-            ORDER BY {BaseDb.COL_CREATED_AT} DESC
+            WHERE {BaseDb.COL_CREATED_AT} < ? AND {BaseDb.COL_SYNCED}=1
             LIMIT ?
         )
     """
 
+    SQL_PRUNE_EXPIRED = f"""
+        DELETE FROM {SQLITE_TABLE_NAME}
+        WHERE {BaseDb.COL_CREATED_AT} < ? AND {BaseDb.COL_SYNCED}=1
+        RETURNING {BaseDb.COL_ID}
+    """
+
     def __init__(
         self,
         db_path: str = settings.CACHE_DB_PATH
     ):
         self.db_path = db_path
+        self._local = threading.local()
         self._init_db()
 
-    def _get_conn(self):
-        return sqlite3.connect(self.db_path)
+    def _get_conn(self) -> sqlite3.Connection:
+        """Long-lived connection owned by the calling thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL only fsyncs at checkpoints; the cache is
+            # replayable from Postgres, so that is durable enough
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={settings.CACHE_MMAP_SIZE}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def _row_to_record(self, row: sqlite3.Row) -> dict[str, Any]:
+        record = dict(row)
+        record[self.COL_DETECTION_DATA] = json.loads(
+            record[self.COL_DETECTION_DATA]
+        )
+        return record
 
     def _init_db(self):
         with self._get_conn() as conn:
             conn.execute(self.SQL_CREATE_TABLE)
+            columns = {
+                row[1] for row in conn.execute(
+                    f"PRAGMA table_info({self.SQLITE_TABLE_NAME})"
+                )
+            }
+            if self.COL_UUID not in columns:
+                conn.execute(self.SQL_ADD_UUID_COLUMN)
+            if self.COL_SOURCE not in columns:
+                conn.execute(self.SQL_ADD_SOURCE_COLUMN)
+            conn.execute(self.SQL_BACKFILL_UUID)
+            conn.execute(self.SQL_CREATE_UUID_INDEX)
             conn.commit()
+            conn.executescript(self.SQL_CREATE_INDEXES)
 
     def insert_detection(
         self,
         image_path: str,
         detection_data: dict[str, Any],
         ts: Optional[int] = None,
-        id_override: Optional[int] = None
+        id_override: Optional[int] = None,
+        detection_uuid: Optional[str] = None,
+        source: Optional[str] = None
     ) -> int:
         ts = ts or int(time.time())
+        detection_uuid = detection_uuid or str(uuid.uuid4())
         with self._get_conn() as conn:
             cursor = conn.cursor()
             if id_override:
@@ -154,7 +280,9 @@ class SqliteDb(BaseDb):
                         id_override,
                         image_path,
                         json.dumps(detection_data),
-                        ts
+                        ts,
+                        detection_uuid,
+                        source
                     )
                 )
                 conn.commit()
@@ -165,7 +293,9 @@ class SqliteDb(BaseDb):
                     (
                         image_path,
                         json.dumps(detection_data),
-                        ts
+                        ts,
+                        detection_uuid,
+                        source
                     )
                 )
             conn.commit()
@@ -176,111 +306,606 @@ class SqliteDb(BaseDb):
         detection_id: int
     ) -> Optional[dict[str, Any]]:
         with self._get_conn() as conn:
-            conn.row_factory = sqlite3.Row
             cursor = conn.execute(
                 self.SQL_SELECT_BY_ID,
                 (detection_id,)
             )
             row = cursor.fetchone()
-            return dict(row) if row else None
+            return self._row_to_record(row) if row else None
 
-    def get_unsynced(self) -> List[dict]:
+    def get_unsynced(self, limit: int = -1) -> List[dict]:
+        """Oldest unsynced rows first; a negative limit returns all."""
         with self._get_conn() as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.execute(self.SQL_SELECT_UNSYNCED)
+            cursor = conn.execute(self.SQL_SELECT_UNSYNCED, (limit,))
             return [dict(r) for r in cursor.fetchall()]
 
-    def mark_synced(self, local_rowid: int, new_id: int):
+    def mark_synced(self, detection_uuid: str, new_id: int) -> List[int]:
+        return self.mark_synced_many([(detection_uuid, new_id)])
+
+    def mark_synced_many(self, synced: List[tuple[str, int]]) -> List[int]:
+        """Adopt the Postgres ids of (detection_uuid, new_id) pairs in one
+        transaction. Returns the ids that now name a different row, whose
+        cached records are stale."""
+        changed = []
         with self._get_conn() as conn:
-            conn.execute(self.SQL_UPDATE_SYNCED, (new_id, local_rowid))
+            for detection_uuid, new_id in synced:
+                relocated = conn.execute(
+                    self.SQL_RELOCATE_CONFLICT,
+                    (new_id, detection_uuid)
+                ).rowcount
+                deleted = conn.execute(
+                    self.SQL_DELETE_CONFLICT,
+                    (new_id, detection_uuid)
+                ).rowcount
+                if relocated or deleted:
+                    changed.append(new_id)
+                conn.execute(
+                    self.SQL_UPDATE_SYNCED,
+                    (new_id, detection_uuid)
+                )
             conn.commit()
+        return changed
 
     def get_recent(
         self,
         limit: int = 10
     ) -> List[dict[str, Any]]:
         with self._get_conn() as conn:
-            conn.row_factory = sqlite3.Row
             cursor = conn.execute(
                 self.SQL_SELECT_RECENT,
                 (limit,)
             )
-            return [dict(row) for row in cursor.fetchall()]
+            return [self._row_to_record(row) for row in cursor.fetchall()]
     
     def prune_cache(
         self,
-        max_rows: int = 100
-    ) -> None:
-        """Optional: remove oldest rows beyond max_rows"""
+        max_rows: int = settings.CACHE_MAX_ROWS,
+        batch_size: int = 1000
+    ) -> int:
+        """Remove synced rows older than the max_rows newest ones.
+
+        Deletes in batches of batch_size, committing in between, so the
+        sync thread and readers are never blocked for long."""
+        conn = self._get_conn()
+        row = conn.execute(self.SQL_PRUNE_CUTOFF, (max_rows - 1,)).fetchone()
+        if row is None:
+            return 0
+        cutoff = row[0]
+        deleted = 0
+        while True:
+            with conn:
+                count = conn.execute(
+                    self.SQL_PRUNE,
+                    (cutoff, batch_size)
+                ).rowcount
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+    def prune_expired(self, cutoff: float) -> List[int]:
+        """Remove synced rows created before `cutoff`; returns their ids."""
         with self._get_conn() as conn:
-            conn.execute(
-                self.SQL_PRUNE,
-                (max_rows,)
-            )
-            conn.commit()
-        
+            return [row[0] for row in conn.execute(self.SQL_PRUNE_EXPIRED, (cutoff,))]
+
 
 class PostgresDb(BaseDb):
-    """POstgres main DB."""
+    """POstgres main DB, accessed through a thread-safe connection pool."""
+    # Frames and their objects are range-partitioned by created_at into one
+    # partition per UTC day, so retention drops whole partitions instead of
+    # deleting rows. Keys include created_at, which partitioned tables
+    # require; ids still come from one sequence and stay unique. Rows
+    # outside every day partition land in the DEFAULT partitions.
     SQL_CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS {table}_migrations (
+        name TEXT PRIMARY KEY,
+        position BIGINT NOT NULL DEFAULT 0,
+        done BOOLEAN NOT NULL DEFAULT FALSE
+    );
+
+    CREATE SEQUENCE IF NOT EXISTS {table}_{id_col}_seq;
     CREATE TABLE IF NOT EXISTS {table} (
-        {id_col} SERIAL PRIMARY KEY,
+        {id_col} INTEGER NOT NULL DEFAULT nextval('{table}_{id_col}_seq'),
         {image_col} TEXT NOT NULL,
         {data_col} JSONB NOT NULL,
-        {ts_col} BIGINT NOT NULL
+        {ts_col} BIGINT NOT NULL,
+        {uuid_col} UUID,
+        {source_col} TEXT,
+        PRIMARY KEY ({id_col}, {ts_col})
+    ) PARTITION BY RANGE ({ts_col});
+    ALTER SEQUENCE {table}_{id_col}_seq OWNED BY {table}.{id_col};
+    CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT;
+    CREATE UNIQUE INDEX IF NOT EXISTS {table}_{uuid_col}_idx ON {table} ({uuid_col}, {ts_col});
+    CREATE INDEX IF NOT EXISTS {table}_{ts_col}_idx ON {table} ({ts_col} DESC, {id_col} DESC);
+    CREATE INDEX IF NOT EXISTS {table}_{source_col}_idx
+        ON {table} ({source_col}, {ts_col} DESC, {id_col} DESC);
+
+    -- One row per detected object, so filters run on indexed columns
+    -- instead of unpacking detection_data. created_at and source are
+    -- copied from the frame to keep class/time lookups on one index.
+    CREATE TABLE IF NOT EXISTS {objects} (
+        {id_col} BIGSERIAL,
+        detection_id INTEGER NOT NULL,
+        {ts_col} BIGINT NOT NULL,
+        {source_col} TEXT,
+        class_id SMALLINT NOT NULL,
+        class_name TEXT NOT NULL,
+        confidence REAL NOT NULL,
+        x1 REAL NOT NULL,
+        y1 REAL NOT NULL,
+        x2 REAL NOT NULL,
+        y2 REAL NOT NULL,
+        track_id TEXT,
+        PRIMARY KEY ({id_col}, {ts_col})
+    ) PARTITION BY RANGE ({ts_col});
+    CREATE TABLE IF NOT EXISTS {objects}_default PARTITION OF {objects} DEFAULT;
+    CREATE INDEX IF NOT EXISTS {objects}_detection_idx ON {objects} (detection_id, {ts_col});
+    CREATE INDEX IF NOT EXISTS {objects}_class_idx
+        ON {objects} (class_name, {ts_col} DESC, confidence);
+    """
+
+    # Moves a pre-partitioning table out of the way; its rows are copied
+    # into the partitioned one in the background. Its objects are rebuilt
+    # from detection_data by the backfill, which starts over.
+    SQL_RENAME_LEGACY = """
+    ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {uuid_col} UUID;
+    ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {source_col} TEXT;
+    DROP TABLE IF EXISTS {objects};
+    DROP INDEX IF EXISTS {table}_{uuid_col}_idx, {table}_{ts_col}_idx, {table}_{source_col}_idx;
+    ALTER TABLE {table} RENAME TO {table}_legacy;
+    ALTER TABLE {table}_legacy RENAME CONSTRAINT {table}_pkey TO {table}_legacy_pkey;
+    """
+
+    SQL_COPY_LEGACY = """
+    WITH moved AS (
+        DELETE FROM {table}_legacy WHERE {id_col} IN (
+            SELECT {id_col} FROM {table}_legacy ORDER BY {id_col} LIMIT %s
+        )
+        RETURNING {id_col}, {image_col}, {data_col}, {ts_col}, {uuid_col}, {source_col}
+    ), copied AS (
+        INSERT INTO {table} ({id_col}, {image_col}, {data_col}, {ts_col}, {uuid_col}, {source_col})
+        SELECT * FROM moved
+        ON CONFLICT DO NOTHING
+    )
+    SELECT count(*) AS moved FROM moved
+    """
+
+    SQL_SELECT_LEGACY_BY_ID = (
+        "SELECT {id_col}, {image_col}, {data_col}, {ts_col}, {uuid_col}, {source_col} "
+        "FROM {table}_legacy WHERE {id_col}=%s"
     )
+
+    SQL_CREATE_PARTITION = (
+        "CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {parent} "
+        "FOR VALUES FROM (%s) TO (%s)"
+    )
+
+    SQL_LIST_PARTITIONS = """
+    SELECT c.relname FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = %s::regclass
     """
 
-    def __init__(self, conn_str: str, table_name: str):
+    # Expired rows of a DEFAULT partition, one batch at a time
+    SQL_DELETE_EXPIRED = """
+    DELETE FROM {partition} WHERE ctid = ANY(ARRAY(
+        SELECT ctid FROM {partition} WHERE {ts_col} < %s LIMIT %s
+    ))
+    """
+
+    SQL_INSERT_OBJECTS = (
+        "INSERT INTO {objects} (detection_id, {ts_col}, {source_col}, class_id, "
+        "class_name, confidence, x1, y1, x2, y2, track_id) VALUES %s"
+    )
+
+    SQL_BACKFILL_STATE = (
+        "INSERT INTO {table}_migrations (name) VALUES (%s) ON CONFLICT DO NOTHING; "
+        "SELECT position, done FROM {table}_migrations WHERE name=%s"
+    )
+    SQL_BACKFILL_SAVE = (
+        "UPDATE {table}_migrations SET position=%s, done=%s WHERE name=%s"
+    )
+
+    # Expands detection_data of the next `limit` frames after id `position`
+    # into object rows, skipping frames that already have them
+    SQL_BACKFILL_OBJECTS = """
+    WITH batch AS (
+        SELECT {id_col}, {ts_col}, {source_col}, {data_col}
+        FROM {table}
+        WHERE {id_col} > %s
+        ORDER BY {id_col}
+        LIMIT %s
+    ), filled AS (
+        INSERT INTO {objects} (detection_id, {ts_col}, {source_col}, class_id,
+            class_name, confidence, x1, y1, x2, y2, track_id)
+        SELECT b.{id_col}, b.{ts_col}, b.{source_col},
+            (o->>'class')::smallint, o->>'name', (o->>'confidence')::real,
+            (o->'box'->>'x1')::real, (o->'box'->>'y1')::real,
+            (o->'box'->>'x2')::real, (o->'box'->>'y2')::real,
+            o->>'track_id'
+        FROM batch b
+        CROSS JOIN LATERAL jsonb_array_elements(
+            CASE WHEN jsonb_typeof(b.{data_col}) = 'array'
+                THEN b.{data_col} ELSE '[]'::jsonb END
+        ) o
+        WHERE jsonb_typeof(o) = 'object' AND o ? 'class' AND o ? 'box'
+            AND NOT EXISTS (
+                SELECT 1 FROM {objects} x
+                WHERE x.detection_id = b.{id_col} AND x.{ts_col} = b.{ts_col}
+            )
+    )
+    SELECT max({id_col}) AS last_id, count(*) AS frames FROM batch
+    """
+
+    SQL_QUERY = """
+    SELECT d.* FROM {table} d
+    WHERE {where}
+    ORDER BY d.{ts_col} DESC, d.{id_col} DESC
+    LIMIT %s
+    """
+
+    def __init__(
+        self,
+        conn_str: str,
+        table_name: str,
+        min_conn: int = settings.POSTGRES_POOL_MIN,
+        max_conn: int = settings.POSTGRES_POOL_MAX
+    ):
         self.conn_str = conn_str
         self.table = table_name
-        self._init_table()
-
-    def _get_conn(self):
-        return psycopg2.connect(
-            self.conn_str,
+        self.objects_table = f"{table_name}_objects"
+        # Whether a pre-partitioning table is still being moved over
+        self.legacy = False
+        self.pool = ThreadedConnectionPool(
+            min_conn,
+            max_conn,
+            conn_str,
             cursor_factory=RealDictCursor
         )
-    
+        # getconn raises instead of blocking once the pool is exhausted;
+        # make callers wait for a free connection instead
+        self._slots = threading.BoundedSemaphore(max_conn)
+        self._init_table()
+
+    @contextmanager
+    def _connection(self) -> Iterator[psycopg2.extensions.connection]:
+        """Borrow a pooled connection, waiting for one if all are in use;
+        commit on success, roll back on error."""
+        with self._slots:
+            conn = self.pool.getconn()
+            broken = False
+            try:
+                yield conn
+                conn.commit()
+            except Exception as e:
+                broken = isinstance(e, psycopg2.InterfaceError) or bool(conn.closed)
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                self.pool.putconn(conn, close=broken)
+
     def _init_table(self):
-        # Format the stored SQL template with the actual table/column names
-        query = self.SQL_CREATE_TABLE.format(
-            table=self.table,
-            id_col=self.COL_ID,
-            image_col=self.COL_IMAGE_PATH,
-            data_col=self.COL_DETECTION_DATA,
-            ts_col=self.COL_CREATED_AT
-        )
-        with self._get_conn() as conn:
+        with self._connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(query)
-                conn.commit()
+                # Replicas starting together migrate one at a time
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (self.table,))
+                cur.execute(
+                    "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+                    (self.table,)
+                )
+                row = cur.fetchone()
+                renamed = row is not None and row["relkind"] == "r"
+                if renamed:
+                    logger.info(f"Moving unpartitioned {self.table} to {self.table}_legacy")
+                    cur.execute(self._format_query(self.SQL_RENAME_LEGACY, self.table))
+                cur.execute(self._format_query(self.SQL_CREATE_TABLE, self.table))
+                if renamed:
+                    cur.execute(
+                        f"DELETE FROM {self.table}_migrations WHERE name = 'objects_backfill'"
+                    )
+                cur.execute("SELECT to_regclass(%s) AS legacy", (f"{self.table}_legacy",))
+                self.legacy = cur.fetchone()["legacy"] is not None
+        self.ensure_partitions()
+
+    @staticmethod
+    def _day_start(ts: float) -> int:
+        return int(ts // 86400 * 86400)
+
+    def _partition_name(self, parent: str, day_start: int) -> str:
+        return f"{parent}_p{time.strftime('%Y%m%d', time.gmtime(day_start))}"
+
+    def ensure_partitions(
+        self,
+        days_ahead: int = settings.POSTGRES_PARTITION_PREMAKE_DAYS,
+        now: Optional[float] = None
+    ) -> None:
+        """Create the day partitions from today to `days_ahead` days out."""
+        today = self._day_start(now or time.time())
+        for day in range(days_ahead + 1):
+            start = today + day * 86400
+            for parent in (self.table, self.objects_table):
+                partition = self._partition_name(parent, start)
+                try:
+                    with self._connection() as conn:
+                        with conn.cursor() as cur:
+                            cur.execute(
+                                self._format_query(
+                                    self.SQL_CREATE_PARTITION,
+                                    self.table,
+                                    partition=partition,
+                                    parent=parent
+                                ),
+                                (start, start + 86400)
+                            )
+                except psycopg2.Error as e:
+                    # e.g. the DEFAULT partition already holds rows of that day
+                    logger.warning(f"Could not create partition {partition}: {e}")
+
+    def drop_expired(
+        self,
+        cutoff: float,
+        batch_size: int = settings.RETENTION_DELETE_BATCH_SIZE
+    ) -> int:
+        """Drop day partitions that end before `cutoff` and delete older
+        rows from the DEFAULT partitions. Returns the partitions dropped."""
+        dropped = 0
+        # Objects first, so a failure never leaves objects without frames
+        for parent in (self.objects_table, self.table):
+            pattern = re.compile(rf"^{re.escape(parent)}_p(\d{{8}})$")
+            with self._connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(self.SQL_LIST_PARTITIONS, (parent,))
+                    partitions = [row["relname"] for row in cur.fetchall()]
+            for partition in partitions:
+                match = pattern.match(partition)
+                if match is None:
+                    continue
+                start = calendar.timegm(time.strptime(match.group(1), "%Y%m%d"))
+                if start + 86400 > cutoff:
+                    continue
+                with self._connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(f"DROP TABLE IF EXISTS {partition}")
+                logger.info(f"Dropped expired partition {partition}")
+                dropped += 1
+
+            default = f"{parent}_default"
+            query = self._format_query(self.SQL_DELETE_EXPIRED, self.table, partition=default)
+            while True:
+                with self._connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(query, (cutoff, batch_size))
+                        deleted = cur.rowcount
+                if deleted < batch_size:
+                    break
+        return dropped
+
+    def copy_legacy(self, batch_size: int = 1000) -> int:
+        """Move one batch of rows from the pre-partitioning table into the
+        partitioned one; drops the old table with the last batch. Returns
+        the rows moved, 0 when there is nothing left to do."""
+        if not self.legacy:
+            return 0
+        try:
+            with self._connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        self._format_query(self.SQL_COPY_LEGACY, self.table),
+                        (batch_size,)
+                    )
+                    moved = cur.fetchone()["moved"]
+                    if moved < batch_size:
+                        # A replica moving rows concurrently may leave some
+                        cur.execute(
+                            f"SELECT EXISTS (SELECT 1 FROM {self.table}_legacy) AS remaining"
+                        )
+                        if not cur.fetchone()["remaining"]:
+                            cur.execute(f"DROP TABLE {self.table}_legacy")
+                            logger.info(f"Finished moving {self.table}_legacy")
+                            self.legacy = False
+        except UndefinedTable:
+            # Another replica finished the move
+            self.legacy = False
+            moved = 0
+        return moved
+
+    def _row_to_record(self, row: dict) -> dict[str, Any]:
+        # JSONB columns are already decoded by psycopg2
+        return {
+            self.COL_ID: row[self.COL_ID],
+            self.COL_IMAGE_PATH: row[self.COL_IMAGE_PATH],
+            self.COL_DETECTION_DATA: row[self.COL_DETECTION_DATA],
+            self.COL_CREATED_AT: row[self.COL_CREATED_AT],
+            self.COL_UUID: row[self.COL_UUID] and str(row[self.COL_UUID]),
+            self.COL_SOURCE: row.get(self.COL_SOURCE)
+        }
+
+    @staticmethod
+    def _object_rows(
+        detection_id: int,
+        ts: int,
+        source: Optional[str],
+        detection_data: Any
+    ) -> List[tuple]:
+        """Index rows for the per-object records of one frame."""
+        if not isinstance(detection_data, list):
+            return []
+        rows = []
+        for obj in detection_data:
+            if not isinstance(obj, dict) or "class" not in obj or "box" not in obj:
+                continue
+            box = obj["box"]
+            rows.append((
+                detection_id,
+                ts,
+                source,
+                obj["class"],
+                obj.get("name", str(obj["class"])),
+                obj.get("confidence", 0.0),
+                box["x1"],
+                box["y1"],
+                box["x2"],
+                box["y2"],
+                obj.get("track_id")
+            ))
+        return rows
 
     def insert_detection(
         self,
         image_path: str,
         detection_data: dict,
-        ts: Optional[int] = None
+        ts: Optional[int] = None,
+        detection_uuid: Optional[str] = None,
+        source: Optional[str] = None
     ) -> int:
-        ts = ts or int(time.time())
+        detection_uuid = detection_uuid or str(uuid.uuid4())
+        return self.insert_many(
+            [(detection_uuid, image_path, detection_data, ts, source)]
+        )[0]
+
+    def insert_many(
+        self,
+        rows: List[tuple[str, str, Any, Optional[int], Optional[str]]]
+    ) -> List[int]:
+        """Upsert (detection_uuid, image_path, detection_data, ts, source)
+        rows with a single multi-row INSERT; ids are returned in row order.
+
+        Newly inserted frames get their object rows in the same
+        transaction, replayed ones already have them."""
+        now = int(time.time())
         query = self._format_query(
-            self.SQL_INSERT,
+            self.SQL_UPSERT_MANY,
             self.table
         )
-        logger.info(f"Query: {query} \ndata: ({image_path}, detection type: ({type(detection_data)}), {ts})")
-        with self._get_conn() as conn:
+        # ON CONFLICT DO UPDATE may touch each row only once per statement
+        unique = {
+            str(uuid.UUID(detection_uuid)): (
+                detection_uuid,
+                image_path,
+                detection_data,
+                ts or now,
+                source
+            )
+            for detection_uuid, image_path, detection_data, ts, source in rows
+        }
+        values = [
+            (detection_uuid, image_path, Json(detection_data), ts, source)
+            for detection_uuid, image_path, detection_data, ts, source
+            in unique.values()
+        ]
+        with self._connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(
+                returned = execute_values(
+                    cur,
                     query,
-                    (
-                        image_path,
-                        psycopg2.extras.Json(detection_data),
-                        ts
+                    values,
+                    template="(%s::uuid, %s, %s, %s, %s)",
+                    page_size=len(values),
+                    fetch=True
+                )
+                objects = []
+                for row in returned:
+                    if not row["inserted"]:
+                        continue
+                    _, _, detection_data, ts, source = unique[str(row[self.COL_UUID])]
+                    objects.extend(self._object_rows(
+                        row[self.COL_ID], ts, source, detection_data
+                    ))
+                if objects:
+                    execute_values(
+                        cur,
+                        self._format_query(self.SQL_INSERT_OBJECTS, self.table),
+                        objects,
+                        page_size=1000
                     )
+        logger.debug(f"Upserted {len(returned)} detection(s) into {self.table}")
+        ids = {str(row[self.COL_UUID]): row[self.COL_ID] for row in returned}
+        return [ids[str(uuid.UUID(row[0]))] for row in rows]
+
+    def backfill_objects(self, batch_size: int = 1000) -> int:
+        """Index the objects of frames stored before the objects table
+        existed, one batch per transaction. Returns the number of frames
+        scanned; 0 once the backfill is complete."""
+        name = "objects_backfill"
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    self._format_query(self.SQL_BACKFILL_STATE, self.table),
+                    (name, name)
                 )
-                inserted_id = cur.fetchone()[self.COL_ID]
-                conn.commit()
-                return inserted_id
+                state = cur.fetchone()
+                if state["done"]:
+                    return 0
+                cur.execute(
+                    self._format_query(self.SQL_BACKFILL_OBJECTS, self.table),
+                    (state["position"], batch_size)
+                )
+                batch = cur.fetchone()
+                done = batch["frames"] < batch_size
+                cur.execute(
+                    self._format_query(self.SQL_BACKFILL_SAVE, self.table),
+                    (batch["last_id"] or state["position"], done, name)
+                )
+                return batch["frames"]
+
+    def query_detections(
+        self,
+        class_name: Optional[str] = None,
+        min_confidence: Optional[float] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        source: Optional[str] = None,
+        before: Optional[tuple[int, int]] = None,
+        limit: int = 50
+    ) -> List[dict[str, Any]]:
+        """Frames matching every given filter, newest first.
+
+        `before` is the (created_at, id) of the last frame of the previous
+        page; paging on it keeps every page an index range scan. The class
+        and confidence filters match frames with at least one such object."""
+        clauses, params = ["TRUE"], []
+        if source is not None:
+            clauses.append(f"d.{self.COL_SOURCE} = %s")
+            params.append(source)
+        if since is not None:
+            clauses.append(f"d.{self.COL_CREATED_AT} >= %s")
+            params.append(since)
+        if until is not None:
+            clauses.append(f"d.{self.COL_CREATED_AT} < %s")
+            params.append(until)
+        if before is not None:
+            clauses.append(f"(d.{self.COL_CREATED_AT}, d.{self.COL_ID}) < (%s, %s)")
+            params.extend(before)
+        if class_name is not None or min_confidence is not None:
+            # Repeating the time bounds lets the class index narrow the scan
+            object_clauses = [
+                f"o.detection_id = d.{self.COL_ID}",
+                f"o.{self.COL_CREATED_AT} = d.{self.COL_CREATED_AT}"
+            ]
+            if class_name is not None:
+                object_clauses.append("o.class_name = %s")
+                params.append(class_name)
+            if min_confidence is not None:
+                object_clauses.append("o.confidence >= %s")
+                params.append(min_confidence)
+            if since is not None:
+                object_clauses.append(f"o.{self.COL_CREATED_AT} >= %s")
+                params.append(since)
+            if until is not None:
+                object_clauses.append(f"o.{self.COL_CREATED_AT} < %s")
+                params.append(until)
+            clauses.append(
+                f"EXISTS (SELECT 1 FROM {self.objects_table} o "
+                f"WHERE {' AND '.join(object_clauses)})"
+            )
+        query = self._format_query(
+            self.SQL_QUERY.replace("{where}", " AND ".join(clauses)),
+            self.table
+        )
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, (*params, limit))
+                return [self._row_to_record(row) for row in cur.fetchall()]
 
     def get_detection_by_id(
         self,
@@ -290,45 +915,108 @@ class PostgresDb(BaseDb):
             self.SQL_SELECT_BY_ID,
             self.table
         )
-        with self._get_conn() as conn:
+        with self._connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(query, (detection_id,))
                 row = cur.fetchone()
-                if row:
-                    return {
-                        self.COL_ID: row[0],
-                        self.COL_IMAGE_PATH: row[1],
-                        self.COL_DETECTION_DATA: json.loads(
-                            row[2]
-                        ),
-                        self.COL_CREATED_AT: row[3]
-                    }
-                return None
+        if row is None and self.legacy:
+            # Not moved to the partitioned table yet
+            try:
+                with self._connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            self._format_query(self.SQL_SELECT_LEGACY_BY_ID, self.table),
+                            (detection_id,)
+                        )
+                        row = cur.fetchone()
+            except UndefinedTable:
+                self.legacy = False
+        return self._row_to_record(row) if row else None
 
     def get_recent(self, limit: int = 100) -> List[dict[str, Any]]:
         query = self._format_query(
             self.SQL_SELECT_RECENT,
             self.table
         )
-        with self._get_conn() as conn:
+        with self._connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(query, (limit,))
-                rows = cur.fetchall()
-                return [
-                    {
-                        self.COL_ID: row[0],
-                        self.COL_IMAGE_PATH: row[1],
-                        self.COL_DETECTION_DATA: json.loads(
-                            row[2]
-                        ),
-                        self.COL_CREATED_AT: row[3]
-                    }
-                    for row in rows
-                ]
-            
+                return [self._row_to_record(row) for row in cur.fetchall()]
+
+
+class GroupCommitter:
+    """
+    Merges inserts that arrive within `window` seconds of each other into
+    one multi-row INSERT ... RETURNING, then hands every caller its own id.
+    """
+
+    def __init__(
+        self,
+        main_db: PostgresDb,
+        run: Callable[..., Any],
+        window: float,
+        max_batch: int
+    ):
+        self.main_db = main_db
+        self._run = run
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: list[tuple[tuple, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def insert_detection(
+        self,
+        image_path: str,
+        detection_data: Any,
+        ts: Optional[int] = None,
+        detection_uuid: Optional[str] = None,
+        source: Optional[str] = None
+    ) -> int:
+        detection_uuid = detection_uuid or str(uuid.uuid4())
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(
+            ((detection_uuid, image_path, detection_data, ts, source), future)
+        )
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._commit(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _commit(self, batch: list[tuple[tuple, asyncio.Future]]) -> None:
+        try:
+            ids = await self._run(
+                self.main_db.insert_many,
+                [row for row, _ in batch]
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), pg_id in zip(batch, ids):
+            if not future.done():
+                future.set_result(pg_id)
+
 
 class DetectionDb:
-    """High-level interface combining Postgres + SQLite cache with offline handling."""
+    """High-level interface combining Postgres + SQLite cache with offline handling.
+
+    The public methods are coroutines; database work runs on a thread pool
+    sized to the Postgres connection pool.
+    """
 
     def __init__(
         self,
@@ -338,96 +1026,271 @@ class DetectionDb:
         self.cache = SqliteDb(sqlite_path)
         self.main_db = PostgresDb(
             postgres_dsn,
-            table_name=settings.POSTGRES_TABLE_NAME
+            table_name=settings.POSTGRES_TABLE_NAME,
+            # One connection per executor thread plus one each for the sync
+            # and migration threads
+            max_conn=settings.POSTGRES_POOL_MAX + 2
         )
-        self.cache.prune_cache(max_rows=100)
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.POSTGRES_POOL_MAX,
+            thread_name_prefix="db"
+        )
+        self.group_commit: Optional[GroupCommitter] = None
+        if settings.POSTGRES_GROUP_COMMIT:
+            self.group_commit = GroupCommitter(
+                self.main_db,
+                self._run,
+                window=settings.POSTGRES_GROUP_COMMIT_WINDOW_MS / 1000,
+                max_batch=settings.POSTGRES_GROUP_COMMIT_MAX_BATCH
+            )
+        self.record_cache = DetectionCache()
+        # Rows created before this are gone; older cached records are stale
+        self.expired_before = 0.0
+        self.analytics = Aggregator()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.cache.prune_cache()
         self._start_sync_thread()
 
-    def insert_detection(
+    async def _run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        # Remembered so the sync thread can schedule cache invalidation
+        self._loop = loop
+        return await loop.run_in_executor(
+            self._executor,
+            lambda: func(*args, **kwargs)
+        )
+
+    async def insert_detection(
         self,
         image_path: str,
-        detection_data: dict[str, Any]
+        detection_data: dict[str, Any],
+        source: Optional[str] = None,
+        image_size: Optional[tuple[int, int]] = None
     ) -> int:
-        """Insert into both cache and main DB."""
-        ts: datetime = int(time.time())
-        local_id = self.cache.insert_detection(
+        """Insert into both cache and main DB.
+
+        image_size is the (height, width) the boxes refer to; it only
+        feeds the analytics heatmaps."""
+        ts: int = int(time.time())
+        detection_uuid = str(uuid.uuid4())
+        local_id = await self._run(
+            self.cache.insert_detection,
             image_path,
             detection_data,
-            ts
+            ts,
+            detection_uuid=detection_uuid,
+            source=source
         )
+        self.analytics.record(detection_data, ts, source, image_size)
         try:
-            pg_id = self.main_db.insert_detection(
-                image_path,
-                detection_data,
-                ts
-            )
-            self.cache.mark_synced(
-                local_id,
+            if self.group_commit is not None:
+                pg_id = await self.group_commit.insert_detection(
+                    image_path,
+                    detection_data,
+                    ts,
+                    detection_uuid=detection_uuid,
+                    source=source
+                )
+            else:
+                pg_id = await self._run(
+                    self.main_db.insert_detection,
+                    image_path,
+                    detection_data,
+                    ts,
+                    detection_uuid=detection_uuid,
+                    source=source
+                )
+            changed = await self._run(
+                self.cache.mark_synced,
+                detection_uuid,
                 pg_id
             )
+            for detection_id in changed:
+                await self.record_cache.invalidate_record(detection_id)
             return pg_id
         except Exception as e:
             logger.warning(
                 f"Postgres insert failed: {e}, keeping local cache ID {local_id}"
             )
             return local_id
+        finally:
+            await self.record_cache.invalidate_recent()
 
-    def get_detection_by_id(
+    async def get_detection_by_id(
         self,
         detection_id: int
     ) -> Optional[dict[str, Any]]:
-        """Try cache first, then main DB."""
-        cached = self.cache.get_detection_by_id(detection_id)
-        if cached:
-            return cached
-        record = self.main_db.get_detection_by_id(detection_id)
+        """Try the record cache, then SQLite, then the main DB."""
+        record = await self.record_cache.get_record(detection_id)
+        if record and record[BaseDb.COL_CREATED_AT] < self.expired_before:
+            # Expired by retention on the main DB; no id list exists for those
+            await self.record_cache.invalidate_record(detection_id)
+            return None
         if record:
-            self.cache.insert_detection(
+            return record
+        record = await self._run(self.cache.get_detection_by_id, detection_id)
+        if record:
+            await self.record_cache.put_record(record)
+            return record
+        record = await self._run(self.main_db.get_detection_by_id, detection_id)
+        if record:
+            # Keep the Postgres id so the next lookup hits SQLite
+            await self._run(
+                self.cache.insert_detection,
                 record[BaseDb.COL_IMAGE_PATH],
                 record[BaseDb.COL_DETECTION_DATA],
                 record[BaseDb.COL_CREATED_AT],
+                id_override=record[BaseDb.COL_ID],
+                detection_uuid=record[BaseDb.COL_UUID],
+                source=record[BaseDb.COL_SOURCE]
             )
+            await self.record_cache.put_record(record)
         return record
 
-    def get_recent(self, limit: int = 10) -> List[dict]:
-        return self.cache.get_recent(limit)
+    async def get_recent(self, limit: int = 10) -> List[dict]:
+        records = await self.record_cache.get_recent(limit)
+        if records is None:
+            records = await self._run(self.cache.get_recent, limit)
+            await self.record_cache.put_recent(limit, records)
+        return records
+
+    async def query(
+        self,
+        class_name: Optional[str] = None,
+        min_confidence: Optional[float] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        source: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 50
+    ) -> tuple[List[dict[str, Any]], Optional[str]]:
+        """Filtered detections from the main DB plus the cursor of the
+        next page (None on the last one). Raises ValueError for a bad cursor."""
+        records = await self._run(
+            self.main_db.query_detections,
+            class_name=class_name,
+            min_confidence=min_confidence,
+            since=since,
+            until=until,
+            source=source,
+            before=decode_cursor(cursor) if cursor else None,
+            limit=limit
+        )
+        next_cursor = None
+        if len(records) == limit:
+            last = records[-1]
+            next_cursor = encode_cursor(last[BaseDb.COL_CREATED_AT], last[BaseDb.COL_ID])
+        return records, next_cursor
+
+    async def expire(self, cutoff: float) -> int:
+        """Apply retention: drop expired partitions and cached rows, and
+        create the coming days' partitions. Returns partitions dropped."""
+        self.expired_before = max(self.expired_before, cutoff)
+        dropped = await self._run(self.main_db.drop_expired, cutoff)
+        pruned = await self._run(self.cache.prune_expired, cutoff)
+        for detection_id in pruned:
+            await self.record_cache.invalidate_record(detection_id)
+        await self.ensure_partitions()
+        await self.record_cache.invalidate_recent()
+        return dropped
+
+    async def ensure_partitions(self) -> None:
+        await self._run(self.main_db.ensure_partitions)
     
+    def _sync_batch(self, rows: List[dict]) -> None:
+        """Upsert a chunk of cache rows and mark them synced together."""
+        pg_ids = self.main_db.insert_many([
+            (
+                row[BaseDb.COL_UUID],
+                row[BaseDb.COL_IMAGE_PATH],
+                json.loads(row[BaseDb.COL_DETECTION_DATA]),
+                row[BaseDb.COL_CREATED_AT],
+                row[BaseDb.COL_SOURCE]
+            )
+            for row in rows
+        ])
+        changed = self.cache.mark_synced_many([
+            (row[BaseDb.COL_UUID], pg_id)
+            for row, pg_id in zip(rows, pg_ids)
+        ])
+        # Ids in cached recent-lists just changed from local to Postgres
+        # ones, and records cached under a taken-over id are stale
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(
+                self._invalidate(changed),
+                self._loop
+            )
+
+    async def _invalidate(self, detection_ids: List[int]) -> None:
+        for detection_id in detection_ids:
+            await self.record_cache.invalidate_record(detection_id)
+        await self.record_cache.invalidate_recent()
+
     def _sync_unsynced(self):
-        """Background thread to push unsynced cache rows to Postgres."""
+        """Background thread to push unsynced cache rows to Postgres.
+
+        Rows go up in chunks of SYNC_BATCH_SIZE; a full chunk is followed
+        immediately by the next one so a backlog drains without waiting.
+        """
         delay = 5
         while True:
-            unsynced = self.cache.get_unsynced()
             synced_any = False
-            for row in unsynced:
+            while True:
+                rows = self.cache.get_unsynced(limit=settings.SYNC_BATCH_SIZE)
+                if not rows:
+                    break
                 try:
-                    pg_id = self.main_db.insert_detection(
-                        image_path=row[BaseDb.COL_IMAGE_PATH],
-                        detection_data=json.loads(row[BaseDb.COL_DETECTION_DATA]),
-                        ts=row[BaseDb.COL_CREATED_AT]
-                    )
-                    self.cache.mark_synced(row['id'], pg_id)
-                    logger.info(
-                        f"Synced local row {row['id']} -> Postgres ID {pg_id}"
-                    )
-                    synced_any = True
-                    delay = 5
+                    self._sync_batch(rows)
                 except Exception as e:
                     logger.warning(
-                        f"Failed to sync local row {row['id']} to Postgres: {e}"
+                        f"Failed to sync {len(rows)} local row(s) to Postgres: {e}"
                     )
                     delay = min(delay * 2, 300)
                     break
+                logger.info(f"Synced {len(rows)} local row(s) to Postgres")
+                synced_any = True
+                delay = 5
+                if len(rows) < settings.SYNC_BATCH_SIZE:
+                    break
             if synced_any:
                 try:
-                    self.cache.prune_cache(max_rows=100)
+                    pruned = self.cache.prune_cache()
                     logger.debug(
-                        "Cache pruned to keep only 100 most recent rows."
+                        f"Cache pruned {pruned} row(s) beyond the "
+                        f"{settings.CACHE_MAX_ROWS} most recent."
                     )
                 except Exception as e:
                     logger.warning(
                         f"Cache pruning failed: {e}"
                     )
             time.sleep(delay)
+
+    def _run_until_done(self, step: Callable[[int], int], what: str) -> None:
+        """Call `step(batch_size)` until it handles a partial batch,
+        backing off on errors."""
+        delay = 5
+        total = 0
+        while True:
+            try:
+                count = step(settings.OBJECT_BACKFILL_BATCH_SIZE)
+            except Exception as e:
+                logger.warning(f"{what} failed: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 300)
+                continue
+            total += count
+            delay = 5
+            if count < settings.OBJECT_BACKFILL_BATCH_SIZE:
+                if total:
+                    logger.info(f"{what} done, {total} row(s)")
+                return
+
+    def _migrate(self):
+        """Background thread moving rows out of a pre-partitioning table,
+        then indexing objects of frames stored before the objects table
+        existed; exits once both have caught up."""
+        self._run_until_done(self.main_db.copy_legacy, "Moving legacy detections")
+        self._run_until_done(self.main_db.backfill_objects, "Object index backfill")
     
     def _start_sync_thread(self):
         t = threading.Thread(
@@ -435,6 +1298,26 @@ class DetectionDb:
             daemon=True
         )
         t.start()
+        threading.Thread(
+            target=self._migrate,
+            daemon=True
+        ).start()
+        self.analytics.start()
+
+
+def encode_cursor(created_at: int, detection_id: int) -> str:
+    """Opaque keyset cursor pointing just past a detection."""
+    raw = f"{created_at}:{detection_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[int, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, detection_id = raw.decode().split(":")
+        return int(created_at), int(detection_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
 
 
 def init_db_with_retry(
@@ -455,4 +1338,4 @@ def init_db_with_retry(
             time.sleep(delay)
     raise RuntimeError("Failed to connect to Postgres after retries")
 
-db: DetectionDb = init_db_with_retry()
\ No newline at end of file
+db: DetectionDb = init_db_with_retry()
@@ -0,0 +1,171 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Optional, List
+import json
+import threading
+
+from src.config import settings
+from src.util import logger
+from shared_config.redis_client import redis_client
+
+
+class LRUCache:
+    """In-process LRU bounded by entry count and by total size in bytes."""
+
+    def __init__(self, max_entries: int, max_bytes: int) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, value: Any, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while (
+                len(self._entries) > self.max_entries
+                or self._bytes > self.max_bytes
+            ):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+
+class DetectionCache:
+    """
+    Read-through cache for detection records and recent-lists.
+
+    Tier 1 is a per-process LRU, tier 2 an optional Redis tier shared by
+    all API replicas. Recent-lists are keyed by a generation counter that
+    is bumped on every insert and sync, which invalidates them everywhere
+    at once. Records are only cached once they carry their final Postgres
+    id, so they never go stale by being re-numbered.
+    """
+    NAME = "DETECTION_CACHE"
+
+    RECORD_KEY = "detection_cache:record:{id}"
+    RECENT_KEY = "detection_cache:recent:{gen}:{limit}"
+    RECENT_GEN_KEY = "detection_cache:recent:gen"
+
+    def __init__(
+        self,
+        max_entries: int = settings.DETECTION_CACHE_MAX_ENTRIES,
+        max_bytes: int = settings.DETECTION_CACHE_MAX_BYTES,
+        use_redis: bool = settings.DETECTION_CACHE_REDIS,
+        ttl: int = settings.DETECTION_CACHE_TTL
+    ) -> None:
+        self.local = LRUCache(max_entries, max_bytes)
+        self.use_redis = use_redis
+        self.ttl = ttl
+        self._local_gen = 0
+
+    async def _recent_gen(self) -> int:
+        if not self.use_redis:
+            return self._local_gen
+        try:
+            return int(await redis_client.get(self.RECENT_GEN_KEY) or 0)
+        except Exception as e:
+            logger.warning(f"[{self.NAME}]: Redis unavailable: {e}")
+            return -1
+
+    async def get_record(self, detection_id: int) -> Optional[dict[str, Any]]:
+        key = self.RECORD_KEY.format(id=detection_id)
+        record = self.local.get(key)
+        if record is not None or not self.use_redis:
+            return record
+        try:
+            raw = await redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"[{self.NAME}]: Redis unavailable: {e}")
+            return None
+        if raw is None:
+            return None
+        record = json.loads(raw)
+        self.local.put(key, record, len(raw))
+        return record
+
+    async def put_record(self, record: dict[str, Any]) -> None:
+        if not record.get("synced", 1):
+            # Local ids change once the row reaches Postgres
+            return
+        key = self.RECORD_KEY.format(id=record["id"])
+        raw = json.dumps(record)
+        self.local.put(key, record, len(raw))
+        if self.use_redis:
+            try:
+                await redis_client.set(key, raw, ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"[{self.NAME}]: Redis unavailable: {e}")
+
+    async def invalidate_record(self, detection_id: int) -> None:
+        key = self.RECORD_KEY.format(id=detection_id)
+        self.local.invalidate(key)
+        if self.use_redis:
+            try:
+                await redis_client.delete(key)
+            except Exception as e:
+                logger.warning(f"[{self.NAME}]: Redis unavailable: {e}")
+
+    async def get_recent(self, limit: int) -> Optional[List[dict[str, Any]]]:
+        gen = await self._recent_gen()
+        if gen < 0:
+            return None
+        key = self.RECENT_KEY.format(gen=gen, limit=limit)
+        records = self.local.get(key)
+        if records is not None or not self.use_redis:
+            return records
+        try:
+            raw = await redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"[{self.NAME}]: Redis unavailable: {e}")
+            return None
+        if raw is None:
+            return None
+        records = json.loads(raw)
+        self.local.put(key, records, len(raw))
+        return records
+
+    async def put_recent(
+        self,
+        limit: int,
+        records: List[dict[str, Any]]
+    ) -> None:
+        gen = await self._recent_gen()
+        if gen < 0:
+            return
+        key = self.RECENT_KEY.format(gen=gen, limit=limit)
+        raw = json.dumps(records)
+        self.local.put(key, records, len(raw))
+        if self.use_redis:
+            try:
+                await redis_client.set(key, raw, ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"[{self.NAME}]: Redis unavailable: {e}")
+
+    async def invalidate_recent(self) -> None:
+        """Orphan every cached recent-list; old generations expire by TTL."""
+        self._local_gen += 1
+        if self.use_redis:
+            try:
+                await redis_client.incr(self.RECENT_GEN_KEY)
+            except Exception as e:
+                logger.warning(f"[{self.NAME}]: Redis unavailable: {e}")
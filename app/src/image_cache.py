@@ -0,0 +1,331 @@
+from __future__ import annotations
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, Optional
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+
+from src.config import settings
+from src.util import logger
+from src.metrics import CACHE_LOOKUPS
+from src.image_storage import (
+    ImageObject,
+    ImageStat,
+    ImageStorage,
+    key_day,
+    minio_storage,
+    read_file_chunks
+)
+
+
+class RangeNotSatisfiable(ValueError):
+    """Raised for a Range header that selects no bytes of the image."""
+
+
+def parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    Resolve a single `bytes=` range against an object of `size` bytes.
+
+    Returns the inclusive (start, end) pair, or None when the header should
+    be ignored and the whole image served (other units, multiple ranges,
+    malformed values).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable(header)
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start > end:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag."""
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+class PinnedChunks:
+    """
+    Chunks of a cached image that hold the entry's pin.
+
+    The pin is released when the stream ends, when it is closed, or when
+    it is garbage collected; unlike an async generator's finally, closing
+    or dropping it releases the pin even if it was never iterated.
+    """
+
+    def __init__(
+        self,
+        cache: DiskImageCache,
+        key: str,
+        chunks: AsyncIterator[bytes]
+    ) -> None:
+        self.cache = cache
+        self.key = key
+        self.chunks = chunks
+        self._pinned = True
+
+    def __aiter__(self) -> PinnedChunks:
+        return self
+
+    async def __anext__(self) -> bytes:
+        try:
+            return await self.chunks.__anext__()
+        except BaseException:
+            self.release()
+            raise
+
+    async def aclose(self) -> None:
+        self.release()
+        await self.chunks.aclose()
+
+    def release(self) -> None:
+        if self._pinned:
+            self._pinned = False
+            self.cache._unpin(self.key)
+
+    def __del__(self) -> None:
+        self.release()
+
+
+class DiskImageCache:
+    """
+    Size-bounded on-disk LRU of recently served images.
+
+    Each entry is a `<hash>.img` file plus a `<hash>.json` sidecar holding
+    the storage key and ETag, so the index can be rebuilt from the directory
+    after a restart. Files are only published once they have been written
+    completely; a half-streamed image never becomes visible.
+
+    Entries being streamed to a client are pinned. Evicting or purging a
+    pinned entry drops it from the index at once, but its files are only
+    unlinked when the last reader finishes, and a fill never replaces a
+    file while it is being read.
+    """
+    NAME = "IMAGE_CACHE"
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, ImageStat] = OrderedDict()
+        self._bytes = 0
+        # Open readers per key, and removed keys waiting for them to finish
+        self._readers: dict[str, int] = {}
+        self._doomed: set[str] = set()
+        if self.enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str, suffix: str) -> Path:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.directory / f"{digest}{suffix}"
+
+    def _load_index(self) -> None:
+        found = []
+        for meta_path in self.directory.glob("*.json"):
+            data_path = meta_path.with_suffix(".img")
+            try:
+                meta = json.loads(meta_path.read_text())
+                st = data_path.stat()
+            except (OSError, ValueError):
+                meta_path.unlink(missing_ok=True)
+                data_path.unlink(missing_ok=True)
+                continue
+            found.append((st.st_atime, meta["key"], ImageStat(st.st_size, meta["etag"])))
+        for _, key, stat in sorted(found):
+            self._entries[key] = stat
+            self._bytes += stat.size
+        for tmp_path in self.directory.glob("*.tmp"):
+            tmp_path.unlink(missing_ok=True)
+        self._evict()
+        logger.info(
+            f"[{self.NAME}]: Loaded {len(self._entries)} cached images "
+            f"({self._bytes} bytes)"
+        )
+
+    def _remove(self, key: str) -> None:
+        stat = self._entries.pop(key)
+        self._bytes -= stat.size
+        if key in self._readers:
+            self._doomed.add(key)
+        else:
+            self._unlink(key)
+
+    def _unlink(self, key: str) -> None:
+        self._path(key, ".img").unlink(missing_ok=True)
+        self._path(key, ".json").unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def purge_expired(self, cutoff: float) -> int:
+        """Drop cached images of days that ended by `cutoff`, as retention
+        removed them from storage. Undated keys predate day prefixes and
+        their age is unknown, so they are dropped as well."""
+        expired = [
+            key for key in self._entries
+            if (day := key_day(key)) is None or day + 86400 <= cutoff
+        ]
+        for key in expired:
+            self._remove(key)
+        return len(expired)
+
+    def lookup(self, key: str) -> Optional[ImageStat]:
+        stat = self._entries.get(key)
+        if stat is not None:
+            self._entries.move_to_end(key)
+        return stat
+
+    def open(self, key: str, start: int, end: int) -> ImageObject:
+        stat = self._entries[key]
+        # Pinned now rather than when streaming starts, so the entry cannot
+        # be evicted between the lookup and the first read
+        self._readers[key] = self._readers.get(key, 0) + 1
+        return ImageObject(
+            size=stat.size,
+            etag=stat.etag,
+            start=start,
+            end=end,
+            chunks=PinnedChunks(
+                self,
+                key,
+                read_file_chunks(self._path(key, ".img"), start, end)
+            )
+        )
+
+    def _unpin(self, key: str) -> None:
+        self._readers[key] -= 1
+        if not self._readers[key]:
+            del self._readers[key]
+            if key in self._doomed:
+                self._doomed.discard(key)
+                self._unlink(key)
+
+    async def fill(
+        self,
+        key: str,
+        etag: str,
+        size: int,
+        chunks: AsyncIterator[bytes]
+    ) -> AsyncIterator[bytes]:
+        """Relay a full image to the client while writing it to the cache."""
+        # Unique per fill, concurrent misses on one key must not share a file
+        tmp_path = self._path(key, f".{uuid.uuid4().hex}.tmp")
+        out = await asyncio.to_thread(open, tmp_path, "wb")
+        written = 0
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(out.write, chunk)
+                written += len(chunk)
+                yield chunk
+        except BaseException:
+            out.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+        out.close()
+        if written != size or size > self.max_bytes or key in self._readers:
+            # A pinned entry's file is still being read; keep it as it is
+            tmp_path.unlink(missing_ok=True)
+            return
+        await asyncio.to_thread(self._publish, key, etag, tmp_path)
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size
+        self._entries[key] = ImageStat(written, etag)
+        self._bytes += written
+        self._evict()
+
+    def _publish(self, key: str, etag: str, tmp_path: Path) -> None:
+        self._path(key, ".json").write_text(json.dumps({"key": key, "etag": etag}))
+        os.replace(tmp_path, self._path(key, ".img"))
+
+
+class CachedImageStore:
+    """Serves images from the disk cache, falling back to the storage backend."""
+
+    def __init__(self, storage: ImageStorage, cache: DiskImageCache) -> None:
+        self.storage = storage
+        # Only remote backends are worth mirroring to local disk
+        self.cache = cache if cache.enabled and storage.REMOTE else None
+
+    async def delete_expired(self, cutoff: float) -> int:
+        """Apply retention to the backend and to the disk cache."""
+        deleted = await self.storage.delete_expired(cutoff)
+        if self.cache is not None:
+            purged = self.cache.purge_expired(cutoff)
+            if purged:
+                logger.info(f"[{DiskImageCache.NAME}]: Purged {purged} expired image(s)")
+        return deleted
+
+    async def stat(self, key: str) -> Optional[ImageStat]:
+        if self.cache is not None:
+            stat = self.cache.lookup(key)
+            if stat is not None:
+                return stat
+        return await self.storage.stat_image(key)
+
+    async def open(
+        self,
+        key: str,
+        start: int = 0,
+        end: Optional[int] = None
+    ) -> Optional[ImageObject]:
+        if self.cache is not None:
+            stat = self.cache.lookup(key)
+            if stat is not None:
+                CACHE_LOOKUPS.labels("image", "hit").inc()
+                end = stat.size - 1 if end is None else end
+                return self.cache.open(key, start, end)
+            CACHE_LOOKUPS.labels("image", "miss").inc()
+
+        image = await self.storage.open_image(key, start, end)
+        if (
+            image is not None
+            and self.cache is not None
+            and image.start == 0
+            and image.end == image.size - 1
+        ):
+            image.chunks = self.cache.fill(
+                key,
+                image.etag,
+                image.size,
+                image.chunks
+            )
+        return image
+
+
+image_store: CachedImageStore = CachedImageStore(
+    storage=minio_storage,
+    cache=DiskImageCache(
+        directory=settings.IMAGE_CACHE_DIR,
+        max_bytes=settings.IMAGE_CACHE_MAX_BYTES
+    )
+)
@@ -1,45 +1,169 @@
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import BinaryIO
+from itertools import islice
+from typing import AsyncIterator, BinaryIO, Iterator, Optional
+import asyncio
+import calendar
 import shutil
 import os
+import time
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError, ClientError
 from io import BytesIO
 from src.util import logger
 from src.config import settings
 
+
+DAY_FORMAT = "%Y-%m-%d"
+
+
+def dated_key(filename: str, ts: Optional[float] = None) -> str:
+    """Storage key of an image saved at `ts` (now by default): the
+    filename under its UTC day, so retention removes whole days without
+    listing the rest of the store."""
+    return f"{time.strftime(DAY_FORMAT, time.gmtime(ts))}/{filename}"
+
+
+def key_day(key: str) -> Optional[int]:
+    """Start of the UTC day a dated key was saved on; None for keys
+    saved before images were filed by day."""
+    day, sep, _ = key.partition("/")
+    if not sep:
+        return None
+    try:
+        return calendar.timegm(time.strptime(day, DAY_FORMAT))
+    except ValueError:
+        return None
+
+
+@dataclass
+class ImageStat:
+    size: int
+    etag: str
+
+
+@dataclass
+class ImageObject:
+    """An opened image: bytes start..end (inclusive) of a size-byte object."""
+    size: int
+    etag: str
+    start: int
+    end: int
+    chunks: AsyncIterator[bytes]
+
+    async def close(self) -> None:
+        """Release the stream, whether or not it was read."""
+        aclose = getattr(self.chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
 class ImageStorage:
     """
     Handles saving, loading, and deleting image files.
+
+    All methods are coroutines; backends keep blocking I/O off the event loop.
     """
     NAME = "IMAGE_STORAGE"
+    # Whether reads go over the network, i.e. are worth caching locally
+    REMOTE = False
+
+    async def save_image(
+        self,
+        file_obj: BinaryIO,
+        filename: str
+    ) -> str:
+        """Save an image under today's day prefix (see dated_key) and
+        return the path it can be loaded from."""
+        raise NotImplementedError()
+
+    async def load_image(self, image_path: str) -> BinaryIO:
+        """Load an image for streaming."""
+        raise NotImplementedError()
+
+    async def stat_image(self, image_path: str) -> Optional[ImageStat]:
+        """Size and ETag of an image, or None if it does not exist."""
+        raise NotImplementedError()
+
+    async def open_image(
+        self,
+        image_path: str,
+        start: int = 0,
+        end: Optional[int] = None
+    ) -> Optional[ImageObject]:
+        """Stream bytes start..end (inclusive, None for the last byte)
+        of an image without buffering it, or None if it does not exist."""
+        raise NotImplementedError()
+
+    async def delete_image(self, image_path: str) -> None:
+        """Delete an image."""
+        raise NotImplementedError()
+
+    async def delete_expired(
+        self,
+        cutoff: float,
+        batch_size: int = settings.RETENTION_DELETE_BATCH_SIZE
+    ) -> int:
+        """Delete every image saved on a day that ended by `cutoff` (unix
+        time), `batch_size` at a time. Images saved without a day prefix
+        go by their modification time. Returns the number deleted."""
+        raise NotImplementedError()
+
+
+class MinioImageStorage(ImageStorage):
+    """
+    MinIO/S3 backend.
+
+    boto3 calls run on a dedicated thread pool sized to the HTTP connection
+    pool, so up to `concurrency` uploads proceed in parallel while the event
+    loop keeps serving requests. Objects above `multipart_threshold` bytes
+    are uploaded in parts.
+    """
+    REMOTE = True
 
     def __init__(
         self,
-        base_dir: str,
-        use_minio: bool,
-        minio_endpoint: str = "",
-        minio_access_key: str = "",
-        minio_secret_key: str = "",
-        minio_bucket: str = "",
+        minio_endpoint: str,
+        minio_access_key: str,
+        minio_secret_key: str,
+        minio_bucket: str,
+        concurrency: int = settings.MINIO_MAX_CONCURRENCY,
+        multipart_threshold: int = settings.MINIO_MULTIPART_THRESHOLD,
+        multipart_chunksize: int = settings.MINIO_MULTIPART_CHUNKSIZE,
+        chunk_size: int = settings.IMAGE_STREAM_CHUNK_SIZE,
     ) -> None:
-        self.base_dir: Path = Path(base_dir)
-        self.use_minio = use_minio
-
-        if self.use_minio:
-            self.s3_client = boto3.client(
-                's3',
-                endpoint_url=minio_endpoint,
-                aws_access_key_id=minio_access_key,
-                aws_secret_access_key=minio_secret_key,
-                region_name='us-east-1'
+        self.s3_client = boto3.client(
+            's3',
+            endpoint_url=minio_endpoint,
+            aws_access_key_id=minio_access_key,
+            aws_secret_access_key=minio_secret_key,
+            region_name='us-east-1',
+            config=Config(
+                max_pool_connections=concurrency,
+                tcp_keepalive=True,
+                connect_timeout=5,
+                read_timeout=30,
+                retries={"max_attempts": 3, "mode": "standard"}
             )
-            self.bucket_name = minio_bucket
-            self._ensure_bucket_exists()
-        else:
-            self.base_dir.mkdir(parents=True, exist_ok=True)
-    
+        )
+        self.bucket_name = minio_bucket
+        self.chunk_size = chunk_size
+        self.multipart_threshold = multipart_threshold
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=concurrency
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency,
+            thread_name_prefix="minio"
+        )
+        self._ensure_bucket_exists()
+
     def _ensure_bucket_exists(self) -> None:
         """Create the bucket if it doesnt exist"""
         try:
@@ -52,76 +176,338 @@ class ImageStorage:
             else:
                 logger.error(f"[{self.NAME}]: Error checking buckets: {e}")
 
-    def save_image(
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            lambda: func(*args, **kwargs)
+        )
+
+    def _upload(self, file_obj: BinaryIO, filename: str) -> None:
+        file_obj.seek(0, os.SEEK_END)
+        size = file_obj.tell()
+        file_obj.seek(0)
+        if size < self.multipart_threshold:
+            # Single PUT; skips the transfer manager's thread fan-out
+            self.s3_client.put_object(
+                Bucket=self.bucket_name,
+                Key=filename,
+                Body=file_obj
+            )
+        else:
+            self.s3_client.upload_fileobj(
+                file_obj,
+                self.bucket_name,
+                filename,
+                Config=self.transfer_config
+            )
+
+    async def save_image(
         self,
         file_obj: BinaryIO,
         filename: str
-    ) -> Path:
+    ) -> str:
+        """Upload an image to the bucket."""
+        filename = dated_key(filename)
+        try:
+            await self._run(self._upload, file_obj, filename)
+            logger.info(f"[{self.NAME}]: Uploaded {filename} to MinIO bucket {self.bucket_name}")
+        except NoCredentialsError:
+            logger.error(f"[{self.NAME}]: Credentials not available for MinIO")
+        except Exception as e:
+            logger.error(f"[{self.NAME}]: Error uploading image to MinIO: {e}")
+        return filename
+
+    async def load_image(self, image_path: str) -> BinaryIO:
+        """Load an image from the bucket."""
+        def _get() -> BytesIO:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name,
+                Key=image_path
+            )
+            return BytesIO(response['Body'].read())
+
+        try:
+            return await self._run(_get)
+        except self.s3_client.exceptions.NoSuchKey:
+            logger.error(f"[{self.NAME}]: Image not found in MinIO: {image_path}")
+            return BytesIO()
+        except Exception as e:
+            logger.error(f"[{self.NAME}]: Error laoding image from MinIO: {e}")
+            return BytesIO()
+
+    def _is_missing(self, e: ClientError) -> bool:
+        return e.response["Error"]["Code"] in ('404', 'NoSuchKey', 'NotFound')
+
+    async def stat_image(self, image_path: str) -> Optional[ImageStat]:
+        try:
+            response = await self._run(
+                self.s3_client.head_object,
+                Bucket=self.bucket_name,
+                Key=image_path
+            )
+        except ClientError as e:
+            if self._is_missing(e):
+                return None
+            raise
+        return ImageStat(
+            size=response["ContentLength"],
+            etag=response["ETag"]
+        )
+
+    async def open_image(
+        self,
+        image_path: str,
+        start: int = 0,
+        end: Optional[int] = None
+    ) -> Optional[ImageObject]:
+        kwargs = {}
+        if start or end is not None:
+            kwargs["Range"] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            response = await self._run(
+                self.s3_client.get_object,
+                Bucket=self.bucket_name,
+                Key=image_path,
+                **kwargs
+            )
+        except ClientError as e:
+            if self._is_missing(e):
+                logger.error(f"[{self.NAME}]: Image not found in MinIO: {image_path}")
+                return None
+            raise
+
+        length = response["ContentLength"]
+        size = length
+        if "ContentRange" in response:
+            size = int(response["ContentRange"].rsplit("/", 1)[1])
+        return ImageObject(
+            size=size,
+            etag=response["ETag"],
+            start=start,
+            end=start + length - 1,
+            chunks=self._iter_body(response["Body"])
+        )
+
+    async def _iter_body(self, body) -> AsyncIterator[bytes]:
+        """Relay the HTTP body chunk by chunk, one executor hop per read."""
+        try:
+            while chunk := await self._run(body.read, self.chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+    async def delete_image(self, image_path: str) -> None:
+        """Delete an image from the bucket."""
+        try:
+            await self._run(
+                self.s3_client.delete_object,
+                Bucket=self.bucket_name,
+                Key=image_path
+            )
+            logger.info(f"[{self.NAME}]: Deleted {image_path} from MinIO bucket {self.bucket_name}")
+        except Exception as e:
+            logger.error(f"[{self.NAME}]: Error deleting image from MinIO: {e}")
+
+    def _delete_batch(self, keys: list[str]) -> int:
+        response = self.s3_client.delete_objects(
+            Bucket=self.bucket_name,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True}
+        )
+        for error in response.get("Errors", []):
+            logger.error(f"[{self.NAME}]: Could not delete {error['Key']}: {error['Message']}")
+        return len(keys) - len(response.get("Errors", []))
+
+    async def delete_expired(
+        self,
+        cutoff: float,
+        batch_size: int = settings.RETENTION_DELETE_BATCH_SIZE
+    ) -> int:
+        """Remove expired objects with multi-object DELETE requests (at
+        most 1000 keys each).
+
+        Only the top level of the bucket is listed: day prefixes and the
+        undated objects saved before them. Objects are listed under the
+        expired days only, so a run costs what it deletes, not the size
+        of the bucket."""
+        batch_size = min(batch_size, 1000)
+
+        def _expired_keys() -> Iterator[str]:
+            paginator = self.s3_client.get_paginator("list_objects_v2")
+            expired_days = []
+            for page in paginator.paginate(Bucket=self.bucket_name, Delimiter="/"):
+                for prefix in page.get("CommonPrefixes", []):
+                    day = key_day(prefix["Prefix"])
+                    if day is not None and day + 86400 <= cutoff:
+                        expired_days.append(prefix["Prefix"])
+                for obj in page.get("Contents", []):
+                    if obj["LastModified"].timestamp() < cutoff:
+                        yield obj["Key"]
+            for prefix in expired_days:
+                for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+                    for obj in page.get("Contents", []):
+                        yield obj["Key"]
+
+        def _sweep() -> int:
+            deleted = 0
+            keys = _expired_keys()
+            while batch := list(islice(keys, batch_size)):
+                deleted += self._delete_batch(batch)
+            return deleted
+
+        deleted = await self._run(_sweep)
+        if deleted:
+            logger.info(f"[{self.NAME}]: Deleted {deleted} expired image(s) from {self.bucket_name}")
+        return deleted
+
+
+class LocalImageStorage(ImageStorage):
+    """Local-disk backend; file I/O runs in worker threads."""
+
+    def __init__(self, base_dir: str) -> None:
+        self.base_dir: Path = Path(base_dir)
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+
+    async def save_image(
+        self,
+        file_obj: BinaryIO,
+        filename: str
+    ) -> str:
         """Save an uploaded image file to disk"""
-        if self.use_minio:
-            try:
-                file_obj.seek(0)
-                self.s3_client.upload_fileobj(
-                    file_obj,
-                    self.bucket_name,
-                    filename
-                )
-                logger.info(f"[{self.NAME}]: Uploaded {filename} to MinIO bucket {self.bucket_name}")
-            except NoCredentialError:
-                logger.error(f"[{self.NAME}]: Credentials not available for MinIO")
-            except Exception as e:
-                logger.error(f"[{self.NAME}]: Error uploading image to MinIO: {e}")
-            finally:
-                return filename
-        else:
-            save_path: Path = self.base_dir / filename
+        save_path: Path = self.base_dir / dated_key(filename)
+
+        def _write() -> None:
             save_path.parent.mkdir(parents=True, exist_ok=True)
+            file_obj.seek(0)
             with open(save_path, "wb") as out_file:
                 shutil.copyfileobj(file_obj, out_file)
-            return str(save_path.relative_to(self.base_dir))
-    
-    def load_image(self, image_path: str) -> BinaryIO:
+
+        await asyncio.to_thread(_write)
+        return str(save_path.relative_to(self.base_dir))
+
+    async def load_image(self, image_path: str) -> BinaryIO:
         """Load an image file from disk for streaming."""
-        if self.use_minio:
-            try:
-                response = self.s3_client.get_object(
-                    Bucket=self.bucket_name,
-                    Key=image_path
-                )
-                return BytesIO(response['Body'].read())
-            except self.s3_client.exceptions.NoSuchKey:
-                logger.error(f"[{self.NAME}]: Image not found in MinIO: {image_path}")
-                return BytesIO()
-            except Exception as e:
-                logger.error(f"[{self.NAME}]: Error laoding image from MinIO: {e}")
-                return BytesIO()
-        else:
-            path = self.base_dir / image_path
-            if not path.exists():
-                logger.error(
-                    f"[{self.NAME}]: Image not found: {image_path}"
-                )
-            return open(path, "rb")
-    
-    def delete_image(self, image_path: str) -> None:
-        """Delete an image file from local storage or MinIO."""
-        if self.use_minio:
-            try:
-                self.s3_client.delete_object(
-                    Bucket=self.bucket_name,
-                    Key=image_path
-                )
-                logger.info(f"[{self.NAME}]: Deleted {image_path} from MinIO bucket {self.bucket_name}")
-            except Exception as e:
-                logger.error(f"[{self.NAME}]: Error deleting image from MinIO: {e}")
-        else:
-            try:
-                os.remove(image_path)
-            except FileNotFoundError:
-                logger.error(f"[{self.NAME}]: File not found")
+        path = self.base_dir / image_path
+        if not path.exists():
+            logger.error(
+                f"[{self.NAME}]: Image not found: {image_path}"
+            )
+        return await asyncio.to_thread(open, path, "rb")
+
+    async def stat_image(self, image_path: str) -> Optional[ImageStat]:
+        try:
+            st = await asyncio.to_thread(os.stat, self.base_dir / image_path)
+        except FileNotFoundError:
+            return None
+        return ImageStat(
+            size=st.st_size,
+            etag=f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        )
+
+    async def open_image(
+        self,
+        image_path: str,
+        start: int = 0,
+        end: Optional[int] = None
+    ) -> Optional[ImageObject]:
+        stat = await self.stat_image(image_path)
+        if stat is None:
+            logger.error(f"[{self.NAME}]: Image not found: {image_path}")
+            return None
+        end = stat.size - 1 if end is None else min(end, stat.size - 1)
+        return ImageObject(
+            size=stat.size,
+            etag=stat.etag,
+            start=start,
+            end=end,
+            chunks=read_file_chunks(self.base_dir / image_path, start, end)
+        )
+
+    async def delete_image(self, image_path: str) -> None:
+        """Delete an image file from local storage."""
+        try:
+            await asyncio.to_thread(os.remove, self.base_dir / image_path)
+        except FileNotFoundError:
+            logger.error(f"[{self.NAME}]: File not found")
+
+    async def delete_expired(
+        self,
+        cutoff: float,
+        batch_size: int = settings.RETENTION_DELETE_BATCH_SIZE
+    ) -> int:
+        expired_days: list[Path] = []
+
+        def _expired_files() -> Iterator[Path]:
+            for entry in os.scandir(self.base_dir):
+                if entry.is_dir():
+                    day = key_day(f"{entry.name}/")
+                    if day is not None and day + 86400 <= cutoff:
+                        expired_days.append(Path(entry.path))
+                        for root, _, files in os.walk(entry.path):
+                            for name in files:
+                                yield Path(root) / name
+                elif entry.is_file() and entry.stat().st_mtime < cutoff:
+                    yield Path(entry.path)
+
+        def _remove(paths: list[Path]) -> int:
+            for path in paths:
+                path.unlink(missing_ok=True)
+            return len(paths)
+
+        deleted = 0
+        paths = _expired_files()
+        # One thread hop per batch, so a large backlog never holds a
+        # worker thread for the whole sweep
+        while batch := await asyncio.to_thread(lambda: list(islice(paths, batch_size))):
+            deleted += await asyncio.to_thread(_remove, batch)
+        for day_dir in expired_days:
+            await asyncio.to_thread(shutil.rmtree, day_dir, True)
+        if deleted:
+            logger.info(f"[{self.NAME}]: Deleted {deleted} expired image(s)")
+        return deleted
+
+
+async def read_file_chunks(
+    path: Path,
+    start: int,
+    end: int,
+    chunk_size: int = settings.IMAGE_STREAM_CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """Yield bytes start..end (inclusive) of a file, reading in threads."""
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        await asyncio.to_thread(f.seek, start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def create_image_storage(
+    base_dir: str,
+    use_minio: bool,
+    minio_endpoint: str = "",
+    minio_access_key: str = "",
+    minio_secret_key: str = "",
+    minio_bucket: str = "",
+) -> ImageStorage:
+    """Pick the MinIO or local-disk backend."""
+    if use_minio:
+        return MinioImageStorage(
+            minio_endpoint=minio_endpoint,
+            minio_access_key=minio_access_key,
+            minio_secret_key=minio_secret_key,
+            minio_bucket=minio_bucket
+        )
+    return LocalImageStorage(base_dir=base_dir)
 
 
-minio_storage: ImageStorage = ImageStorage(
+minio_storage: ImageStorage = create_image_storage(
     base_dir=settings.IMAGE_DIR,
     use_minio=settings.USE_MINIO,
     minio_endpoint=settings.MINIO_ENDPOINT,
@@ -130,7 +516,7 @@ minio_storage: ImageStorage = ImageStorage(
     minio_bucket=settings.MINIO_BUCKET
 )
 
-local_storage: ImageStorage = ImageStorage(
+local_storage: ImageStorage = create_image_storage(
     base_dir=settings.IMAGE_DIR,
     use_minio=False
 )
@@ -0,0 +1,63 @@
+"""
+Prometheus metrics of the API process, served on /metrics.
+
+Stage latencies share one histogram labelled by stage:
+
+    ingest           /stream request handling up to admission
+    task_queue_wait  enqueue -> popped by the stream pipeline
+    model_roundtrip  model request pushed -> result received
+    inference        forward pass alone, as reported by the model worker
+    upload           image upload to storage
+    db_insert        detection insert (SQLite cache + Postgres)
+    end_to_end       enqueue -> detection stored
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+from src.util import logger
+from shared_config.redis_client import redis_client
+from shared_config.task_queue import task_queue
+from shared_config.settings import REDIS_MODEL_REQUEST_QUEUE
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+STAGE_SECONDS = Histogram(
+    "edge_stage_seconds",
+    "Time spent per pipeline stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+FRAMES = Counter(
+    "edge_frames_total",
+    "Frames per source by outcome (queued, rejected, dropped, expired, "
+    "duplicate, unchanged, stored, failed)",
+    ["source", "outcome"]
+)
+CACHE_LOOKUPS = Counter(
+    "edge_cache_lookups_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"]
+)
+QUEUE_DEPTH = Gauge(
+    "edge_queue_depth",
+    "Items waiting per queue",
+    ["queue"]
+)
+TASK_QUEUE_BYTES = Gauge(
+    "edge_task_queue_bytes",
+    "Payload bytes waiting in the task queue"
+)
+
+
+async def update_queue_depths() -> None:
+    """Refresh the Redis queue gauges; called on every scrape."""
+    try:
+        depth = await task_queue.depth()
+        QUEUE_DEPTH.labels("task_queue").set(depth["frames"])
+        TASK_QUEUE_BYTES.set(depth["bytes"])
+        QUEUE_DEPTH.labels("model_request_queue").set(
+            await redis_client.llen(REDIS_MODEL_REQUEST_QUEUE)
+        )
+    except Exception as e:
+        logger.warning(f"[METRICS]: Could not read queue depths: {e}")
@@ -0,0 +1,152 @@
+from __future__ import annotations
+from typing import Optional
+import asyncio
+import dataclasses
+import json
+import time
+import uuid
+
+from src.config import settings
+from src.util import logger
+from src.metrics import STAGE_SECONDS
+from shared_config import shm_ring
+from shared_config.redis_client import redis_client
+from shared_config.wire import Frame, DetectionResult, EXT_REPLY_TO
+
+
+class ModelClient:
+    """
+    Sends frames to the inference worker and routes the results back.
+
+    Each process owns a single reply list. One dispatcher task pops it and
+    resolves the future of the matching request, so any number of requests
+    can be in flight without a blocking BLPOP per request.
+
+    Payloads go through the shared-memory ring when the model worker maps
+    the same ring as this process, and inline otherwise.
+    """
+    NAME = "MODEL_CLIENT"
+    # Seconds before model_info is fetched again (the worker may restart)
+    MODEL_INFO_REFRESH = 60
+
+    def __init__(
+        self,
+        request_queue: str,
+        result_queue: str,
+        timeout: float
+    ) -> None:
+        self.request_queue = request_queue
+        self.reply_key = f"{result_queue}:{uuid.uuid4()}"
+        self.timeout = timeout
+        self._pending: dict[str, asyncio.Future] = {}
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._class_names: dict[int, str] = {}
+        self._model_ring: Optional[str] = None
+        self._model_version: Optional[str] = None
+        self._info_fetched_at = 0.0
+
+    def _ensure_started(self) -> None:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch_results())
+
+    async def _dispatch_results(self) -> None:
+        logger.info(f"[{self.NAME}]: Listening for results on {self.reply_key}")
+        while True:
+            try:
+                item = await redis_client.blpop(self.reply_key, timeout=5)
+                if item is None:
+                    continue
+                result = DetectionResult.unpack(item[1])
+                if result.trace is not None:
+                    result.trace.mark("result_received")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[{self.NAME}]: Bad result message: {e}")
+                await asyncio.sleep(0.1)
+                continue
+
+            future = self._pending.pop(result.request_id, None)
+            if future is None or future.done():
+                logger.warning(
+                    f"[{self.NAME}]: Dropping late result for {result.request_id}"
+                )
+                continue
+            future.set_result(result)
+
+    async def _load_model_info(self) -> None:
+        if time.monotonic() - self._info_fetched_at < self.MODEL_INFO_REFRESH:
+            return
+        raw = await redis_client.get(settings.REDIS_MODEL_INFO_KEY)
+        if not raw:
+            return
+        info = json.loads(raw)
+        self._class_names = {int(k): v for k, v in info["names"].items()}
+        self._model_ring = info.get("shm_ring")
+        self._model_version = info.get("version", info.get("model"))
+        self._info_fetched_at = time.monotonic()
+
+    async def _share_payload(self, frame: Frame) -> tuple[Frame, bool]:
+        """Hand the model a reference to the frame's ring slot if it maps
+        our ring, otherwise an inline copy. Returns the frame to send and
+        whether the model now holds a slot reference."""
+        await self._load_model_info()
+        local_ring = shm_ring.ring_id()
+        if local_ring is not None and self._model_ring == local_ring:
+            if shm_ring.slot_ref(frame) is None:
+                shared = await shm_ring.offload(frame, refs=1)
+                return shared, shared is not frame
+            if await shm_ring.retain(frame):
+                return frame, True
+        if shm_ring.slot_ref(frame) is None:
+            return frame, False
+        inline = shm_ring.inline(frame)
+        if inline is None:
+            raise ValueError("frame payload is no longer available")
+        return inline, False
+
+    async def infer(self, frame: Frame) -> DetectionResult:
+        """Queue a frame for inference and wait for its result."""
+        self._ensure_started()
+        frame, model_holds_ref = await self._share_payload(frame)
+        request = dataclasses.replace(
+            frame,
+            enqueued_at=time.time(),
+            extensions={
+                **frame.extensions,
+                EXT_REPLY_TO: self.reply_key.encode()
+            }
+        )
+        request.mark("model_queued")
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request.request_id] = future
+        try:
+            try:
+                await redis_client.rpush(self.request_queue, request.pack())
+            except Exception:
+                if model_holds_ref:
+                    await shm_ring.release(request)
+                raise
+            with STAGE_SECONDS.labels("model_roundtrip").time():
+                result = await asyncio.wait_for(future, self.timeout)
+            STAGE_SECONDS.labels("inference").observe(result.inference_ms / 1000)
+            return result
+        finally:
+            self._pending.pop(request.request_id, None)
+
+    async def get_class_names(self) -> dict[int, str]:
+        """Class-name table published by the model worker."""
+        await self._load_model_info()
+        return self._class_names
+
+    async def get_model_version(self) -> Optional[str]:
+        """Identity of the served weights, None until the worker is up."""
+        await self._load_model_info()
+        return self._model_version
+
+
+model_client: ModelClient = ModelClient(
+    request_queue=settings.REDIS_MODEL_REQUEST_QUEUE,
+    result_queue=settings.REDIS_MODEL_RESULT_QUEUE,
+    timeout=settings.MODEL_RESULT_TIMEOUT
+)
@@ -0,0 +1,148 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Optional
+import hashlib
+import time
+
+from src.config import settings
+from src.util import logger
+from src.metrics import CACHE_LOOKUPS
+from shared_config.redis_client import redis_client
+from shared_config.wire import DetectionResult
+
+
+def content_hash(image_bytes: bytes | memoryview) -> str:
+    """Fast 128-bit content hash of an encoded image."""
+    return hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+
+@dataclass
+class CachedResult:
+    result: DetectionResult
+    # Set once a detection built from this result has been stored
+    detection_id: Optional[int] = None
+    image_path: Optional[str] = None
+
+
+class ResultCache:
+    """
+    Content-addressed cache of inference results in Redis.
+
+    Entries are keyed by the image's content hash and the model version,
+    so new weights never serve old results. Each entry is a hash holding
+    the packed DetectionResult and, once stored, the detection it produced.
+    Entries expire after `ttl` seconds and an index zset keeps at most
+    `max_entries` of them, evicting the oldest first. Hit and miss
+    counters are shared by all API replicas.
+    """
+    NAME = "RESULT_CACHE"
+
+    ENTRY_KEY = "result_cache:{model}:{digest}"
+    INDEX_KEY = "result_cache:{model}:index"
+    STATS_KEY = "result_cache:stats"
+
+    def __init__(
+        self,
+        enabled: bool = settings.RESULT_CACHE_ENABLED,
+        ttl: int = settings.RESULT_CACHE_TTL,
+        max_entries: int = settings.RESULT_CACHE_MAX_ENTRIES
+    ) -> None:
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    async def get(
+        self,
+        model: str,
+        digest: str,
+        request_id: str
+    ) -> Optional[CachedResult]:
+        """Cached result for an image, re-addressed to `request_id`."""
+        if not self.enabled:
+            return None
+        try:
+            entry = await redis_client.hgetall(
+                self.ENTRY_KEY.format(model=model, digest=digest)
+            )
+            await redis_client.hincrby(self.STATS_KEY, "hits" if entry else "misses", 1)
+        except Exception as e:
+            logger.warning(f"[{self.NAME}]: Redis unavailable: {e}")
+            return None
+        CACHE_LOOKUPS.labels("result", "hit" if entry else "miss").inc()
+        if not entry:
+            return None
+
+        result = DetectionResult.unpack(entry[b"result"])
+        result.request_id = request_id
+        detection_id = entry.get(b"detection_id")
+        image_path = entry.get(b"image_path")
+        return CachedResult(
+            result=result,
+            detection_id=int(detection_id) if detection_id else None,
+            image_path=image_path.decode() if image_path else None
+        )
+
+    async def put(self, model: str, digest: str, result: DetectionResult) -> None:
+        if not self.enabled:
+            return
+        key = self.ENTRY_KEY.format(model=model, digest=digest)
+        index = self.INDEX_KEY.format(model=model)
+        now = time.time()
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.hset(key, "result", result.pack())
+                pipe.expire(key, self.ttl)
+                pipe.zadd(index, {key: now})
+                # Index entries whose keys have expired
+                pipe.zremrangebyscore(index, "-inf", now - self.ttl)
+                pipe.zcard(index)
+                size = (await pipe.execute())[-1]
+            if size > self.max_entries:
+                evicted = await redis_client.zpopmin(index, size - self.max_entries)
+                if evicted:
+                    await redis_client.delete(*(member for member, _ in evicted))
+        except Exception as e:
+            logger.warning(f"[{self.NAME}]: Redis unavailable: {e}")
+
+    async def set_detection(
+        self,
+        model: str,
+        digest: str,
+        detection_id: int,
+        image_path: str
+    ) -> None:
+        """Remember which stored detection an entry produced."""
+        if not self.enabled:
+            return
+        key = self.ENTRY_KEY.format(model=model, digest=digest)
+        try:
+            # Only annotate entries that still exist; never resurrect one
+            if await redis_client.exists(key):
+                await redis_client.hset(key, mapping={
+                    "detection_id": detection_id,
+                    "image_path": image_path
+                })
+        except Exception as e:
+            logger.warning(f"[{self.NAME}]: Redis unavailable: {e}")
+
+    async def stats(self, model: str) -> dict[str, Any]:
+        """Shared counters; only `enabled` and `available` without Redis."""
+        try:
+            raw = await redis_client.hmget(self.STATS_KEY, "hits", "misses")
+            entries = await redis_client.zcard(self.INDEX_KEY.format(model=model))
+        except Exception as e:
+            logger.warning(f"[{self.NAME}]: Redis unavailable: {e}")
+            return {"enabled": self.enabled, "available": False}
+        hits, misses = (int(value or 0) for value in raw)
+        lookups = hits + misses
+        return {
+            "enabled": self.enabled,
+            "available": True,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": entries
+        }
+
+
+result_cache: ResultCache = ResultCache()
@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+from src.config import settings
+from src.db_util import db
+from src.image_cache import image_store
+from src.util import logger
+
+NAME = "RETENTION"
+
+
+def retention_cutoff(now: float, days: float = settings.RETENTION_DAYS) -> int:
+    """Start of the UTC day before which everything has expired.
+
+    Aligned to days so images go in step with the day partitions."""
+    return int((now - days * 86400) // 86400 * 86400)
+
+
+async def run_retention_once(now: float) -> None:
+    if settings.RETENTION_DAYS <= 0:
+        # Still keep partitions ready for the coming days
+        await db.ensure_partitions()
+        return
+    cutoff = retention_cutoff(now)
+    dropped = await db.expire(cutoff)
+    deleted = await image_store.delete_expired(cutoff)
+    logger.info(
+        f"[{NAME}]: Expired data before {time.strftime('%Y-%m-%d', time.gmtime(cutoff))}: "
+        f"{dropped} partition(s) dropped, {deleted} image(s) deleted"
+    )
+
+
+async def run_retention():
+    """Apply retention every RETENTION_INTERVAL seconds."""
+    while True:
+        try:
+            await run_retention_once(time.time())
+        except Exception as e:
+            logger.error(f"[{NAME}]: Retention run failed: {e}")
+        await asyncio.sleep(settings.RETENTION_INTERVAL)
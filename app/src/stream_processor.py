@@ -1,9 +1,26 @@
-import asyncio, tempfile, os, logging, pickle, json, uuid
+import asyncio, os, logging, time, uuid
+from io import BytesIO
+from typing import Optional
 
 from src.db_util import db
 from src.image_storage import local_storage, minio_storage
 from src.config import settings
-from shared_config.redis_client import redis_client
+from src.model_client import model_client
+from src.result_cache import result_cache, content_hash
+from src.tracker import tracker, TrackUpdate
+from src.metrics import FRAMES, QUEUE_DEPTH, STAGE_SECONDS
+from src.tracing import trace_store
+from shared_config import shm_ring
+from shared_config.task_queue import task_queue, Admission, QueueFull
+from shared_config.wire import (
+    Frame,
+    DetectionResult,
+    Letterbox,
+    Trace,
+    EXT_SOURCE,
+    EXT_LETTERBOX,
+    EXT_TRACE
+)
 
 NAME = "STREAM"
 
@@ -19,75 +36,249 @@ logging.basicConfig(
 )
 logger = logging.getLogger("stream_processor")
 
-async def enqueue_image(image_bytes: bytes, filename: str):
-    """Adds an image to redis queue as aserialized tuple."""
-    data = pickle.dumps((image_bytes, filename))
-    await redis_client.rpush(
-        settings.REDIS_TASK_QUEUE,
-        data
+async def enqueue_image(
+    image_bytes: bytes,
+    filename: str,
+    content_type: Optional[str] = "image/jpeg",
+    source: str = "default",
+    letterbox: Optional[Letterbox] = None,
+    trace: Optional[Trace] = None
+) -> Admission:
+    """Adds an image to redis queue as a binary frame envelope.
+
+    The frame carries the edge device's trace, or a new one, so its
+    timeline can be followed through the pipeline (see src.tracing).
+
+    The payload goes into the shared-memory ring when there is room, so
+    the queued message is only a slot descriptor. The slot's reference is
+    owned by the pipeline until persist_results is done with the frame.
+
+    Raises QueueFull when admission control refuses the frame."""
+    frame = Frame(
+        request_id=str(uuid.uuid4()),
+        filename=filename,
+        image_bytes=image_bytes,
+        content_type=content_type,
+        enqueued_at=time.time(),
+        extensions={EXT_SOURCE: source.encode("utf-8")}
     )
-    logging.info(f"[{NAME}] Queued image: {filename}") 
+    if letterbox is not None:
+        frame.extensions[EXT_LETTERBOX] = letterbox.pack()
+    trace_store.start(frame, trace)
+    frame.mark("queued")
+    frame = await shm_ring.offload(frame, refs=1)
+    packed = frame.pack()
+    try:
+        admission = await task_queue.put(
+            source,
+            packed,
+            shm_ring.queued_size(frame, packed)
+        )
+    except QueueFull:
+        FRAMES.labels(source, "rejected").inc()
+        await shm_ring.release(frame)
+        await trace_store.finish(frame, "rejected")
+        raise
+    FRAMES.labels(source, "queued").inc()
+    for dropped in admission.dropped_frames:
+        dropped = Frame.unpack(dropped)
+        await shm_ring.release(dropped)
+        await trace_store.finish(dropped, "dropped")
+    if admission.dropped:
+        # Attributed to the source being queued; quota drops evict its own frames
+        FRAMES.labels(source, "dropped").inc(admission.dropped)
+        logger.warning(
+            f"[{NAME}] Dropped {admission.dropped} stale frame(s) from {source}"
+        )
+    logger.info(f"[{NAME}] Queued image: {filename} from {source}")
+    return admission
 
-async def process_queue():
-    """Continuously process images from Redis queue."""
-    logger.info(f"[{NAME}] Starting Redis YOLO worker...")
-    while True:
-        data = await redis_client.blpop(
-            settings.REDIS_TASK_QUEUE,
-            timeout=5
+async def await_result(
+    frame: Frame,
+    persist_queue: asyncio.Queue,
+    in_flight: asyncio.Semaphore
+):
+    """Stage 2: wait for the inference result and hand it to persistence.
+
+    Images seen before (same bytes, same model) are answered from the
+    result cache and not stored again, unless the tracker reports that
+    they start, end or move a track. With tracking enabled, frames that
+    do none of these are dropped here as well.
+
+    Frames that are not handed to persistence give back their in-flight
+    permit and ring slot in one place, whatever went wrong."""
+    outcome = "failed"
+    handed_off = False
+    try:
+        model = await model_client.get_model_version()
+        payload = shm_ring.payload(frame)
+        digest = content_hash(payload) if model and payload is not None else None
+        cached = None
+        if digest is not None:
+            cached = await result_cache.get(model, digest, frame.request_id)
+        if cached is not None:
+            result = cached.result
+        else:
+            result = await model_client.infer(frame)
+            if result.trace is not None:
+                # Now also holds the model worker's hops
+                frame.extensions[EXT_TRACE] = result.trace.pack()
+            if digest is not None:
+                await result_cache.put(model, digest, result)
+
+        # Duplicates still keep the source's tracks alive
+        update = await track_frame(frame, result) if tracker.enabled else None
+        significant = update is not None and update.significant
+        if cached is not None and not significant:
+            logger.info(f"[{NAME}] Duplicate of a cached image, skipping {frame.filename}")
+            outcome = "duplicate"
+            return
+        if update is not None and not significant:
+            logger.info(f"[{NAME}] No track changes, skipping {frame.filename}")
+            outcome = "unchanged"
+            return
+        await persist_queue.put((frame, result, model, digest, update))
+        handed_off = True
+    except Exception as e:
+        logger.error(f"[{NAME}] Could not get a result for {frame.filename}: {e!r}")
+    finally:
+        if not handed_off:
+            in_flight.release()
+            FRAMES.labels(frame_source(frame), outcome).inc()
+            try:
+                await shm_ring.release(frame)
+                await trace_store.finish(frame, outcome)
+            except Exception as e:
+                logger.error(f"[{NAME}] Could not release {frame.filename}: {e!r}")
+
+def frame_source(frame: Frame) -> str:
+    return frame.extensions.get(EXT_SOURCE, b"default").decode("utf-8")
+
+async def track_frame(frame: Frame, result: DetectionResult) -> TrackUpdate:
+    update = tracker.update(frame_source(frame), result, frame.enqueued_at)
+    if update.deaths:
+        await tracker.record_finished(
+            update.deaths,
+            await model_client.get_class_names()
         )
-        if data is None:
-            await asyncio.sleep(0.1)
-            continue
+    return update
 
-        logger.info(f"[{NAME}] Got item from Redis Queue...")
-        _, serialized = data
+async def persist_results(
+    persist_queue: asyncio.Queue,
+    in_flight: asyncio.Semaphore
+):
+    """Stage 3: upload the image and store the detection."""
+    while True:
+        frame, result, model, digest, update = await persist_queue.get()
+        outcome = "failed"
         try:
-            image_bytes, filename = pickle.loads(serialized)
-            tmp_path = None
-
-            with tempfile.NamedTemporaryFile(
-                delete=False,
-                suffix=".jpg"
-            ) as tmp:
-                tmp.write(image_bytes)
-                tmp.flush()
-                tmp_path = tmp.name
-
-            request_id = str(uuid.uuid4())
-
-            # -------- SEND JOB TO INFERENCE WORKER --------
-            payload = pickle.dumps({
-                "request_id": request_id,
-                "filename": filename,
-                "image_bytes": image_bytes,
-            })
-
-            await redis_client.rpush(
-                settings.REDIS_MODEL_REQUEST_QUEUE,
-                payload
+            letterbox = frame.extensions.get(EXT_LETTERBOX)
+            letterbox = Letterbox.unpack(letterbox) if letterbox else None
+            detection_data = result.to_records(
+                await model_client.get_class_names(),
+                letterbox=letterbox
             )
+            if update is not None:
+                for record, track_id in zip(detection_data, update.track_ids):
+                    record["track_id"] = track_id
 
-            # -------- WAIT FOR RESULT FROM WORKER --------
-            result_key = f"{settings.REDIS_MODEL_RESULT_QUEUE}:{request_id}"
-            _, result_raw = await redis_client.blpop(result_key)
-            result = pickle.loads(result_raw)
+            image_bytes = shm_ring.payload(frame)
+            if image_bytes is None:
+                raise ValueError("frame payload is in a ring this host does not map")
 
-            await redis_client.delete(result_key)
+            # Upload straight from the original bytes; the request id keeps
+            # frames that share a filename from overwriting each other
+            with STAGE_SECONDS.labels("upload").time():
+                minio_path = await minio_storage.save_image(
+                    BytesIO(image_bytes),
+                    f"{frame.request_id}_{frame.filename}"
+                )
+            frame.mark("uploaded")
 
-            detection_data = result["detection"]
+            with STAGE_SECONDS.labels("db_insert").time():
+                detection_id = await db.insert_detection(
+                    image_path=str(minio_path),
+                    detection_data=detection_data,
+                    source=frame_source(frame),
+                    # original_box coordinates refer to the camera frame
+                    image_size=(
+                        (letterbox.height, letterbox.width)
+                        if letterbox is not None else result.image_size
+                    )
+                )
+            frame.mark("stored")
+            if digest is not None:
+                await result_cache.set_detection(
+                    model,
+                    digest,
+                    detection_id,
+                    str(minio_path)
+                )
+            STAGE_SECONDS.labels("end_to_end").observe(time.time() - frame.enqueued_at)
+            FRAMES.labels(frame_source(frame), "stored").inc()
+            outcome = "stored"
+            logger.info(f"[{NAME}] Processed and uploaded {frame.filename}")
 
+        except Exception as e:
+            FRAMES.labels(frame_source(frame), "failed").inc()
+            logger.exception(f"[{NAME}] Error processing {frame.filename}: {e}")
+        finally:
+            await shm_ring.release(frame)
+            in_flight.release()
+            persist_queue.task_done()
+            await trace_store.finish(frame, outcome)
 
-            with open(tmp_path, "rb") as f:
-                minio_path = minio_storage.save_image(f, filename)
+async def process_queue():
+    """Continuously process images from Redis queue.
 
-            db.insert_detection(
-                image_path=str(minio_path),
-                detection_data=detection_data
-            )
-            logger.info(f"[{NAME}] Processed and uploaded {filename}")
+    Runs as a staged pipeline (dispatch -> await result -> persist) with at
+    most STREAM_MAX_IN_FLIGHT frames between the task queue and the DB, so
+    inference keeps running while earlier frames are being stored.
+    """
+    logger.info(f"[{NAME}] Starting Redis YOLO worker...")
+    in_flight = asyncio.Semaphore(settings.STREAM_MAX_IN_FLIGHT)
+    persist_queue: asyncio.Queue = asyncio.Queue()
+    QUEUE_DEPTH.labels("persist_queue").set_function(persist_queue.qsize)
+    tasks: set[asyncio.Task] = set()
+    for _ in range(settings.STREAM_PERSIST_WORKERS):
+        tasks.add(asyncio.create_task(
+            persist_results(persist_queue, in_flight)
+        ))
+
+    while True:
+        # Stage 1: dispatch, but only while there is room in the window
+        await in_flight.acquire()
+        data = await task_queue.get(timeout=5)
+        if data is None:
+            in_flight.release()
+            await asyncio.sleep(0.1)
+            continue
 
-            os.remove(tmp_path)
-        
+        logger.info(f"[{NAME}] Got item from Redis Queue...")
+        _, serialized = data
+        try:
+            frame = Frame.unpack(serialized)
         except Exception as e:
-            logger.exception(f"[{NAME}] Error processing {filename}: {e}")
+            logger.error(f"[{NAME}] Dropping malformed frame: {e}")
+            in_flight.release()
+            continue
+        STAGE_SECONDS.labels("task_queue_wait").observe(time.time() - frame.enqueued_at)
+        frame.mark("dequeued")
+        try:
+            alive = await shm_ring.touch(frame)
+        except Exception as e:
+            logger.warning(f"[{NAME}] Could not renew slot lease of {frame.filename}: {e}")
+            alive = True
+        if not alive:
+            # Waited past SHM_SLOT_TTL and its slot went to another frame
+            logger.warning(f"[{NAME}] Payload of {frame.filename} expired in the queue, dropping")
+            FRAMES.labels(frame_source(frame), "expired").inc()
+            await trace_store.finish(frame, "expired")
+            in_flight.release()
+            continue
+
+        task = asyncio.create_task(
+            await_result(frame, persist_queue, in_flight)
+        )
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
@@ -0,0 +1,90 @@
+from __future__ import annotations
+from typing import Any, Optional
+import json
+
+from src.config import settings
+from src.util import logger
+from shared_config.redis_client import redis_client
+from shared_config.wire import Frame, Trace, EXT_TRACE, EXT_SOURCE
+
+
+class TraceStore:
+    """
+    Completed frame timelines, kept in Redis so every API replica sees them.
+
+    A frame carries its trace id and hop timestamps in the EXT_TRACE
+    extension from the edge device to the database. When it leaves the
+    pipeline its timeline is stored under its id; a list holds the ids
+    in arrival order and bounds the store to `history` timelines, and a
+    sorted set ranks the retained ones by total time.
+    """
+    NAME = "TRACE"
+    RING_KEY = "traces:ring"
+    DATA_KEY = "traces:data"
+    SLOWEST_KEY = "traces:slowest"
+
+    def __init__(
+        self,
+        enabled: bool = settings.TRACE_ENABLED,
+        history: int = settings.TRACE_HISTORY
+    ) -> None:
+        self.enabled = enabled
+        self.history = history
+
+    def start(self, frame: Frame, trace: Optional[Trace] = None) -> None:
+        """Attach a trace to a frame entering the server; an upstream
+        trace keeps its id and hops, otherwise the request id is used."""
+        if not self.enabled:
+            return
+        if trace is None:
+            trace = frame.trace() or Trace(frame.request_id)
+        frame.extensions[EXT_TRACE] = trace.pack()
+
+    async def finish(self, frame: Frame, outcome: str) -> None:
+        """Store the timeline of a frame that left the pipeline."""
+        trace = frame.trace()
+        if not self.enabled or trace is None or not trace.hops:
+            return
+        timeline = trace.timeline()
+        slowest = max(timeline[1:] or timeline, key=lambda hop: hop["delta"])
+        total = timeline[-1]["elapsed"]
+        record = {
+            "trace_id": trace.trace_id,
+            "request_id": frame.request_id,
+            "source": frame.extensions.get(EXT_SOURCE, b"default").decode("utf-8"),
+            "filename": frame.filename,
+            "outcome": outcome,
+            "total": total,
+            "slowest_hop": slowest["hop"],
+            "hops": timeline
+        }
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.hset(self.DATA_KEY, trace.trace_id, json.dumps(record))
+                pipe.zadd(self.SLOWEST_KEY, {trace.trace_id: total})
+                pipe.lpush(self.RING_KEY, trace.trace_id)
+                pipe.lrange(self.RING_KEY, self.history, -1)
+                pipe.ltrim(self.RING_KEY, 0, self.history - 1)
+                evicted = (await pipe.execute())[3]
+            if evicted:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    pipe.hdel(self.DATA_KEY, *evicted)
+                    pipe.zrem(self.SLOWEST_KEY, *evicted)
+                    await pipe.execute()
+        except Exception as e:
+            logger.warning(f"[{self.NAME}]: Could not store trace {trace.trace_id}: {e}")
+
+    async def get(self, trace_id: str) -> Optional[dict[str, Any]]:
+        raw = await redis_client.hget(self.DATA_KEY, trace_id)
+        return json.loads(raw) if raw else None
+
+    async def slowest(self, limit: int = 20) -> list[dict[str, Any]]:
+        """The `limit` slowest retained timelines, slowest first."""
+        ids = await redis_client.zrevrange(self.SLOWEST_KEY, 0, max(1, limit) - 1)
+        if not ids:
+            return []
+        raws = await redis_client.hmget(self.DATA_KEY, ids)
+        return [json.loads(raw) for raw in raws if raw]
+
+
+trace_store: TraceStore = TraceStore()
@@ -0,0 +1,275 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, Optional, List
+import json
+import time
+import uuid
+
+import numpy as np
+
+from src.config import settings
+from src.util import logger
+from shared_config.redis_client import redis_client
+from shared_config.wire import DetectionResult
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of xyxy boxes a[N, 4] and b[M, 4]."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0).astype(np.float32)
+
+
+@dataclass
+class Track:
+    id: str
+    source: str
+    class_id: int
+    box: np.ndarray
+    first_seen: float
+    last_seen: float
+    velocity: np.ndarray = field(default_factory=lambda: np.zeros(4, dtype=np.float32))
+    hits: int = 1
+    confirmed: bool = False
+    max_confidence: float = 0.0
+    first_box: Optional[np.ndarray] = None
+    # Box as of the last frame that was persisted for this track
+    persisted_box: Optional[np.ndarray] = None
+    distance: float = 0.0
+
+    def predict(self, timestamp: float, horizon: float) -> np.ndarray:
+        """Box extrapolated to `timestamp`, at most `horizon` seconds ahead."""
+        dt = min(max(timestamp - self.last_seen, 0.0), horizon)
+        return self.box + self.velocity * dt
+
+    def summary(self, names: dict[int, str]) -> dict[str, Any]:
+        return {
+            "track_id": self.id,
+            "source": self.source,
+            "class": self.class_id,
+            "name": names.get(self.class_id, str(self.class_id)),
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "frames": self.hits,
+            "max_confidence": round(self.max_confidence, 5),
+            "first_box": [round(v, 2) for v in self.first_box.tolist()],
+            "last_box": [round(v, 2) for v in self.box.tolist()],
+            "distance": round(self.distance, 2)
+        }
+
+
+@dataclass
+class TrackUpdate:
+    # Track id per detection of the frame, aligned with the result arrays
+    track_ids: List[Optional[str]]
+    births: List[Track]
+    deaths: List[Track]
+    changed: List[Track]
+
+    @property
+    def significant(self) -> bool:
+        """Whether the frame is worth persisting."""
+        return bool(self.births or self.deaths or self.changed)
+
+
+class SourceTracker:
+    """
+    IoU tracker for one camera.
+
+    Tracks follow a constant-velocity model smoothed with an alpha-beta
+    filter (a fixed-gain Kalman filter). Each frame, predicted track boxes
+    are matched greedily, by descending IoU, to detections of the same
+    class. A track becomes confirmed (born) after `min_hits` matches and
+    dies when it has not been matched for `max_age` seconds. Deaths are
+    noticed when the source's next frame arrives.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        iou_threshold: float = settings.TRACKER_IOU_THRESHOLD,
+        max_age: float = settings.TRACKER_MAX_AGE,
+        min_hits: int = settings.TRACKER_MIN_HITS,
+        change_iou: float = settings.TRACKER_CHANGE_IOU,
+        alpha: float = 0.5
+    ) -> None:
+        self.source = source
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.change_iou = change_iou
+        self.alpha = alpha
+        self.tracks: List[Track] = []
+        self.last_timestamp = 0.0
+
+    def _match(
+        self,
+        result: DetectionResult,
+        timestamp: float
+    ) -> list[tuple[int, int]]:
+        if not self.tracks or not len(result):
+            return []
+        predicted = np.stack([track.predict(timestamp, self.max_age) for track in self.tracks])
+        iou = iou_matrix(predicted, result.boxes)
+        track_classes = np.array([track.class_id for track in self.tracks])
+        iou[track_classes[:, None] != result.classes[None, :]] = 0
+
+        matches = []
+        for flat in np.argsort(-iou, axis=None):
+            t, d = np.unravel_index(flat, iou.shape)
+            if iou[t, d] < self.iou_threshold:
+                break
+            matches.append((int(t), int(d)))
+            iou[t, :] = 0
+            iou[:, d] = 0
+        return matches
+
+    def update(self, result: DetectionResult, timestamp: float) -> TrackUpdate:
+        # Frames may finish inference slightly out of order
+        timestamp = max(timestamp, self.last_timestamp)
+        self.last_timestamp = timestamp
+
+        track_ids: List[Optional[str]] = [None] * len(result)
+        births, changed = [], []
+        matched_tracks = set()
+
+        for t, d in self._match(result, timestamp):
+            track = self.tracks[t]
+            box = result.boxes[d]
+            dt = timestamp - track.last_seen
+            if dt > 0:
+                observed = (box - track.box) / dt
+                track.velocity = self.alpha * observed + (1 - self.alpha) * track.velocity
+            old_center = (track.box[:2] + track.box[2:]) / 2
+            new_center = (box[:2] + box[2:]) / 2
+            track.distance += float(np.linalg.norm(new_center - old_center))
+            track.box = box.copy()
+            track.last_seen = timestamp
+            track.hits += 1
+            track.max_confidence = max(track.max_confidence, float(result.confidences[d]))
+            matched_tracks.add(t)
+            track_ids[d] = track.id
+
+            if not track.confirmed and track.hits >= self.min_hits:
+                track.confirmed = True
+                births.append(track)
+            elif track.confirmed and iou_matrix(
+                track.box[None], track.persisted_box[None]
+            )[0, 0] < self.change_iou:
+                changed.append(track)
+
+        for d, track_id in enumerate(track_ids):
+            if track_id is not None:
+                continue
+            track = Track(
+                id=uuid.uuid4().hex[:12],
+                source=self.source,
+                class_id=int(result.classes[d]),
+                box=result.boxes[d].copy(),
+                first_seen=timestamp,
+                last_seen=timestamp,
+                max_confidence=float(result.confidences[d]),
+                first_box=result.boxes[d].copy()
+            )
+            self.tracks.append(track)
+            track_ids[d] = track.id
+            if self.min_hits <= 1:
+                track.confirmed = True
+                births.append(track)
+
+        deaths = []
+        alive = []
+        for i, track in enumerate(self.tracks):
+            if i not in matched_tracks and timestamp - track.last_seen > self.max_age:
+                if track.confirmed:
+                    deaths.append(track)
+            else:
+                alive.append(track)
+        self.tracks = alive
+
+        for track in births + changed:
+            track.persisted_box = track.box.copy()
+        return TrackUpdate(track_ids, births, deaths, changed)
+
+
+class Tracker:
+    """
+    Per-source tracking stage between inference and persistence.
+
+    When enabled, a frame is only persisted on a track birth, death or
+    significant move, and every stored detection carries its track id.
+    Summaries of finished tracks are kept in a bounded Redis list.
+    """
+    NAME = "TRACKER"
+    FINISHED_KEY = "tracks:finished"
+
+    def __init__(
+        self,
+        enabled: bool = settings.TRACKER_ENABLED,
+        history: int = settings.TRACKER_HISTORY
+    ) -> None:
+        self.enabled = enabled
+        self.history = history
+        self.sources: dict[str, SourceTracker] = {}
+
+    def update(
+        self,
+        source: str,
+        result: DetectionResult,
+        timestamp: Optional[float] = None
+    ) -> TrackUpdate:
+        tracker = self.sources.get(source)
+        if tracker is None:
+            tracker = self.sources[source] = SourceTracker(source)
+        return tracker.update(result, timestamp or time.time())
+
+    async def record_finished(
+        self,
+        tracks: List[Track],
+        names: dict[int, str]
+    ) -> None:
+        if not tracks:
+            return
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for track in tracks:
+                    pipe.lpush(self.FINISHED_KEY, json.dumps(track.summary(names)))
+                pipe.ltrim(self.FINISHED_KEY, 0, self.history - 1)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"[{self.NAME}]: Could not store track summaries: {e}")
+
+    def active(
+        self,
+        names: dict[int, str],
+        source: Optional[str] = None
+    ) -> List[dict[str, Any]]:
+        return [
+            track.summary(names)
+            for name, tracker in self.sources.items()
+            if source is None or name == source
+            for track in tracker.tracks
+            if track.confirmed
+        ]
+
+    async def finished(
+        self,
+        limit: int = 100,
+        source: Optional[str] = None
+    ) -> List[dict[str, Any]]:
+        raw = await redis_client.lrange(self.FINISHED_KEY, 0, self.history - 1)
+        summaries = [json.loads(item) for item in raw]
+        if source is not None:
+            summaries = [s for s in summaries if s["source"] == source]
+        return summaries[:limit]
+
+
+tracker: Tracker = Tracker()
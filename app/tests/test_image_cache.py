@@ -0,0 +1,66 @@
+"""
+DiskImageCache pinning. Imports the app's modules, so run it inside the
+app container with the compose stack up:
+
+    pip install -r requirements.test.txt && python -m pytest tests
+"""
+import asyncio
+import gc
+import time
+
+from src.image_cache import DiskImageCache
+
+KEY = "2020-01-01/frame.jpg"
+DATA = b"\xff\xd8" + b"x" * 1000 + b"\xff\xd9"
+
+
+async def _chunks():
+    yield DATA
+
+
+def _cache(tmp_path) -> DiskImageCache:
+    cache = DiskImageCache(str(tmp_path), max_bytes=1024 * 1024)
+    async def fill():
+        async for _ in cache.fill(KEY, '"etag"', len(DATA), _chunks()):
+            pass
+    asyncio.run(fill())
+    assert cache.lookup(KEY) is not None
+    return cache
+
+
+def test_dropped_unread_entry_is_purged(tmp_path):
+    cache = _cache(tmp_path)
+    image = cache.open(KEY, 0, len(DATA) - 1)
+    # e.g. the client went away before the response body was sent
+    del image
+    gc.collect()
+
+    assert cache.purge_expired(time.time()) == 1
+    assert not cache._path(KEY, ".img").exists()
+    assert not cache._path(KEY, ".json").exists()
+    assert not cache._readers and not cache._doomed
+
+
+def test_closed_unread_entry_is_purged(tmp_path):
+    cache = _cache(tmp_path)
+    image = cache.open(KEY, 0, len(DATA) - 1)
+    asyncio.run(image.close())
+
+    cache.purge_expired(time.time())
+    assert not cache._path(KEY, ".img").exists()
+    assert not cache._readers
+
+
+def test_purge_waits_for_reader(tmp_path):
+    cache = _cache(tmp_path)
+    image = cache.open(KEY, 0, len(DATA) - 1)
+    cache.purge_expired(time.time())
+    assert cache.lookup(KEY) is None
+    # Still on disk for the stream that is being served
+    assert cache._path(KEY, ".img").exists()
+
+    async def read():
+        return b"".join([chunk async for chunk in image.chunks])
+    assert asyncio.run(read()) == DATA
+    assert not cache._path(KEY, ".img").exists()
+    assert not cache._readers and not cache._doomed
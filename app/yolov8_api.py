@@ -1,20 +1,36 @@
 from __future__ import annotations
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
-import uvicorn, asyncio, tempfile, os, json
-from typing import Any
+import uvicorn, asyncio, os, json, time, uuid
+from io import BytesIO
+from typing import Any, Optional
 
 from src.config import settings
-from src.db_util import db
+from src.db_util import BaseDb, db
 from src.image_storage import minio_storage
+from src.image_cache import (
+    image_store,
+    parse_range,
+    etag_matches,
+    RangeNotSatisfiable
+)
 from src.util import DetectionResponse
 from src.stream_processor import enqueue_image, process_queue
+from src.retention import run_retention
+from src.metrics import STAGE_SECONDS, update_queue_depths
+from src.model_client import model_client
+from src.result_cache import CachedResult, result_cache, content_hash
+from src.tracker import tracker
+from src.tracing import trace_store
 from src.util import logger
 
-from shared_config import redis_client
+from shared_config.redis_client import redis_client
+from shared_config.task_queue import QueueFull
+from shared_config.wire import Frame, Letterbox, Trace, WireError
 from shared_config.settings import (
-    REDIS_MODEL_REQUEST_QUEUE,
     REDIS_MODEL_RESULT_QUEUE,
     LOG_DIR
 )
@@ -28,63 +44,170 @@ NAME: str = "yolov8_server"
 async def startup_event():
     os.makedirs(settings.LOG_DIR, exist_ok=True)
     asyncio.create_task(process_queue())
+    asyncio.create_task(run_retention())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    db.analytics.save()
 
 @app.post("/stream")
-async def stream_image(file: UploadFile = File(...)):
-    """Receive images and enqueue them for background processing."""
-    contents = await file.read()
-    await enqueue_image(contents, file.filename)
+async def stream_image(
+    request: Request,
+    file: UploadFile = File(...),
+    source: Optional[str] = Form(None),
+    x_source_id: Optional[str] = Header(None),
+    x_letterbox: Optional[str] = Header(None),
+    x_trace: Optional[str] = Header(None)
+):
+    """Receive images and enqueue them for background processing.
+
+    Frames are attributed to a source (form field, X-Source-Id header or
+    client address) for per-source quotas; a full queue answers 429.
+    Edge devices that scaled the frame send X-Letterbox
+    ("scale,pad_x,pad_y,width,height") so boxes can be mapped back, and
+    may send X-Trace ("trace_id;captured=ts;sent=ts") to have the frame's
+    timeline recorded under their own id.
+    """
+    received_at = time.time()
+    trace = None
+    if x_trace and trace_store.enabled:
+        try:
+            trace = Trace.parse(x_trace)
+        except WireError as e:
+            # Tracing is diagnostic; the frame itself is fine
+            logger.warning(f"[{NAME}]: Ignoring trace header: {e}")
+    if trace is None and trace_store.enabled:
+        trace = Trace(str(uuid.uuid4()))
+    letterbox = None
+    if x_letterbox:
+        try:
+            letterbox = Letterbox.parse(x_letterbox)
+        except WireError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    source = (
+        source
+        or x_source_id
+        or (request.client.host if request.client else None)
+        or "default"
+    )[:64]
+    try:
+        with STAGE_SECONDS.labels("ingest").time():
+            contents = await file.read()
+            admission = await enqueue_image(
+                contents,
+                file.filename,
+                file.content_type,
+                source,
+                letterbox,
+                trace.mark("received", received_at) if trace else None
+            )
+    except QueueFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
     return {
-        "message": f"{file.filename} queued for detection"
+        "message": f"{file.filename} queued for detection",
+        "source": source,
+        "dropped": admission.dropped,
+        "trace_id": trace.trace_id if trace else None
     }
 
+@app.get("/metrics")
+async def metrics() -> Response:
+    """Prometheus metrics of the API process."""
+    await update_queue_depths()
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/health")
 async def health_check():
     """Health check, returns 200 if the app is running."""
     return {"status": "healthy"}
 
+async def stored_detection_exists(cached: CachedResult) -> bool:
+    """Whether the detection a cache entry points at is still that frame.
+
+    Local ids are renumbered when they collide with Postgres ones on sync,
+    and retention removes old rows, so the id alone is not enough."""
+    if cached.detection_id is None:
+        return False
+    try:
+        record = await db.get_detection_by_id(cached.detection_id)
+    except Exception as e:
+        logger.warning(f"[{NAME}]: Could not check detection {cached.detection_id}: {e}")
+        return False
+    return record is not None and record[BaseDb.COL_IMAGE_PATH] == cached.image_path
+
 @app.post("/detect")
 async def detect(
     file: UploadFile = File(...)
 ) -> JSONResponse:
-    with tempfile.NamedTemporaryFile(
-        delete=False,
-        suffix=".jpg"
-    ) as tmp:
-        tmp.write(await file.read())
-        tmp.seek(0)
-        image_path = minio_storage.save_image(
-            tmp,
-            filename = file.filename
-        )
-        logger.info(f"[{NAME}]: Saved image with path '{image_path}'.")
-        request_id = str(uuid.uuid4())
+    image_bytes = await file.read()
+    request_id = str(uuid.uuid4())
 
-        payload = pickle.dumps({
-            "request_id": request_id,
-            "filename": file.filename,
-            "image_bytes": image_bytes,
-            "minio_path": str(minio_path),
-        })
-
-        # Send job
-        await redis_client.rpush(settings.REDIS_MODEL_REQUEST_QUEUE, payload)
+    model = await model_client.get_model_version()
+    digest = content_hash(image_bytes) if model else None
+    cached = (
+        await result_cache.get(model, digest, request_id)
+        if digest is not None else None
+    )
+    if cached is not None and not await stored_detection_exists(cached):
+        # Renumbered by a sync or expired by retention; store it again
+        cached.detection_id = None
+    if cached is not None and cached.detection_id is not None:
+        # Same image already analysed and stored: answer from the cache
+        logger.info(f"[{NAME}]: Result cache hit, detection {cached.detection_id}.")
+        return JSONResponse(
+            {
+                "message": "Detection complete",
+                "id": cached.detection_id,
+                "image": file.filename,
+                "path": cached.image_path,
+                "detection": cached.result.to_records(
+                    await model_client.get_class_names()
+                ),
+                "cached": True
+            }
+        )
 
-        # Listen for result
-        result_key = f"{settings.REDIS_MODEL_RESULT_QUEUE_PREFIX}{request_id}"
-        _, result_raw = await redis_client.blpop(result_key)
-        result = pickle.loads(result_raw)
-        detection_data = result["detection"]
+    image_path = await minio_storage.save_image(
+        BytesIO(image_bytes),
+        filename = f"{request_id}_{file.filename}"
+    )
+    logger.info(f"[{NAME}]: Saved image with path '{image_path}'.")
 
-    
-    detection_data: json = results[0].tojson()
+    frame = Frame(
+        request_id=request_id,
+        filename=file.filename,
+        image_bytes=image_bytes,
+        content_type=file.content_type
+    )
+    if cached is not None:
+        result = cached.result
+    else:
+        try:
+            result = await model_client.infer(frame)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=504,
+                detail="Timed out waiting for inference"
+            )
+        if digest is not None:
+            await result_cache.put(model, digest, result)
+    detection_data: list[dict[str, Any]] = result.to_records(
+        await model_client.get_class_names()
+    )
 
-    detection_id = db.insert_detection(
+    detection_id = await db.insert_detection(
         str(image_path),
-        json.loads(detection_data)
+        detection_data,
+        image_size=result.image_size
     )
 
     logger.info(f"[{NAME}]: Saved detection {detection_id}.")
+    if digest is not None:
+        await result_cache.set_detection(model, digest, detection_id, str(image_path))
 
     return JSONResponse(
         {
@@ -92,19 +215,117 @@ async def detect(
             "id": detection_id,
             "image": file.filename,
             "path": str(image_path),
-            "detection": json.loads(detection_data)
+            "detection": detection_data
         }
     )
 
+@app.get("/cache/stats")
+async def get_cache_stats() -> JSONResponse:
+    """Hit/miss counters of the inference result cache."""
+    model = await model_client.get_model_version()
+    return JSONResponse(await result_cache.stats(model or "unknown"))
+
+@app.get("/tracks")
+async def get_tracks(
+    source: Optional[str] = None,
+    limit: int = 100
+) -> JSONResponse:
+    """Active tracks and summaries of the most recently finished ones."""
+    if not tracker.enabled:
+        raise HTTPException(status_code=404, detail="Tracking is disabled")
+    names = await model_client.get_class_names()
+    return JSONResponse({
+        "active": tracker.active(names, source),
+        "finished": await tracker.finished(limit, source)
+    })
+
+@app.get("/trace/{trace_id}")
+async def get_trace(trace_id: str) -> JSONResponse:
+    """Hop-by-hop timeline of one completed frame."""
+    timeline = await trace_store.get(trace_id)
+    if timeline is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return JSONResponse(timeline)
+
+@app.get("/traces/slowest")
+async def get_slowest_traces(limit: int = 20) -> JSONResponse:
+    """The slowest of the retained timelines, slowest first."""
+    if not trace_store.enabled:
+        raise HTTPException(status_code=404, detail="Tracing is disabled")
+    return JSONResponse(await trace_store.slowest(min(limit, 1000)))
+
+@app.get("/analytics/counts")
+async def get_analytics_counts(
+    source: Optional[str] = None,
+    buckets: int = 60
+) -> JSONResponse:
+    """Per-class object counts for the last `buckets` time buckets
+    (minutes by default), from the incrementally kept aggregates."""
+    if not db.analytics.enabled:
+        raise HTTPException(status_code=404, detail="Analytics are disabled")
+    return JSONResponse(db.analytics.counts(source, buckets))
+
+@app.get("/analytics/heatmap")
+async def get_analytics_heatmap(
+    source: Optional[str] = None,
+    class_name: Optional[str] = None
+) -> JSONResponse:
+    """Grid of how often object centres fell in each cell, rows top to
+    bottom, in frame-relative cells."""
+    if not db.analytics.enabled:
+        raise HTTPException(status_code=404, detail="Analytics are disabled")
+    heatmap = db.analytics.heatmap(source, class_name)
+    if heatmap is None:
+        raise HTTPException(status_code=404, detail=f"No objects of class {class_name!r}")
+    return JSONResponse({
+        "source": source,
+        "class_name": class_name,
+        "grid": heatmap.shape[0],
+        "total": int(heatmap.sum()),
+        "heatmap": heatmap.tolist()
+    })
+
 @app.get("/detections")
-async def get_all_detections() -> JSONResponse:
+async def get_all_detections(
+    class_name: Optional[str] = None,
+    min_confidence: Optional[float] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    source: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20
+) -> JSONResponse:
+    """Most recent detections, or with any filter or cursor, a page of
+    matching ones from Postgres. since/until are unix timestamps; pass
+    next_cursor back as cursor for the following page."""
+    limit = max(1, min(limit, settings.DETECTIONS_PAGE_MAX))
+    filters = (class_name, min_confidence, since, until, source, cursor)
+    if all(value is None for value in filters):
+        return JSONResponse(
+            {"detections": await db.get_recent(limit=limit)}
+        )
+    try:
+        records, next_cursor = await db.query(
+            class_name=class_name,
+            min_confidence=min_confidence,
+            since=since,
+            until=until,
+            source=source,
+            cursor=cursor,
+            limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"[{NAME}]: Detection query failed: {e}")
+        raise HTTPException(status_code=503, detail="Detection index unavailable")
     return JSONResponse(
-        {"detections": db.get_recent(limit=20)}
+        {"detections": records, "next_cursor": next_cursor}
     )
 
 @app.get("/detection/{id}")
-async def get_detection(id: int):
-    detection = db.get_detection_by_id(id)
+async def get_detection(id: int, request: Request):
+    detection = await db.get_detection_by_id(id)
     if detection is None:
         raise HTTPException(
             status_code=404,
@@ -113,19 +334,54 @@ async def get_detection(id: int):
     logger.info(f"[{NAME}]: Fetched detection: s{detection}")
     
     image_path: str = detection["image_path"]
-    detection_data: list[dict[str, Any]] = json.loads(detection["detection_data"])
+    detection_data: list[dict[str, Any]] = detection["detection_data"]
+
+    headers: dict[str, str] = {
+        "X-Detection-Data": json.dumps(detection_data),
+        "Accept-Ranges": "bytes",
+        # Object keys are never reused, so the image behind an id is fixed
+        "Cache-Control": "private, max-age=86400"
+    }
+    range_header = request.headers.get("range")
+    if_none_match = request.headers.get("if-none-match")
+
+    start, end = 0, None
+    if range_header or if_none_match:
+        # Conditional and partial requests need size and ETag up front
+        stat = await image_store.stat(image_path)
+        if stat is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        headers["ETag"] = stat.etag
+        if if_none_match and etag_matches(if_none_match, stat.etag):
+            return Response(status_code=304, headers=headers)
+        if range_header:
+            try:
+                byte_range = parse_range(range_header, stat.size)
+            except RangeNotSatisfiable:
+                headers["Content-Range"] = f"bytes */{stat.size}"
+                return Response(status_code=416, headers=headers)
+            if byte_range is not None:
+                start, end = byte_range
 
-    def image_stream() -> Any:
-        with minio_storage.load_image(image_path) as image_file:
-            while chunk := image_file.read(1024):
-                yield chunk
+    image = await image_store.open(image_path, start, end)
+    if image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    headers["ETag"] = image.etag
+    headers["Content-Length"] = str(image.end - image.start + 1)
+    status_code = 200
+    if end is not None:
+        status_code = 206
+        headers["Content-Range"] = f"bytes {image.start}-{image.end}/{image.size}"
     
     return StreamingResponse(
-        image_stream(),
+        image.chunks,
+        status_code=status_code,
         media_type="image/jpeg",
-        headers={
-            "X-Detection-Data": json.dumps(detection_data)
-        })
+        headers=headers,
+        # Also releases a cache pin when the body was never iterated
+        background=BackgroundTask(image.close)
+    )
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=5000)
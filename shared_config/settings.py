@@ -1,3 +1,5 @@
+import os
+
 REDIS_HOST = "redis"
 REDIS_PORT = 6379
 REDIS_DB = 0
@@ -6,6 +8,56 @@ REDIS_TASK_QUEUE = "task_queue"
 REDIS_MODEL_REQUEST_QUEUE = "model_request_queue"
 REDIS_MODEL_RESULT_QUEUE = "model_result_queue"
 REDIS_STORAGE_QUEUE = "storage_queue"
+REDIS_MODEL_PROCESSING_QUEUE = "model_processing_queue"
+REDIS_MODEL_INFO_KEY = "model_info"
+REDIS_MODEL_ATTEMPTS_KEY = "model_request_attempts"
+REDIS_MODEL_DEAD_LETTER_QUEUE = "model_dead_letter_queue"
+
+# Admission control for the ingest task queue; 0 disables a limit.
+# TASK_QUEUE_POLICY is "reject" (answer 429) or "drop_oldest" (evict the
+# oldest queued frames of the same source to make room).
+TASK_QUEUE_MAX_FRAMES = int(os.getenv("TASK_QUEUE_MAX_FRAMES", 256))
+TASK_QUEUE_MAX_BYTES = int(os.getenv("TASK_QUEUE_MAX_BYTES", 128 * 1024 * 1024))
+TASK_QUEUE_SOURCE_MAX_FRAMES = int(os.getenv("TASK_QUEUE_SOURCE_MAX_FRAMES", 32))
+TASK_QUEUE_POLICY = os.getenv("TASK_QUEUE_POLICY", "reject")
+# Seconds clients are told to back off for when a frame is rejected
+TASK_QUEUE_RETRY_AFTER = int(os.getenv("TASK_QUEUE_RETRY_AFTER", 1))
+
+# Micro-batching for the inference worker: up to MODEL_BATCH_SIZE requests
+# are collected, waiting at most MODEL_BATCH_MAX_WAIT_MS for the batch to fill.
+MODEL_BATCH_SIZE = int(os.getenv("MODEL_BATCH_SIZE", 8))
+MODEL_BATCH_MAX_WAIT_MS = float(os.getenv("MODEL_BATCH_MAX_WAIT_MS", 10))
+
+# Number of model worker processes and intra-op threads per worker.
+# 0 threads means "split the available cores evenly between workers".
+MODEL_WORKERS = int(os.getenv("MODEL_WORKERS", 1))
+MODEL_THREADS_PER_WORKER = int(os.getenv("MODEL_THREADS_PER_WORKER", 0))
+
+# Port of the model worker's Prometheus endpoint (0 disables it)
+MODEL_METRICS_PORT = int(os.getenv("MODEL_METRICS_PORT", 9100))
+# Directory the model worker processes write their metric samples to
+MODEL_METRICS_DIR = os.getenv("MODEL_METRICS_DIR", "/tmp/model_metrics")
+
+# A job left behind by MODEL_MAX_ATTEMPTS dead workers is moved to the
+# dead-letter list (newest MODEL_DEAD_LETTER_MAX kept) instead of retried
+MODEL_MAX_ATTEMPTS = int(os.getenv("MODEL_MAX_ATTEMPTS", 3))
+MODEL_DEAD_LETTER_MAX = int(os.getenv("MODEL_DEAD_LETTER_MAX", 100))
+
+# Seconds an uncollected result list is kept in Redis
+MODEL_RESULT_TTL = int(os.getenv("MODEL_RESULT_TTL", 300))
+
+# Shared-memory ring for frame payloads between services on one host.
+# Redis messages then carry only a slot descriptor; frames larger than a
+# slot, or peers that do not map the same ring, fall back to inline bytes.
+SHM_ENABLED = os.getenv("SHM_ENABLED", "1") == "1"
+SHM_RING_PATH = os.getenv("SHM_RING_PATH", "/dev/shm/edge_frames/ring")
+SHM_SLOTS = int(os.getenv("SHM_SLOTS", 64))
+SHM_SLOT_SIZE = int(os.getenv("SHM_SLOT_SIZE", 1024 * 1024))
+# Seconds after which a slot whose holders never released it may be
+# reclaimed; renewed on every hand-off, so it must exceed the longest wait
+# in a single queue (frames whose slot was reclaimed are dropped and
+# counted as "expired")
+SHM_SLOT_TTL = int(os.getenv("SHM_SLOT_TTL", 120))
 
 POSTGRES_HOST = "postgres"
 POSTGRES_PORT = 5432
@@ -0,0 +1,335 @@
+"""
+Shared-memory ring of frame payloads for services on one host.
+
+The ring is a single file on a tmpfs (SHM_RING_PATH) that every service
+maps:
+
+    header   magic, version, slot count, slot size, ring id (16 bytes)
+    slots    slot count x slot size, each one
+             generation (u32), payload length (u32), payload
+
+A frame whose payload lives in the ring travels through Redis with an
+empty payload and an EXT_SHM_SLOT extension holding a SlotRef (ring id,
+slot, generation, length). Readers map the slot instead of copying the
+bytes out of a Redis message.
+
+Slot ownership is kept in Redis, so it works across containers:
+
+- Free slots are kept in a list.
+- A hash holds each slot's reference count, and a second hash its
+  generation.
+- A lease zset reclaims slots whose holders died without releasing them.
+  Leases last SHM_SLOT_TTL and are renewed whenever the reference count
+  changes and when a queued frame is picked up (touch), so the TTL must
+  exceed the longest time a frame waits in one queue. Expired slots are
+  only reclaimed when the ring is full.
+
+Every reuse bumps the generation, so a descriptor that outlived its slot
+is detected instead of silently reading another frame.
+
+A reader that does not map the same ring (another host, or a missing
+volume) sees a ring id it does not know. The model worker advertises its
+ring id in model_info, and senders fall back to inline bytes when it
+differs from theirs.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, replace
+from typing import Optional
+import logging
+import mmap
+import os
+import struct
+import time
+import uuid
+
+from shared_config.redis_client import redis_client
+from shared_config.settings import (
+    SHM_ENABLED,
+    SHM_RING_PATH,
+    SHM_SLOTS,
+    SHM_SLOT_SIZE,
+    SHM_SLOT_TTL
+)
+from shared_config.wire import Frame, EXT_SHM_SLOT
+
+logger = logging.getLogger("shm_ring")
+
+RING_MAGIC = b"EFRING\x00\x00"
+RING_VERSION = 1
+RING_HEADER = struct.Struct("!8sIII16s")
+RING_HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct("!II")
+SLOT_REF = struct.Struct("!16sIII")
+
+# KEYS: free list, refs hash, generation hash, lease zset, init flag
+# ARGV: slot count, initial refs, now, lease ttl
+# Returns {slot, generation} or false when every slot is taken
+ACQUIRE_SCRIPT = """
+if redis.call('SET', KEYS[5], 1, 'NX') then
+    redis.call('DEL', KEYS[1], KEYS[2], KEYS[4])
+    for i = 0, tonumber(ARGV[1]) - 1 do
+        redis.call('RPUSH', KEYS[1], i)
+    end
+end
+local slot = redis.call('LPOP', KEYS[1])
+if not slot then
+    -- Reclaim a slot whose holders died without releasing it
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', ARGV[3], 'LIMIT', 0, 1)
+    if #expired == 0 then
+        return false
+    end
+    slot = expired[1]
+end
+local gen = redis.call('HINCRBY', KEYS[3], slot, 1) % 4294967296
+redis.call('HSET', KEYS[2], slot, ARGV[2])
+redis.call('ZADD', KEYS[4], tonumber(ARGV[3]) + tonumber(ARGV[4]), slot)
+return {tonumber(slot), gen}
+"""
+
+# KEYS: refs hash, generation hash, lease zset, free list
+# ARGV: slot, generation, delta, now, lease ttl
+# Returns the new reference count, or -1 if the slot was reused
+ADJUST_SCRIPT = """
+local gen = redis.call('HGET', KEYS[2], ARGV[1])
+if not gen
+    or tonumber(gen) % 4294967296 ~= tonumber(ARGV[2])
+    or redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return -1
+end
+local refs = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[3])
+if refs <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    redis.call('ZREM', KEYS[3], ARGV[1])
+    redis.call('RPUSH', KEYS[4], ARGV[1])
+    return 0
+end
+redis.call('ZADD', KEYS[3], tonumber(ARGV[4]) + tonumber(ARGV[5]), ARGV[1])
+return refs
+"""
+
+
+@dataclass
+class SlotRef:
+    ring_id: bytes
+    slot: int
+    generation: int
+    length: int
+
+    def pack(self) -> bytes:
+        return SLOT_REF.pack(self.ring_id, self.slot, self.generation, self.length)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> SlotRef:
+        return cls(*SLOT_REF.unpack(data))
+
+
+class FrameRing:
+    """A mapped ring file plus its Redis-side slot bookkeeping."""
+
+    def __init__(
+        self,
+        path: str = SHM_RING_PATH,
+        slots: int = SHM_SLOTS,
+        slot_size: int = SHM_SLOT_SIZE,
+        lease_ttl: int = SHM_SLOT_TTL
+    ) -> None:
+        self.path = path
+        self.lease_ttl = lease_ttl
+        self._map, self.ring_id, self.slots, self.slot_size = self._open(
+            path, slots, slot_size
+        )
+        self._view = memoryview(self._map)
+        prefix = f"shm:{self.ring_id.hex()}"
+        self.free_key = f"{prefix}:free"
+        self.refs_key = f"{prefix}:refs"
+        self.gen_key = f"{prefix}:gen"
+        self.lease_key = f"{prefix}:leases"
+        self.init_key = f"{prefix}:init"
+        self._acquire = redis_client.register_script(ACQUIRE_SCRIPT)
+        self._adjust = redis_client.register_script(ADJUST_SCRIPT)
+
+    @staticmethod
+    def _open(path: str, slots: int, slot_size: int):
+        """Create the ring file, or map the one another service created."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = RING_HEADER_SIZE + slots * slot_size
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666)
+            created = True
+        except FileExistsError:
+            fd = os.open(path, os.O_RDWR)
+            created = False
+        try:
+            if created:
+                os.ftruncate(fd, size)
+                ring_id = uuid.uuid4().bytes
+                os.pwrite(fd, RING_HEADER.pack(
+                    RING_MAGIC, RING_VERSION, slots, slot_size, ring_id
+                ), 0)
+            else:
+                # The creator may still be writing the header
+                for _ in range(50):
+                    header = os.pread(fd, RING_HEADER.size, 0)
+                    if header[:len(RING_MAGIC)] == RING_MAGIC:
+                        break
+                    time.sleep(0.02)
+                else:
+                    raise OSError(f"{path} is not a frame ring")
+                _, _, slots, slot_size, ring_id = RING_HEADER.unpack(header)
+                size = RING_HEADER_SIZE + slots * slot_size
+            return mmap.mmap(fd, size), ring_id, slots, slot_size
+        finally:
+            os.close(fd)
+
+    @property
+    def max_payload(self) -> int:
+        return self.slot_size - SLOT_HEADER.size
+
+    def _offset(self, slot: int) -> int:
+        return RING_HEADER_SIZE + slot * self.slot_size
+
+    async def put(self, data: bytes | memoryview, refs: int = 1) -> Optional[SlotRef]:
+        """Copy a payload into a free slot held by `refs` references.
+
+        Returns None if it does not fit or the ring is full."""
+        if len(data) > self.max_payload:
+            return None
+        claimed = await self._acquire(
+            keys=[self.free_key, self.refs_key, self.gen_key, self.lease_key, self.init_key],
+            args=[self.slots, refs, time.time(), self.lease_ttl]
+        )
+        if not claimed:
+            return None
+        slot, generation = int(claimed[0]), int(claimed[1])
+        offset = self._offset(slot)
+        start = offset + SLOT_HEADER.size
+        # Invalidate first so stale readers never accept a half-written slot
+        SLOT_HEADER.pack_into(self._map, offset, 0, 0)
+        self._view[start:start + len(data)] = data
+        SLOT_HEADER.pack_into(self._map, offset, generation, len(data))
+        return SlotRef(self.ring_id, slot, generation, len(data))
+
+    def view(self, ref: SlotRef) -> Optional[memoryview]:
+        """Map a slot's payload, or None if it is not in this ring or was reused."""
+        if ref.ring_id != self.ring_id or not self.is_current(ref):
+            return None
+        start = self._offset(ref.slot) + SLOT_HEADER.size
+        return self._view[start:start + ref.length]
+
+    def is_current(self, ref: SlotRef) -> bool:
+        """Whether the slot still holds the payload `ref` was issued for."""
+        generation, length = SLOT_HEADER.unpack_from(self._map, self._offset(ref.slot))
+        return generation == ref.generation and length == ref.length
+
+    async def _adjust_refs(self, ref: SlotRef, delta: int) -> int:
+        return await self._adjust(
+            keys=[self.refs_key, self.gen_key, self.lease_key, self.free_key],
+            args=[ref.slot, ref.generation, delta, time.time(), self.lease_ttl]
+        )
+
+    async def retain(self, ref: SlotRef, count: int = 1) -> bool:
+        return await self._adjust_refs(ref, count) > 0
+
+    async def release(self, ref: SlotRef) -> None:
+        await self._adjust_refs(ref, -1)
+
+
+def open_frame_ring() -> Optional[FrameRing]:
+    if not SHM_ENABLED:
+        return None
+    try:
+        return FrameRing()
+    except Exception as e:
+        logger.warning(f"Shared-memory frame ring unavailable, sending frames inline: {e}")
+        return None
+
+
+frame_ring: Optional[FrameRing] = open_frame_ring()
+
+
+def ring_id() -> Optional[str]:
+    """Hex id of the ring this process maps, for peers to compare with."""
+    return frame_ring.ring_id.hex() if frame_ring is not None else None
+
+
+def slot_ref(frame: Frame) -> Optional[SlotRef]:
+    raw = frame.extensions.get(EXT_SHM_SLOT)
+    return SlotRef.unpack(raw) if raw else None
+
+
+async def offload(frame: Frame, refs: int = 1) -> Frame:
+    """Move an inline payload into the ring; unchanged if it cannot be."""
+    if frame_ring is None or slot_ref(frame) is not None:
+        return frame
+    ref = await frame_ring.put(frame.image_bytes, refs)
+    if ref is None:
+        return frame
+    return replace(
+        frame,
+        image_bytes=b"",
+        extensions={**frame.extensions, EXT_SHM_SLOT: ref.pack()}
+    )
+
+
+def payload(frame: Frame) -> Optional[bytes | memoryview]:
+    """The frame's image bytes, mapped from the ring when offloaded.
+
+    None if the slot is not reachable from this process."""
+    ref = slot_ref(frame)
+    if ref is None:
+        return frame.image_bytes
+    if frame_ring is None:
+        return None
+    return frame_ring.view(ref)
+
+
+def is_current(frame: Frame) -> bool:
+    """Re-check after reading a mapped payload that it was not reused meanwhile."""
+    ref = slot_ref(frame)
+    return ref is None or (frame_ring is not None and frame_ring.is_current(ref))
+
+
+def inline(frame: Frame) -> Optional[Frame]:
+    """A copy of the frame carrying its payload inline, for remote peers."""
+    data = payload(frame)
+    if data is None:
+        return None
+    extensions = dict(frame.extensions)
+    extensions.pop(EXT_SHM_SLOT, None)
+    return replace(frame, image_bytes=bytes(data), extensions=extensions)
+
+
+def queued_size(frame: Frame, packed: bytes) -> int:
+    """Bytes a queued frame holds: its message plus its ring slot, if any."""
+    ref = slot_ref(frame)
+    return len(packed) + (ref.length if ref is not None else 0)
+
+
+async def touch(frame: Frame) -> bool:
+    """Renew the lease of the frame's slot when a consumer picks it up.
+
+    False if the slot was already reclaimed (its lease ran out while the
+    frame waited) and the payload is gone; True otherwise, including for
+    inline frames and slots of a ring this process does not map."""
+    ref = slot_ref(frame)
+    if ref is None or frame_ring is None or ref.ring_id != frame_ring.ring_id:
+        return True
+    return await frame_ring.retain(ref, 0)
+
+
+async def retain(frame: Frame, count: int = 1) -> bool:
+    ref = slot_ref(frame)
+    if ref is None or frame_ring is None or ref.ring_id != frame_ring.ring_id:
+        return False
+    return await frame_ring.retain(ref, count)
+
+
+async def release(frame: Frame) -> None:
+    """Drop one reference to the frame's slot, if it has one."""
+    ref = slot_ref(frame)
+    if ref is None or frame_ring is None or ref.ring_id != frame_ring.ring_id:
+        return
+    try:
+        await frame_ring.release(ref)
+    except Exception as e:
+        logger.error(f"Failed to release slot {ref.slot}: {e}")
@@ -0,0 +1,224 @@
+"""
+Admission-controlled ingest queue (task_queue).
+
+Frames are stored in one Redis list per source, task_queue:src:{source}.
+The task_queue list itself only holds source ids, one per queued frame in
+arrival order: a consumer pops an id, then takes the oldest frame of that
+source. Frame and byte totals are kept in the task_queue:stats hash so the
+admission checks run atomically in a single script without scanning.
+
+When a limit would be exceeded the frame is either rejected (QueueFull) or,
+with the drop_oldest policy, the oldest queued frames of the *same* source
+are evicted to make room. A source can never evict another source's frames,
+and the per-source quota keeps one camera from filling the whole queue.
+
+Byte limits count what a frame holds while queued, which for a frame
+offloaded to the shared-memory ring is its slot payload as well as the
+message. Each queued item is therefore prefixed with its accounted size
+(u32, big-endian); the prefix never leaves the scripts.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Optional
+
+from shared_config.redis_client import redis_client
+from shared_config.settings import (
+    REDIS_TASK_QUEUE,
+    TASK_QUEUE_MAX_FRAMES,
+    TASK_QUEUE_MAX_BYTES,
+    TASK_QUEUE_SOURCE_MAX_FRAMES,
+    TASK_QUEUE_POLICY,
+    TASK_QUEUE_RETRY_AFTER
+)
+
+POLICY_REJECT = "reject"
+POLICY_DROP_OLDEST = "drop_oldest"
+
+# KEYS: token list, source list, stats hash
+# ARGV: source, frame, max frames, max bytes, per-source max frames,
+#       drop oldest (1/0), accounted size
+# Returns {1, evicted frames...} when admitted, {0} when rejected
+ADMIT_SCRIPT = """
+local size = tonumber(ARGV[7])
+local max_frames = tonumber(ARGV[3])
+local max_bytes = tonumber(ARGV[4])
+local source_max = tonumber(ARGV[5])
+local bytes_field = 'bytes:' .. ARGV[1]
+
+local frames = tonumber(redis.call('HGET', KEYS[3], 'frames') or '0')
+local bytes = tonumber(redis.call('HGET', KEYS[3], 'bytes') or '0')
+local queued = redis.call('LLEN', KEYS[2])
+local queued_bytes = tonumber(redis.call('HGET', KEYS[3], bytes_field) or '0')
+
+local function fits(f, b, q)
+    return (max_frames <= 0 or f + 1 <= max_frames)
+        and (max_bytes <= 0 or b + size <= max_bytes)
+        and (source_max <= 0 or q + 1 <= source_max)
+end
+
+local dropped = 0
+local reply = {1}
+if not fits(frames, bytes, queued) then
+    -- Only drop if evicting this source's backlog can make room at all
+    if ARGV[6] ~= '1' or not fits(frames - queued, bytes - queued_bytes, 0) then
+        return {0}
+    end
+    while not fits(frames, bytes, queued) do
+        local old = redis.call('LPOP', KEYS[2])
+        local old_size = struct.unpack('>I4', old)
+        frames = frames - 1
+        bytes = bytes - old_size
+        queued = queued - 1
+        queued_bytes = queued_bytes - old_size
+        dropped = dropped + 1
+        reply[#reply + 1] = string.sub(old, 5)
+    end
+end
+
+redis.call('RPUSH', KEYS[2], struct.pack('>I4', size) .. ARGV[2])
+if dropped == 0 then
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+elseif dropped > 1 then
+    -- The new frame reuses one evicted frame's token; retire the rest
+    redis.call('LREM', KEYS[1], dropped - 1, ARGV[1])
+end
+redis.call('HSET', KEYS[3],
+    'frames', frames + 1,
+    'bytes', bytes + size,
+    bytes_field, queued_bytes + size)
+return reply
+"""
+
+# Takes the next token and the frame it stands for in one step, so a
+# consumer dying in between cannot leave a token without a frame or the
+# reverse. The source list name is derived from the token, which is fine
+# on the single Redis instance this queue lives on.
+# KEYS: token list, stats hash
+# ARGV: source list prefix
+# Returns {source, frame}, {source, false} for an orphaned token, or
+# false when the queue is empty
+POP_SCRIPT = """
+local source = redis.call('LPOP', KEYS[1])
+if not source then
+    return false
+end
+local frame = redis.call('LPOP', ARGV[1] .. source)
+if not frame then
+    return {source, false}
+end
+local size = struct.unpack('>I4', frame)
+local bytes_field = 'bytes:' .. source
+redis.call('HINCRBY', KEYS[2], 'frames', -1)
+redis.call('HINCRBY', KEYS[2], 'bytes', -size)
+if redis.call('HINCRBY', KEYS[2], bytes_field, -size) <= 0 then
+    redis.call('HDEL', KEYS[2], bytes_field)
+end
+return {source, string.sub(frame, 5)}
+"""
+
+
+class QueueFull(Exception):
+    """Raised when a frame is refused by admission control."""
+
+    def __init__(self, source: str, retry_after: int) -> None:
+        super().__init__(f"task queue is full for source '{source}'")
+        self.source = source
+        self.retry_after = retry_after
+
+
+@dataclass
+class Admission:
+    # Frames evicted to make room, so their owner can release resources
+    dropped_frames: list[bytes] = field(default_factory=list)
+
+    @property
+    def dropped(self) -> int:
+        return len(self.dropped_frames)
+
+
+class TaskQueue:
+    """Bounded multi-source frame queue; see the module docstring."""
+
+    def __init__(
+        self,
+        name: str = REDIS_TASK_QUEUE,
+        max_frames: int = TASK_QUEUE_MAX_FRAMES,
+        max_bytes: int = TASK_QUEUE_MAX_BYTES,
+        source_max_frames: int = TASK_QUEUE_SOURCE_MAX_FRAMES,
+        policy: str = TASK_QUEUE_POLICY,
+        retry_after: int = TASK_QUEUE_RETRY_AFTER
+    ) -> None:
+        if policy not in (POLICY_REJECT, POLICY_DROP_OLDEST):
+            raise ValueError(f"unknown task queue policy '{policy}'")
+        self.name = name
+        self.stats_key = f"{name}:stats"
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.source_max_frames = source_max_frames
+        self.policy = policy
+        self.retry_after = retry_after
+        self._admit = redis_client.register_script(ADMIT_SCRIPT)
+        self._pop = redis_client.register_script(POP_SCRIPT)
+
+    def source_key(self, source: str) -> str:
+        return f"{self.name}:src:{source}"
+
+    async def put(
+        self,
+        source: str,
+        data: bytes,
+        size: Optional[int] = None
+    ) -> Admission:
+        """Queue a packed frame for `source`, or raise QueueFull.
+
+        `size` is the bytes it holds while queued, len(data) by default;
+        see shm_ring.queued_size for offloaded frames."""
+        admitted, *dropped_frames = await self._admit(
+            keys=[self.name, self.source_key(source), self.stats_key],
+            args=[
+                source,
+                data,
+                self.max_frames,
+                self.max_bytes,
+                self.source_max_frames,
+                1 if self.policy == POLICY_DROP_OLDEST else 0,
+                len(data) if size is None else size
+            ]
+        )
+        if not admitted:
+            raise QueueFull(source, self.retry_after)
+        return Admission(dropped_frames=dropped_frames)
+
+    async def get(self, timeout: float = 5) -> Optional[tuple[str, bytes]]:
+        """Pop the next (source, frame) in arrival order, or None on timeout."""
+        while True:
+            item = await self._pop(
+                keys=[self.name, self.stats_key],
+                args=[self.source_key("")]
+            )
+            if item and item[1] is not None:
+                return item[0].decode("utf-8", "replace"), item[1]
+            if item:
+                # Orphaned token; take the next one
+                continue
+            # Block until a token arrives without taking it: moving the
+            # head onto the head leaves the list as it was
+            if await redis_client.blmove(
+                self.name,
+                self.name,
+                timeout,
+                src="LEFT",
+                dest="LEFT"
+            ) is None:
+                return None
+
+    async def depth(self) -> dict[str, int]:
+        """Queued frame and byte totals."""
+        stats = await redis_client.hmget(self.stats_key, "frames", "bytes")
+        return {
+            "frames": int(stats[0] or 0),
+            "bytes": int(stats[1] or 0)
+        }
+
+
+task_queue: TaskQueue = TaskQueue()
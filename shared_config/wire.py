@@ -0,0 +1,387 @@
+"""
+Binary envelopes exchanged over the Redis queues.
+
+Frame envelope (task_queue, model_request_queue), network byte order:
+
+    FRAME_HEADER   magic, version, content type, request id (16 byte uuid),
+                   captured_at, enqueued_at, filename length,
+                   extensions length
+    filename       utf-8
+    extensions     (tag: u8, length: u16, value) records
+    payload        raw encoded image bytes, up to the end of the message
+
+Result envelope (model_result_queue:*):
+
+    RESULT_HEADER  magic, version, request id, image height, image width,
+                   detection count N, inference time in ms
+    boxes          float32[N, 4], xyxy in pixels
+    classes        uint16[N]
+    confidences    float32[N]
+    trace          optional, the frame's trace with the worker's hops added
+
+The arrays are little-endian so both ends can view them without copying.
+
+Trace (EXT_TRACE and the result trailer): trace id (16 byte uuid), hop
+count, then (hop: u8, timestamp: f64) records in the order they happened.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, Optional
+import struct
+import time
+import uuid
+
+import numpy as np
+
+WIRE_VERSION = 1
+
+FRAME_MAGIC = b"EF"
+RESULT_MAGIC = b"ER"
+
+FRAME_HEADER = struct.Struct("!2sBB16sddHH")
+RESULT_HEADER = struct.Struct("!2sB16sHHIf")
+EXTENSION_HEADER = struct.Struct("!BH")
+LETTERBOX = struct.Struct("!fHHHH")
+TRACE_HEADER = struct.Struct("!16sB")
+TRACE_HOP = struct.Struct("!Bd")
+
+# Frame extension tags
+EXT_REPLY_TO = 1  # Redis list the model worker should push the result to
+EXT_SOURCE = 2  # Id of the camera/client the frame came from
+EXT_SHM_SLOT = 3  # Payload lives in the shared-memory ring (shm_ring.SlotRef)
+EXT_LETTERBOX = 4  # Frame was scaled/padded at the edge (Letterbox)
+EXT_TRACE = 5  # Trace id and hop timestamps (Trace)
+
+# Trace hops, in pipeline order; the index is the wire code
+TRACE_HOPS = (
+    "captured",         # camera frame grabbed at the edge
+    "sent",             # edge started uploading/enqueueing it
+    "received",         # /stream got the request
+    "queued",           # pushed onto task_queue
+    "dequeued",         # popped by the stream pipeline
+    "model_queued",     # pushed onto model_request_queue
+    "model_dequeued",   # claimed by a model worker
+    "decoded",          # payload decoded to an image
+    "inferred",         # its batch came out of the model
+    "result_received",  # result popped from the reply list
+    "uploaded",         # image stored in MinIO
+    "stored",           # detection row inserted
+)
+
+CONTENT_TYPES = (
+    "application/octet-stream",
+    "image/jpeg",
+    "image/png",
+)
+
+
+class WireError(ValueError):
+    """Raised when a message is not a valid envelope."""
+
+
+@dataclass
+class Trace:
+    """One frame's trace id and the times (epoch seconds) it passed each hop."""
+    trace_id: str
+    hops: list[tuple[int, float]] = field(default_factory=list)
+
+    def mark(self, hop: str, at: Optional[float] = None) -> Trace:
+        self.hops.append((TRACE_HOPS.index(hop), time.time() if at is None else at))
+        return self
+
+    def pack(self) -> bytes:
+        return TRACE_HEADER.pack(uuid.UUID(self.trace_id).bytes, len(self.hops)) + b"".join(
+            TRACE_HOP.pack(hop, at) for hop, at in self.hops
+        )
+
+    @classmethod
+    def unpack(cls, data: bytes) -> Trace:
+        try:
+            trace_id, count = TRACE_HEADER.unpack_from(data)
+            hops = [
+                TRACE_HOP.unpack_from(data, TRACE_HEADER.size + i * TRACE_HOP.size)
+                for i in range(count)
+            ]
+        except struct.error as e:
+            raise WireError(f"truncated trace: {e}")
+        return cls(str(uuid.UUID(bytes=trace_id)), hops)
+
+    @classmethod
+    def parse(cls, header: str) -> Trace:
+        """Parse the "trace_id;hop=timestamp;..." X-Trace header."""
+        try:
+            trace_id, *hops = header.split(";")
+            trace = cls(str(uuid.UUID(trace_id.strip())))
+            for hop in hops:
+                name, at = hop.split("=")
+                trace.mark(name.strip(), float(at))
+        except ValueError:
+            raise WireError(f"bad trace '{header}'")
+        return trace
+
+    def timeline(self) -> list[dict[str, Any]]:
+        """Hops with the time since the first hop and since the previous one."""
+        if not self.hops:
+            return []
+        start = self.hops[0][1]
+        timeline = []
+        previous = start
+        for hop, at in self.hops:
+            timeline.append({
+                "hop": TRACE_HOPS[hop] if hop < len(TRACE_HOPS) else f"hop_{hop}",
+                "at": at,
+                "elapsed": round(at - start, 6),
+                "delta": round(at - previous, 6)
+            })
+            previous = at
+        return timeline
+
+
+def _content_type_code(content_type: Optional[str]) -> int:
+    try:
+        return CONTENT_TYPES.index(content_type)
+    except ValueError:
+        return 0
+
+
+def _check_header(magic: bytes, version: int, expected: bytes) -> None:
+    if magic != expected:
+        raise WireError(f"bad magic {magic!r}, expected {expected!r}")
+    if version > WIRE_VERSION:
+        raise WireError(f"unsupported wire version {version}")
+
+
+@dataclass
+class Frame:
+    """An encoded image plus the metadata that travels with it.
+
+    After unpack(), image_bytes is a memoryview over the received message,
+    so the payload is never copied out of it.
+    """
+    request_id: str
+    filename: str
+    image_bytes: bytes | memoryview
+    content_type: str = "image/jpeg"
+    captured_at: float = 0.0
+    enqueued_at: float = 0.0
+    extensions: dict[int, bytes] = field(default_factory=dict)
+
+    def pack(self) -> bytes:
+        filename = self.filename.encode("utf-8")
+        ext = b"".join(
+            EXTENSION_HEADER.pack(tag, len(value)) + value
+            for tag, value in self.extensions.items()
+        )
+        header = FRAME_HEADER.pack(
+            FRAME_MAGIC,
+            WIRE_VERSION,
+            _content_type_code(self.content_type),
+            uuid.UUID(self.request_id).bytes,
+            self.captured_at,
+            self.enqueued_at,
+            len(filename),
+            len(ext)
+        )
+        return b"".join((header, filename, ext, self.image_bytes))
+
+    @classmethod
+    def unpack(cls, data: bytes) -> Frame:
+        view = memoryview(data)
+        try:
+            (
+                magic,
+                version,
+                content_type,
+                request_id,
+                captured_at,
+                enqueued_at,
+                filename_len,
+                ext_len
+            ) = FRAME_HEADER.unpack_from(view)
+        except struct.error as e:
+            raise WireError(f"truncated frame header: {e}")
+        _check_header(magic, version, FRAME_MAGIC)
+
+        offset = FRAME_HEADER.size
+        filename = bytes(view[offset:offset + filename_len]).decode("utf-8")
+        offset += filename_len
+
+        extensions = {}
+        ext_end = offset + ext_len
+        while offset < ext_end:
+            tag, length = EXTENSION_HEADER.unpack_from(view, offset)
+            offset += EXTENSION_HEADER.size
+            extensions[tag] = bytes(view[offset:offset + length])
+            offset += length
+
+        return cls(
+            request_id=str(uuid.UUID(bytes=request_id)),
+            filename=filename,
+            image_bytes=view[ext_end:],
+            content_type=CONTENT_TYPES[content_type]
+            if content_type < len(CONTENT_TYPES) else CONTENT_TYPES[0],
+            captured_at=captured_at,
+            enqueued_at=enqueued_at,
+            extensions=extensions
+        )
+
+    def trace(self) -> Optional[Trace]:
+        value = self.extensions.get(EXT_TRACE)
+        return Trace.unpack(value) if value else None
+
+    def mark(self, hop: str, at: Optional[float] = None) -> None:
+        """Stamp a hop onto the frame's trace; untraced frames are left alone."""
+        trace = self.trace()
+        if trace is not None:
+            self.extensions[EXT_TRACE] = trace.mark(hop, at).pack()
+
+
+@dataclass
+class Letterbox:
+    """How an edge device scaled and padded a frame before sending it:
+    sent = original * scale + pad. Width and height are the original's."""
+    scale: float
+    pad_x: int
+    pad_y: int
+    width: int
+    height: int
+
+    def pack(self) -> bytes:
+        return LETTERBOX.pack(self.scale, self.pad_x, self.pad_y, self.width, self.height)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> Letterbox:
+        return cls(*LETTERBOX.unpack(data))
+
+    @classmethod
+    def parse(cls, header: str) -> Letterbox:
+        """Parse the "scale,pad_x,pad_y,width,height" X-Letterbox header."""
+        try:
+            scale, pad_x, pad_y, width, height = header.split(",")
+            letterbox = cls(float(scale), int(pad_x), int(pad_y), int(width), int(height))
+        except ValueError:
+            raise WireError(f"bad letterbox '{header}'")
+        if letterbox.scale <= 0:
+            raise WireError(f"bad letterbox scale {letterbox.scale}")
+        return letterbox
+
+    def unmap_boxes(self, boxes: np.ndarray) -> np.ndarray:
+        """Map xyxy boxes from the sent image back onto the original frame."""
+        pad = np.array([self.pad_x, self.pad_y, self.pad_x, self.pad_y], dtype=np.float32)
+        limit = np.array([self.width, self.height, self.width, self.height], dtype=np.float32)
+        return np.clip((boxes - pad) / self.scale, 0, limit)
+
+
+@dataclass
+class DetectionResult:
+    """Detections for one image as packed arrays."""
+    request_id: str
+    boxes: np.ndarray
+    classes: np.ndarray
+    confidences: np.ndarray
+    image_size: tuple[int, int] = (0, 0)
+    inference_ms: float = 0.0
+    trace: Optional[Trace] = None
+
+    def __post_init__(self):
+        self.boxes = np.ascontiguousarray(self.boxes, dtype="<f4").reshape(-1, 4)
+        self.classes = np.ascontiguousarray(self.classes, dtype="<u2")
+        self.confidences = np.ascontiguousarray(self.confidences, dtype="<f4")
+
+    def __len__(self) -> int:
+        return len(self.classes)
+
+    def pack(self) -> bytes:
+        height, width = self.image_size
+        header = RESULT_HEADER.pack(
+            RESULT_MAGIC,
+            WIRE_VERSION,
+            uuid.UUID(self.request_id).bytes,
+            height,
+            width,
+            len(self),
+            self.inference_ms
+        )
+        return b"".join((
+            header,
+            self.boxes.tobytes(),
+            self.classes.tobytes(),
+            self.confidences.tobytes(),
+            self.trace.pack() if self.trace is not None else b""
+        ))
+
+    @classmethod
+    def unpack(cls, data: bytes) -> DetectionResult:
+        try:
+            (
+                magic,
+                version,
+                request_id,
+                height,
+                width,
+                count,
+                inference_ms
+            ) = RESULT_HEADER.unpack_from(data)
+        except struct.error as e:
+            raise WireError(f"truncated result header: {e}")
+        _check_header(magic, version, RESULT_MAGIC)
+
+        expected = RESULT_HEADER.size + count * (16 + 2 + 4)
+        if len(data) < expected:
+            raise WireError(
+                f"result body is {len(data)} bytes, expected {expected}"
+            )
+        trace = Trace.unpack(data[expected:]) if len(data) > expected else None
+
+        offset = RESULT_HEADER.size
+        boxes = np.frombuffer(data, dtype="<f4", count=count * 4, offset=offset)
+        offset += boxes.nbytes
+        classes = np.frombuffer(data, dtype="<u2", count=count, offset=offset)
+        offset += classes.nbytes
+        confidences = np.frombuffer(data, dtype="<f4", count=count, offset=offset)
+
+        return cls(
+            request_id=str(uuid.UUID(bytes=request_id)),
+            boxes=boxes.reshape(count, 4),
+            classes=classes,
+            confidences=confidences,
+            image_size=(height, width),
+            inference_ms=inference_ms,
+            trace=trace
+        )
+
+    def to_records(
+        self,
+        names: dict[int, str],
+        decimals: int = 5,
+        letterbox: Optional[Letterbox] = None
+    ) -> list[dict[str, Any]]:
+        """Expand into the per-object dicts stored as detection_data
+        (same shape as ultralytics Results.tojson()).
+
+        "box" is in the coordinates of the image that was analysed (and
+        stored). With a letterbox, "original_box" is added in the
+        coordinates of the camera frame it was scaled from."""
+        boxes = self.boxes.astype(np.float64).round(decimals).tolist()
+        confidences = self.confidences.astype(np.float64).round(decimals).tolist()
+        original = (
+            letterbox.unmap_boxes(self.boxes).astype(np.float64).round(decimals).tolist()
+            if letterbox is not None else None
+        )
+        records = []
+        for i, ((x1, y1, x2, y2), class_id, confidence) in enumerate(zip(
+            boxes,
+            self.classes.tolist(),
+            confidences
+        )):
+            record = {
+                "name": names.get(class_id, str(class_id)),
+                "class": class_id,
+                "confidence": confidence,
+                "box": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}
+            }
+            if original is not None:
+                ox1, oy1, ox2, oy2 = original[i]
+                record["original_box"] = {"x1": ox1, "y1": oy1, "x2": ox2, "y2": oy2}
+            records.append(record)
+        return records
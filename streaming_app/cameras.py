@@ -0,0 +1,180 @@
+import os
+import json
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+from capture import FrameGrabber
+from change_detection import (
+    ChangeDetector,
+    HASH_DISTANCE_THRESHOLD,
+    MOTION_THRESHOLD,
+    PIXEL_THRESHOLD,
+    MAX_STATIC_SECONDS
+)
+from preprocess import (
+    FramePreprocessor,
+    Letterbox,
+    PRESCALE_SIZE,
+    PRESCALE_PAD,
+    JPEG_QUALITY,
+    GRAYSCALE,
+    ROI
+)
+
+VIDEO_PATH: str = "/app/input_video.mp4"
+# Seconds between frames sampled from a camera for change detection
+SEND_INTERVAL: float = float(os.getenv("SEND_INTERVAL", 1.0))
+# Encoded frames waiting for upload per camera; the oldest is dropped when full
+SEND_QUEUE_SIZE: int = int(os.getenv("SEND_QUEUE_SIZE", 4))
+
+
+@dataclass
+class CameraConfig:
+    id: str
+    source: str
+    interval: float = SEND_INTERVAL
+    hash_threshold: int = HASH_DISTANCE_THRESHOLD
+    motion_threshold: float = MOTION_THRESHOLD
+    pixel_threshold: int = PIXEL_THRESHOLD
+    max_static_seconds: float = MAX_STATIC_SECONDS
+    target_size: int = PRESCALE_SIZE
+    pad: bool = PRESCALE_PAD
+    jpeg_quality: int = JPEG_QUALITY
+    grayscale: bool = GRAYSCALE
+    roi: Optional[Sequence[Sequence[float]]] = ROI
+
+
+def _default_id(source: str) -> str:
+    return os.path.basename(source.rstrip("/")) or source
+
+
+def load_camera_configs() -> List[CameraConfig]:
+    """
+    Cameras from CAMERA_SOURCES, falling back to the single CAMERA_SOURCE.
+
+    CAMERA_SOURCES is either a comma-separated list of sources (files,
+    RTSP/HTTP URLs, device indices) or a JSON list whose items are source
+    strings or objects with "source" plus any CameraConfig field, e.g.
+    [{"id": "door", "source": "rtsp://cam1/stream", "interval": 0.5}].
+    """
+    raw = os.getenv("CAMERA_SOURCES", "").strip()
+    if not raw:
+        source = os.getenv("CAMERA_SOURCE", VIDEO_PATH)
+        return [CameraConfig(id=os.getenv("SOURCE_ID", _default_id(source)), source=source)]
+
+    if raw.startswith("["):
+        items = json.loads(raw)
+    else:
+        items = [item.strip() for item in raw.split(",") if item.strip()]
+
+    configs = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"source": item}
+        item.setdefault("id", _default_id(item["source"]))
+        configs.append(CameraConfig(**item))
+
+    ids = [config.id for config in configs]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Camera ids must be unique, got {ids}")
+    return configs
+
+
+@dataclass
+class CameraStats:
+    sampled: int = 0
+    unchanged: int = 0
+    encoded: int = 0
+    dropped: int = 0
+    sent: int = 0
+    rejected: int = 0
+    failed: int = 0
+    bytes_sent: int = 0
+    last_sent_at: float = 0.0
+
+
+class Camera:
+    """One source: its capture thread, preprocessing, change detector
+    and counters."""
+
+    def __init__(self, config: CameraConfig):
+        self.config = config
+        self.id = config.id
+        self.grabber = FrameGrabber(config.source, name=f"capture-{config.id}")
+        self.detector = ChangeDetector(
+            hash_threshold=config.hash_threshold,
+            motion_threshold=config.motion_threshold,
+            pixel_threshold=config.pixel_threshold,
+            max_static_seconds=config.max_static_seconds
+        )
+        self.preprocessor = FramePreprocessor(
+            target_size=config.target_size,
+            pad=config.pad,
+            jpeg_quality=config.jpeg_quality,
+            grayscale=config.grayscale,
+            roi=config.roi
+        )
+        self.stats = CameraStats()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "source": self.config.source,
+            "captured": self.grabber.frames_read,
+            "read_failures": self.grabber.read_failures,
+            **asdict(self.stats)
+        }
+
+
+class FairQueue:
+    """
+    Per-camera upload queues served round-robin.
+
+    Each camera gets its own bounded deque, so a busy camera only ever
+    drops its own oldest frames, and get() rotates over cameras so every
+    camera gets a turn at the shared upload slots.
+    """
+
+    def __init__(self, cameras: List[Camera], maxsize: int = SEND_QUEUE_SIZE):
+        self._queues: Dict[str, Deque[Tuple[Camera, bytes, float, Letterbox]]] = {
+            camera.id: deque() for camera in cameras
+        }
+        self._order = [camera.id for camera in cameras]
+        self._next = 0
+        self.maxsize = maxsize
+        self._ready = asyncio.Event()
+
+    def put(
+        self,
+        camera: Camera,
+        image_bytes: bytes,
+        captured_at: float,
+        letterbox: Letterbox
+    ) -> bool:
+        """Queue a frame; returns False if an older frame had to be dropped."""
+        queue = self._queues[camera.id]
+        dropped = len(queue) >= self.maxsize
+        if dropped:
+            queue.popleft()
+        queue.append((camera, image_bytes, captured_at, letterbox))
+        self._ready.set()
+        return not dropped
+
+    def _pop(self) -> Optional[Tuple[Camera, bytes, float, Letterbox]]:
+        for offset in range(len(self._order)):
+            index = (self._next + offset) % len(self._order)
+            queue = self._queues[self._order[index]]
+            if queue:
+                self._next = index + 1
+                return queue.popleft()
+        return None
+
+    async def get(self) -> Tuple[Camera, bytes, float, Letterbox]:
+        while True:
+            item = self._pop()
+            if item is not None:
+                return item
+            self._ready.clear()
+            await self._ready.wait()
@@ -0,0 +1,100 @@
+import os, time, cv2
+import logging
+import threading
+import numpy as np
+from collections import deque
+from typing import Optional, Tuple, Union
+
+logger = logging.getLogger("streaming_apps")
+
+# Newest frames kept per camera; older ones are overwritten, never queued
+CAPTURE_BUFFER_SIZE: int = int(os.getenv("CAPTURE_BUFFER_SIZE", 2))
+# Seconds to wait before reopening a source that stopped delivering frames
+RECONNECT_DELAY: float = float(os.getenv("RECONNECT_DELAY", 2.0))
+
+
+def open_source(source: str) -> Union[str, int]:
+    """Device indices ("0") open as integers, everything else as a path/URL."""
+    return int(source) if source.isdigit() else source
+
+
+class FrameGrabber(threading.Thread):
+    """
+    Reads a camera on its own thread into a small ring buffer.
+
+    The consumer only ever looks at the newest frame, so a slow consumer
+    never makes the camera fall behind real time; frames it had no time
+    for are simply overwritten. Video files are paced to their own frame
+    rate and looped, live sources are reopened after RECONNECT_DELAY when
+    reads fail.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        buffer_size: int = CAPTURE_BUFFER_SIZE,
+        name: Optional[str] = None
+    ):
+        super().__init__(name=name or f"capture-{source}", daemon=True)
+        self.source = source
+        self.is_file = os.path.isfile(source)
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.frames_read = 0
+        self.read_failures = 0
+
+    def latest(self) -> Optional[Tuple[int, float, np.ndarray]]:
+        """Newest (sequence number, capture time, frame), or None."""
+        with self._lock:
+            return self._buffer[-1] if self._buffer else None
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _open(self) -> cv2.VideoCapture:
+        cap = cv2.VideoCapture(open_source(self.source))
+        if not self.is_file:
+            # Ask the backend not to queue frames behind our back
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def run(self) -> None:
+        cap = self._open()
+        fps = cap.get(cv2.CAP_PROP_FPS) if self.is_file else 0
+        frame_period = 1.0 / fps if fps and fps > 0 else 0.0
+        next_read = time.monotonic()
+        failures_in_row = 0
+
+        while not self._stopped.is_set():
+            if frame_period:
+                delay = next_read - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_read = max(next_read + frame_period, time.monotonic())
+
+            ret, frame = cap.read()
+            if not ret:
+                self.read_failures += 1
+                failures_in_row += 1
+                if self.is_file and failures_in_row == 1:
+                    # End of file: loop back to the start
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                logger.warning(
+                    f"[{self.name}]: Failed to read frame, "
+                    f"reopening in {RECONNECT_DELAY}s"
+                )
+                cap.release()
+                self._stopped.wait(RECONNECT_DELAY)
+                cap = self._open()
+                continue
+
+            failures_in_row = 0
+            self.frames_read += 1
+            with self._lock:
+                self._seq += 1
+                self._buffer.append((self._seq, time.time(), frame))
+
+        cap.release()
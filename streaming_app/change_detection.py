@@ -0,0 +1,118 @@
+import os, time, cv2
+import numpy as np
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+# Hamming distance (out of 64 bits) between dHashes that counts as a change
+HASH_DISTANCE_THRESHOLD: int = int(os.getenv("CHANGE_HASH_THRESHOLD", 6))
+# Fraction of motion-grid cells that must differ to count as a change
+MOTION_THRESHOLD: float = float(os.getenv("CHANGE_MOTION_THRESHOLD", 0.01))
+# Per-cell grey-level difference (0-255) that marks a cell as moving
+PIXEL_THRESHOLD: int = int(os.getenv("CHANGE_PIXEL_THRESHOLD", 25))
+# Width of the downsampled motion grid; height follows the aspect ratio
+MOTION_GRID_WIDTH: int = int(os.getenv("CHANGE_MOTION_GRID_WIDTH", 64))
+# Send a frame at least this often even if nothing changes (0 = never)
+MAX_STATIC_SECONDS: float = float(os.getenv("CHANGE_MAX_STATIC_SECONDS", 0))
+
+_BIT_WEIGHTS = np.uint64(1) << np.arange(64, dtype=np.uint64)
+
+
+def dhash(gray: np.ndarray) -> int:
+    """64-bit difference hash: sign of horizontal gradients on a 9x8 thumbnail."""
+    thumb = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).ravel()
+    return int(_BIT_WEIGHTS[bits].sum())
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+@dataclass
+class ChangeResult:
+    changed: bool
+    hash_distance: int
+    motion: float
+    # Bounding box (x1, y1, x2, y2) of the moving cells in frame pixels
+    region: Optional[Tuple[int, int, int, int]] = None
+
+
+class ChangeDetector:
+    """
+    Decides whether a frame differs enough from the last *sent* frame.
+
+    Two cheap signals are combined: the Hamming distance between dHashes
+    (global changes such as lighting or camera moves) and a motion score,
+    the fraction of cells of a small blurred grey grid whose absolute
+    difference exceeds pixel_threshold (local changes such as a person
+    walking in). Comparing against the last sent frame rather than the
+    previous one means slow drift still triggers eventually.
+    """
+
+    def __init__(
+        self,
+        hash_threshold: int = HASH_DISTANCE_THRESHOLD,
+        motion_threshold: float = MOTION_THRESHOLD,
+        pixel_threshold: int = PIXEL_THRESHOLD,
+        grid_width: int = MOTION_GRID_WIDTH,
+        max_static_seconds: float = MAX_STATIC_SECONDS
+    ):
+        self.hash_threshold = hash_threshold
+        self.motion_threshold = motion_threshold
+        self.pixel_threshold = pixel_threshold
+        self.grid_width = grid_width
+        self.max_static_seconds = max_static_seconds
+        self._ref_hash: Optional[int] = None
+        self._ref_grid: Optional[np.ndarray] = None
+        self._ref_time = 0.0
+
+    def _grid(self, gray: np.ndarray) -> np.ndarray:
+        h, w = gray.shape
+        grid_h = max(1, round(self.grid_width * h / w))
+        small = cv2.resize(gray, (self.grid_width, grid_h), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (3, 3), 0)
+
+    def update(self, frame: np.ndarray) -> ChangeResult:
+        """Score a BGR or greyscale frame; a changed frame becomes the new reference."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        frame_hash = dhash(gray)
+        grid = self._grid(gray)
+        now = time.monotonic()
+
+        if self._ref_grid is None or self._ref_grid.shape != grid.shape:
+            result = ChangeResult(True, 64, 1.0, (0, 0, gray.shape[1], gray.shape[0]))
+        else:
+            distance = hamming(frame_hash, self._ref_hash)
+            moving = cv2.absdiff(grid, self._ref_grid) > self.pixel_threshold
+            motion = float(moving.mean())
+            region = None
+            if motion > 0:
+                ys, xs = np.nonzero(moving)
+                scale_x = gray.shape[1] / grid.shape[1]
+                scale_y = gray.shape[0] / grid.shape[0]
+                region = (
+                    int(xs.min() * scale_x),
+                    int(ys.min() * scale_y),
+                    int((xs.max() + 1) * scale_x),
+                    int((ys.max() + 1) * scale_y)
+                )
+            stale = (
+                self.max_static_seconds > 0
+                and now - self._ref_time >= self.max_static_seconds
+            )
+            result = ChangeResult(
+                changed=(
+                    distance >= self.hash_threshold
+                    or motion >= self.motion_threshold
+                    or stale
+                ),
+                hash_distance=distance,
+                motion=motion,
+                region=region
+            )
+
+        if result.changed:
+            self._ref_hash = frame_hash
+            self._ref_grid = grid
+            self._ref_time = now
+        return result
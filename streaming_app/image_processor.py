@@ -1,10 +1,14 @@
-import os, time, cv2
+import os, time, uuid
 import logging
 import aiohttp
 import asyncio
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-import hashlib
+from typing import Optional, Tuple
+
+from cameras import Camera, FairQueue, load_camera_configs
+from preprocess import Letterbox
 
 logging.basicConfig(
     filename="/app/logs/streaming_app.log",
@@ -17,25 +21,30 @@ logger = logging.getLogger("streaming_apps")
 image_directory = '/app/images'
 
 YOLO_API_URL: str = 'http://yolov8_server:5000/stream'
-VIDEO_PATH: str = "/app/input_video.mp4"
-CAMERA_SOURCE: str = os.getenv(
-    "CAMERA_SOURCE",
-    VIDEO_PATH
-)
+# "http" posts frames to /stream; "redis" pushes them straight onto the
+# task queue and needs shared_config and the Redis host (co-located only)
+TRANSPORT: str = os.getenv("TRANSPORT", "http")
 FRAME_INTERVAL: int = int(os.getenv("FRAME_INTERVAL", 5))
-HASH_DIFF_THRESHOLD = 1000
-SEND_INTERVAL = 1.0
-
-def frame_hash(frame: np.ndarray) -> int:
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    resized = cv2.resize(gray, (64,64))
-    return int(hashlib.md5(resized).hexdigest(), 16)
+# Concurrent uploads over the shared keep-alive session, across all cameras
+MAX_IN_FLIGHT: int = int(os.getenv("MAX_IN_FLIGHT", 4))
+# Threads running change detection and JPEG encoding, across all cameras
+ENCODE_WORKERS: int = int(os.getenv("ENCODE_WORKERS", 2))
+# Seconds between per-camera stats reports (0 disables them)
+STATS_INTERVAL: float = float(os.getenv("STATS_INTERVAL", 30))
 
 async def send_image_to_yolo(
     session,
     image_path=None,
-    image_bytes=None
-):
+    image_bytes=None,
+    source_id: Optional[str] = None,
+    filename: str = "frame.jpg",
+    letterbox: Optional[Letterbox] = None,
+    captured_at: Optional[float] = None
+) -> Optional[int]:
+    """Post one image to /stream; returns the HTTP status, None on error.
+
+    Frames start their trace here: the X-Trace header carries a new trace
+    id with the capture and send times, looked up later on /trace/{id}."""
     logger.info(f"Sending image: {image_path}")
     try:
         if image_path:
@@ -50,23 +59,48 @@ async def send_image_to_yolo(
                         logger.info(f"Successfully processed {image_path}")
                     else:
                         logger.error(f"Failed to process {image_path}, Status Code: {response.status}")
+                    return response.status
         elif image_bytes:
             logger.info(f"Sending image from bytes")
             if not isinstance(image_bytes, BytesIO):
                 image_bytes = BytesIO(image_bytes)
-            data = {'file': image_bytes}
+            data = aiohttp.FormData()
+            data.add_field(
+                'file',
+                image_bytes,
+                filename=filename,
+                content_type='image/jpeg'
+            )
+            headers = {}
+            if source_id:
+                headers["X-Source-Id"] = source_id
+            if letterbox:
+                headers["X-Letterbox"] = letterbox.header()
+            trace = [str(uuid.uuid4())]
+            if captured_at:
+                trace.append(f"captured={captured_at:.6f}")
+            trace.append(f"sent={time.time():.6f}")
+            headers["X-Trace"] = ";".join(trace)
             async with session.post(
                 YOLO_API_URL,
-                data=data
+                data=data,
+                headers=headers
             ) as response:
                 if response.status == 200:
                     logger.info(f"Successfully sent image bytes")
+                elif response.status == 429:
+                    # Server is shedding load; back off instead of piling on
+                    retry_after = float(response.headers.get("Retry-After", 1))
+                    logger.warning(f"Server busy, backing off {retry_after}s")
+                    await asyncio.sleep(retry_after)
                 else:
                     logger.error(f"Failed to send image bytes, Status: {response.status}")
+                return response.status
         else:
             logger.error("No image provided to send")
     except Exception as e:
         logger.error(f"Error sending image: {str(e)}")
+    return None
 
 async def process_images(image_bytes: bytes):
     async with aiohttp.ClientSession() as session:
@@ -83,40 +117,144 @@ async def process_images(image_bytes: bytes):
         await asyncio.gather(*tasks)
 
 
-async def process_video(session):
-    prev_hash = None
-    cap = cv2.VideoCapture(CAMERA_SOURCE)
-    prev_time = time.time()
+def encode_frame(
+    camera: Camera,
+    frame: np.ndarray
+) -> Optional[Tuple[bytes, Letterbox]]:
+    """Scaling/masking, change detection and JPEG encoding; runs off the
+    event loop. Change detection sees the frame as it will be sent, so
+    motion outside the regions of interest is ignored."""
+    image, letterbox = camera.preprocessor.prepare(frame)
+    change = camera.detector.update(image)
+    if not change.changed:
+        return None
+    logger.info(
+        f"[{camera.id}] Frame changed: hash distance {change.hash_distance}, "
+        f"motion {change.motion:.3f}, region {change.region}"
+    )
+    image_bytes = camera.preprocessor.encode(image)
+    return (image_bytes, letterbox) if image_bytes else None
+
+async def encode_frames(
+    camera: Camera,
+    send_queue: FairQueue,
+    executor: ThreadPoolExecutor
+):
+    """Sample a camera's newest frame every interval and queue the changed
+    ones for upload. Each camera has at most one frame in the shared
+    encode pool at a time, so cameras take turns at encoding."""
+    loop = asyncio.get_running_loop()
+    last_seq = 0
+    next_sample = time.monotonic()
 
     while True:
-        ret, frame = cap.read()
-        if not ret:
-            logger.info(f"[{__name__}]: Failed to read frame.")
+        next_sample = max(next_sample + camera.config.interval, time.monotonic())
+        await asyncio.sleep(next_sample - time.monotonic())
+
+        latest = camera.grabber.latest()
+        if latest is None or latest[0] == last_seq:
             continue
-        
-        current_time = time.time()
-        if current_time - prev_time < SEND_INTERVAL:
+        last_seq, captured_at, frame = latest
+        camera.stats.sampled += 1
+
+        encoded = await loop.run_in_executor(
+            executor,
+            encode_frame,
+            camera,
+            frame
+        )
+        if encoded is None:
+            camera.stats.unchanged += 1
             continue
+        image_bytes, letterbox = encoded
+        camera.stats.encoded += 1
+        if not send_queue.put(camera, image_bytes, captured_at, letterbox):
+            camera.stats.dropped += 1
+            logger.warning(f"[{camera.id}] Uploads are falling behind, dropped oldest frame")
 
-        prev_time = current_time
-        
-        current_hash = frame_hash(frame)
-        if (prev_hash is None
-            or abs(current_hash - prev_hash) > HASH_DIFF_THRESHOLD):
-            prev_hash = current_hash
-            _, buf = cv2.imencode('.jpg', frame)
-            frame_bytes = buf.tobytes()
-            await send_image_to_yolo(
-                session,
-                image_bytes=frame_bytes
-            )
+def http_sender(session):
+    """Adapt send_image_to_yolo to the sender signature used by send_frames."""
+    async def send(source_id, image_bytes, filename, captured_at, letterbox):
+        return await send_image_to_yolo(
+            session,
+            image_bytes=image_bytes,
+            source_id=source_id,
+            filename=filename,
+            letterbox=letterbox,
+            captured_at=captured_at
+        )
+    return send
+
+async def send_frames(send, send_queue: FairQueue):
+    """Upload worker; MAX_IN_FLIGHT of these share the transport."""
+    while True:
+        camera, image_bytes, captured_at, letterbox = await send_queue.get()
+        status = await send(
+            camera.id,
+            image_bytes,
+            f"{camera.id}_{int(captured_at * 1000)}.jpg",
+            captured_at,
+            letterbox
+        )
+        if status == 200:
+            camera.stats.sent += 1
+            camera.stats.bytes_sent += len(image_bytes)
+            camera.stats.last_sent_at = time.time()
+        elif status == 429:
+            camera.stats.rejected += 1
+        else:
+            camera.stats.failed += 1
+
+async def report_stats(cameras: list[Camera]):
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        for camera in cameras:
+            logger.info(f"Camera stats: {camera.report()}")
+
+async def run_cameras(cameras: list[Camera], send):
+    send_queue = FairQueue(cameras)
+    executor = ThreadPoolExecutor(
+        max_workers=ENCODE_WORKERS,
+        thread_name_prefix="encode"
+    )
+    tasks = [
+        asyncio.create_task(send_frames(send, send_queue))
+        for _ in range(MAX_IN_FLIGHT)
+    ]
+    if STATS_INTERVAL > 0:
+        tasks.append(asyncio.create_task(report_stats(cameras)))
+    try:
+        await asyncio.gather(*(
+            encode_frames(camera, send_queue, executor)
+            for camera in cameras
+        ))
+    finally:
+        for task in tasks:
+            task.cancel()
+        for camera in cameras:
+            camera.grabber.stop()
+        executor.shutdown(wait=False)
 
 async def main():
     logger.info(f"{__name__} i am up...")
-    async with aiohttp.ClientSession() as session:
-        while True:
-            await process_video(session)
-            await asyncio.sleep(5)
+    cameras = [Camera(config) for config in load_camera_configs()]
+    for camera in cameras:
+        logger.info(f"Starting camera {camera.id}: {camera.config}")
+        camera.grabber.start()
+
+    if TRANSPORT == "redis":
+        # Imported here so HTTP-only deployments need no shared_config
+        from redis_transport import enqueue_frame
+        logger.info("Sending frames directly to the Redis task queue")
+        await run_cameras(cameras, enqueue_frame)
+        return
+
+    connector = aiohttp.TCPConnector(
+        limit=MAX_IN_FLIGHT,
+        keepalive_timeout=30
+    )
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await run_cameras(cameras, http_sender(session))
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,111 @@
+import os, cv2
+import json
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Longest side frames are scaled down to before upload (0 keeps full size).
+# Matches the model's input size, which would letterbox them to it anyway.
+PRESCALE_SIZE: int = int(os.getenv("PRESCALE_SIZE", 640))
+# Pad scaled frames to a PRESCALE_SIZE square like the model's letterbox
+PRESCALE_PAD: bool = os.getenv("PRESCALE_PAD", "0") == "1"
+JPEG_QUALITY: int = int(os.getenv("JPEG_QUALITY", 85))
+GRAYSCALE: bool = os.getenv("GRAYSCALE", "0") == "1"
+# Regions to keep, as a JSON list of [x1, y1, x2, y2] in 0-1 frame
+# coordinates; everything outside them is blacked out before encoding
+ROI: Optional[List[List[float]]] = json.loads(os.getenv("ROI", "null"))
+
+PAD_VALUE = 114
+
+
+@dataclass
+class Letterbox:
+    """sent = original * scale + pad; width/height are the original's."""
+    scale: float
+    pad_x: int
+    pad_y: int
+    width: int
+    height: int
+
+    def header(self) -> str:
+        """Value of the X-Letterbox header understood by /stream."""
+        return f"{self.scale:.6f},{self.pad_x},{self.pad_y},{self.width},{self.height}"
+
+
+class FramePreprocessor:
+    """
+    Shrinks frames before they leave the device.
+
+    Frames are scaled (never enlarged) so their longest side is
+    target_size, optionally padded to a square, optionally converted to
+    greyscale and masked to the regions of interest, then JPEG-encoded at
+    jpeg_quality. The returned Letterbox lets the server map boxes back
+    onto the original frame.
+    """
+
+    def __init__(
+        self,
+        target_size: int = PRESCALE_SIZE,
+        pad: bool = PRESCALE_PAD,
+        jpeg_quality: int = JPEG_QUALITY,
+        grayscale: bool = GRAYSCALE,
+        roi: Optional[Sequence[Sequence[float]]] = ROI
+    ):
+        self.target_size = target_size
+        self.pad = pad
+        self.jpeg_quality = jpeg_quality
+        self.grayscale = grayscale
+        self.roi = roi
+        self._masks: Dict[Tuple[int, int], np.ndarray] = {}
+
+    def _mask(self, shape: Tuple[int, int]) -> np.ndarray:
+        """Keep-mask for the ROI at a given (height, width), built once."""
+        mask = self._masks.get(shape)
+        if mask is None:
+            h, w = shape
+            mask = np.zeros(shape, dtype=np.uint8)
+            for x1, y1, x2, y2 in self.roi:
+                mask[int(y1 * h):int(np.ceil(y2 * h)), int(x1 * w):int(np.ceil(x2 * w))] = 255
+            self._masks[shape] = mask
+        return mask
+
+    def prepare(self, frame: np.ndarray) -> Tuple[np.ndarray, Letterbox]:
+        h, w = frame.shape[:2]
+        scale = 1.0
+        if self.target_size and max(h, w) > self.target_size:
+            scale = self.target_size / max(h, w)
+            frame = cv2.resize(
+                frame,
+                (round(w * scale), round(h * scale)),
+                interpolation=cv2.INTER_AREA
+            )
+
+        if self.grayscale and frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        if self.roi:
+            # Normalised coordinates, so the mask is built at the scaled size
+            frame = cv2.bitwise_and(frame, frame, mask=self._mask(frame.shape[:2]))
+
+        pad_x = pad_y = 0
+        if self.pad and self.target_size:
+            sh, sw = frame.shape[:2]
+            pad_x = (self.target_size - sw) // 2
+            pad_y = (self.target_size - sh) // 2
+            frame = cv2.copyMakeBorder(
+                frame,
+                pad_y, self.target_size - sh - pad_y,
+                pad_x, self.target_size - sw - pad_x,
+                cv2.BORDER_CONSTANT,
+                value=PAD_VALUE if frame.ndim == 2 else (PAD_VALUE,) * 3
+            )
+
+        return frame, Letterbox(scale, pad_x, pad_y, w, h)
+
+    def encode(self, image: np.ndarray) -> Optional[bytes]:
+        ok, buf = cv2.imencode(
+            '.jpg',
+            image,
+            [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        )
+        return buf.tobytes() if ok else None
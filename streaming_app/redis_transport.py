@@ -0,0 +1,73 @@
+import time, uuid
+import asyncio
+import logging
+from typing import Optional
+
+from shared_config import shm_ring
+from shared_config.task_queue import task_queue, QueueFull
+from shared_config.wire import (
+    Frame,
+    Letterbox,
+    Trace,
+    EXT_SOURCE,
+    EXT_LETTERBOX,
+    EXT_TRACE
+)
+
+logger = logging.getLogger("streaming_apps")
+
+
+async def enqueue_frame(
+    source_id: str,
+    image_bytes: bytes,
+    filename: str,
+    captured_at: float,
+    letterbox=None
+) -> Optional[int]:
+    """
+    Put a frame straight onto the server's task queue.
+
+    Builds the same envelope /stream would, so stream_processor consumes
+    it unchanged. Returns the status /stream would have answered with.
+    The request id doubles as the frame's trace id.
+    """
+    request_id = str(uuid.uuid4())
+    enqueued_at = time.time()
+    trace = Trace(request_id).mark("captured", captured_at).mark("sent", enqueued_at)
+    frame = Frame(
+        request_id=request_id,
+        filename=filename,
+        image_bytes=image_bytes,
+        content_type="image/jpeg",
+        captured_at=captured_at,
+        enqueued_at=enqueued_at,
+        extensions={
+            EXT_SOURCE: source_id.encode("utf-8"),
+            EXT_TRACE: trace.pack()
+        }
+    )
+    frame.mark("queued")
+    if letterbox is not None:
+        frame.extensions[EXT_LETTERBOX] = Letterbox(
+            letterbox.scale,
+            letterbox.pad_x,
+            letterbox.pad_y,
+            letterbox.width,
+            letterbox.height
+        ).pack()
+    try:
+        admission = await task_queue.put(source_id, frame.pack())
+    except QueueFull as e:
+        # Server is shedding load; back off instead of piling on
+        logger.warning(f"[{source_id}] Task queue full, backing off {e.retry_after}s")
+        await asyncio.sleep(e.retry_after)
+        return 429
+    except Exception as e:
+        logger.error(f"[{source_id}] Error enqueuing frame: {e}")
+        return None
+    for dropped in admission.dropped_frames:
+        # Evicted frames may have been offloaded by another producer
+        await shm_ring.release(Frame.unpack(dropped))
+    if admission.dropped:
+        logger.warning(f"[{source_id}] Server dropped {admission.dropped} stale frame(s)")
+    return 200
@@ -0,0 +1,91 @@
+import requests
+import time
+import uuid
+
+from util import unique_frames
+
+SERVER_URL = "http://yolov8_server:5000"
+TEST_IMAGE = "test.jpg"
+FRAMES = 2
+
+def stream_frames(source: str) -> None:
+    for i, frame in enumerate(unique_frames(TEST_IMAGE, FRAMES)):
+        files = {"file": (f"frame_{i}.jpg", frame, "image/jpeg")}
+        response = requests.post(
+            f"{SERVER_URL}/stream",
+            files=files,
+            data={"source": source}
+        )
+        assert response.status_code == 200, response.text
+
+def get_counts(source: str) -> dict:
+    response = requests.get(
+        f"{SERVER_URL}/analytics/counts",
+        params={"source": source, "buckets": 2}
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def get_heatmap(source: str, **params) -> requests.Response:
+    return requests.get(
+        f"{SERVER_URL}/analytics/heatmap",
+        params={"source": source, **params}
+    )
+
+def wait_for_frames(source: str, expected: int, timeout: float = 60) -> dict:
+    """Poll until the last bucket holds `expected` frames of the source."""
+    deadline = time.time() + timeout
+    while True:
+        counts = get_counts(source)
+        if counts["frames"][-1] >= expected or time.time() > deadline:
+            return counts
+        time.sleep(1)
+
+def run_test():
+    probe = requests.get(f"{SERVER_URL}/analytics/counts")
+    if probe.status_code == 404:
+        print("Analytics are disabled, skipping")
+        return
+    bucket_seconds = probe.json()["bucket_seconds"]
+
+    # Start early in a bucket so the first round cannot straddle two
+    if time.time() % bucket_seconds > bucket_seconds / 2:
+        time.sleep(bucket_seconds - time.time() % bucket_seconds + 1)
+
+    source = f"test-{uuid.uuid4().hex[:8]}"
+    stream_frames(source)
+    first = wait_for_frames(source, FRAMES)
+    print("Counts after the first bucket:", first)
+    assert first["frames"] == [0, FRAMES]
+    first_bucket = first["buckets"][-1]
+
+    first_heatmap = get_heatmap(source)
+    assert first_heatmap.status_code == 200, first_heatmap.text
+    first_total = first_heatmap.json()["total"]
+    print("Heatmap total after the first bucket:", first_total)
+
+    # Roll over into the next bucket and stream the same amount again
+    time.sleep(max(0, first_bucket + bucket_seconds + 1 - time.time()))
+    stream_frames(source)
+    second = wait_for_frames(source, FRAMES)
+    print("Counts after rollover:", second)
+    assert second["buckets"] == [first_bucket, first_bucket + bucket_seconds]
+    assert second["frames"] == [FRAMES, FRAMES]
+    for name, per_bucket in second["counts"].items():
+        # The old bucket keeps its counts, the new one starts from zero
+        assert per_bucket[0] == first["counts"][name][-1], name
+        assert per_bucket[1] == per_bucket[0], name
+        assert second["totals"][name] == 2 * per_bucket[0], name
+
+    # Heatmaps are not windowed: rollover adds to them, never clears them
+    second_heatmap = get_heatmap(source)
+    assert second_heatmap.status_code == 200, second_heatmap.text
+    print("Heatmap total after rollover:", second_heatmap.json()["total"])
+    assert second_heatmap.json()["total"] == 2 * first_total
+
+    for name in second["counts"]:
+        by_class = get_heatmap(source, class_name=name)
+        assert by_class.status_code == 200, by_class.text
+        assert by_class.json()["total"] > 0, name
+    assert get_heatmap(source, class_name="no-such-class").status_code == 404
+    print("/analytics counts and heatmap rollover OK")
@@ -1,12 +1,78 @@
 import requests
+import time
+import uuid
+
+from util import unique_frames
 
 SERVER_URL = "http://yolov8_server:5000"
 TEST_IMAGE = "test.jpg"
+FRAMES = 3
+PAGE_SIZE = 2
+
+def stream_frames(source: str) -> None:
+    """Stream FRAMES distinct copies of the test image from one source."""
+    for i, frame in enumerate(unique_frames(TEST_IMAGE, FRAMES)):
+        files = {"file": (f"frame_{i}.jpg", frame, "image/jpeg")}
+        response = requests.post(
+            f"{SERVER_URL}/stream",
+            files=files,
+            data={"source": source}
+        )
+        print("Stream status code:", response.status_code)
+        assert response.status_code == 200, response.text
+
+def get_detections(**params) -> dict:
+    response = requests.get(f"{SERVER_URL}/detections", params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def wait_for_source(source: str, timeout: float = 60) -> list[dict]:
+    """Poll until every streamed frame is queryable by source."""
+    deadline = time.time() + timeout
+    while True:
+        records = get_detections(source=source, limit=FRAMES + 1)["detections"]
+        if len(records) >= FRAMES or time.time() > deadline:
+            return records
+        time.sleep(1)
 
 def run_test():
-    with open(TEST_IMAGE, "rb") as f:
-        files = {"file": f}
-        response = requests.post(f"{SERVER_URL}/detect", files=files)
-    
-    print("Status code:", response.status_code)
-    print("Response:", response.json())
+    # A fresh source keeps earlier runs out of the results
+    source = f"test-{uuid.uuid4().hex[:8]}"
+    stream_frames(source)
+
+    records = wait_for_source(source)
+    print(f"Found {len(records)} detections for source {source}")
+    assert len(records) == FRAMES
+    assert all(record["source"] == source for record in records)
+
+    # Cursor paging: two pages, no overlap, no cursor after the last one
+    first = get_detections(source=source, limit=PAGE_SIZE)
+    print("First page:", [record["id"] for record in first["detections"]])
+    assert len(first["detections"]) == PAGE_SIZE
+    assert first["next_cursor"] is not None
+
+    second = get_detections(source=source, limit=PAGE_SIZE, cursor=first["next_cursor"])
+    print("Second page:", [record["id"] for record in second["detections"]])
+    assert len(second["detections"]) == FRAMES - PAGE_SIZE
+    assert second["next_cursor"] is None
+    paged_ids = [record["id"] for record in first["detections"] + second["detections"]]
+    assert len(set(paged_ids)) == FRAMES
+    assert set(paged_ids) == {record["id"] for record in records}
+
+    # Class filter, combined with the source filter
+    names = {obj["name"] for record in records for obj in record["detection_data"]}
+    if not names:
+        print("Test image has no detections, skipping the class filter check")
+        return
+    class_name = sorted(names)[0]
+    matching = get_detections(source=source, class_name=class_name)["detections"]
+    print(f"Detections with a {class_name}:", [record["id"] for record in matching])
+    assert len(matching) == FRAMES
+    assert all(
+        any(obj["name"] == class_name for obj in record["detection_data"])
+        for record in matching
+    )
+
+    missing = get_detections(source=source, class_name="no-such-class")["detections"]
+    assert missing == []
+    print("/detections filters and paging OK")
@@ -1,3 +1,4 @@
+import test_analytics
 import test_detection
 import test_detection_id
 import test_detections
@@ -12,6 +13,8 @@ def main():
     test_detections.run_test()
     print("Runnning /stream test...")
     test_stream.run_test()
+    print("Runnning /analytics test...")
+    test_analytics.run_test()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,5 +1,6 @@
 import cv2
-from typing import Any
+import random
+from typing import Any, Iterator
 
 log_file = "/app/output/detections.log"
 
@@ -56,4 +57,14 @@ def draw_detection(
         )
 
     cv2.imwrite(output_path, img)
-    log(f"Saved detections to {output_path}")
\ No newline at end of file
+    log(f"Saved detections to {output_path}")
+
+def unique_frames(image_path: str, count: int) -> Iterator[bytes]:
+    """Yield `count` JPEG encodings of an image whose bytes differ from
+    each other and from earlier runs, so the server's result cache never
+    skips them as duplicates. Only one pixel changes."""
+    img = cv2.imread(image_path)
+    for _ in range(count):
+        img[0, 0] = [random.randrange(256) for _ in range(3)]
+        _, encoded = cv2.imencode(".jpg", img)
+        yield encoded.tobytes()
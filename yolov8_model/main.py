@@ -1,22 +1,55 @@
 import asyncio
-import pickle
-import tempfile
+import hashlib
+import multiprocessing
 import os
 import json
-from ultralytics import YOLO
+import shutil
+import time
+import cv2
+import numpy as np
+from shared_config import shm_ring
 from shared_config.redis_client import redis_client
+from shared_config.wire import Frame, DetectionResult, EXT_REPLY_TO, EXT_SOURCE
 from shared_config.settings import (
     REDIS_MODEL_REQUEST_QUEUE,
     REDIS_MODEL_RESULT_QUEUE,
+    REDIS_MODEL_PROCESSING_QUEUE,
+    REDIS_MODEL_INFO_KEY,
+    REDIS_MODEL_ATTEMPTS_KEY,
+    REDIS_MODEL_DEAD_LETTER_QUEUE,
+    MODEL_BATCH_SIZE,
+    MODEL_BATCH_MAX_WAIT_MS,
+    MODEL_WORKERS,
+    MODEL_THREADS_PER_WORKER,
+    MODEL_RESULT_TTL,
+    MODEL_MAX_ATTEMPTS,
+    MODEL_DEAD_LETTER_MAX,
+    MODEL_METRICS_PORT,
+    MODEL_METRICS_DIR,
     LOG_DIR
 )
-import sys
 import logging
+
+# Workers are separate processes; their samples are shared through files
+# and merged by the supervisor's endpoint. Must be set before the import.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", MODEL_METRICS_DIR)
+if __name__ == "__main__":
+    # Only the supervisor: samples of a previous run would otherwise be
+    # merged into this one (spawned workers import this as __mp_main__)
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    multiprocess,
+    start_http_server
+)
 os.makedirs(LOG_DIR, exist_ok=True)
 log_path = os.path.join(LOG_DIR, "yolov8_model.log")
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
+    format="%(asctime)s [%(levelname)s] %(processName)s %(message)s",
     handlers=[
         logging.FileHandler(log_path),
         logging.StreamHandler()
@@ -25,61 +58,398 @@ logging.basicConfig(
 logger = logging.getLogger("yolov8_model")
 
 MODEL_PATH = "/app/model/yolov8n.pt"
-model = YOLO(MODEL_PATH)
 NAME = "YOLOv8_MODEL"
 
-async def process_model_queue():
-    logger.info(f"[{NAME}] Worker started, listening for model requests...")
-    while True:
-        item = await redis_client.blpop(
+# Loaded per worker process by load_model()
+model = None
+
+STAGE_SECONDS = Histogram(
+    "edge_model_stage_seconds",
+    "Time spent per model worker stage (queue_wait, decode, inference)",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+BATCH_SIZE = Histogram(
+    "edge_model_batch_size",
+    "Frames per inference batch",
+    buckets=tuple(range(1, MODEL_BATCH_SIZE + 1))
+)
+FRAMES = Counter(
+    "edge_model_frames_total",
+    "Model requests per source by outcome (processed, dropped, dead_lettered)",
+    ["source", "outcome"]
+)
+WORKER_RESTARTS = Counter(
+    "edge_model_worker_restarts_total",
+    "Worker processes restarted after exiting"
+)
+
+def frame_source(frame: Frame) -> str:
+    return frame.extensions.get(EXT_SOURCE, b"default").decode("utf-8")
+
+def processing_key(worker_id: int) -> str:
+    """Redis list holding the jobs a worker has claimed but not finished."""
+    return f"{REDIS_MODEL_PROCESSING_QUEUE}:{worker_id}"
+
+def running_key(worker_id: int) -> str:
+    """Redis set of the ids of the jobs a worker is inferring right now."""
+    return f"{REDIS_MODEL_PROCESSING_QUEUE}:{worker_id}:running"
+
+def load_model(num_threads: int):
+    """Load a private model copy with a capped intra-op thread count."""
+    global model
+    # Imported here so the supervisor never initialises torch itself
+    import torch
+    from ultralytics import YOLO
+
+    torch.set_num_threads(num_threads)
+    cv2.setNumThreads(num_threads)
+    model = YOLO(MODEL_PATH)
+
+def model_version() -> str:
+    """Content hash of the weights, so caches keyed on it follow model swaps."""
+    digest = hashlib.blake2b(digest_size=8)
+    with open(MODEL_PATH, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+async def publish_model_info():
+    """Publish the class-name table so consumers can label packed results,
+    and the shared-memory ring this worker maps so local senders can pass
+    slot descriptors instead of bytes."""
+    await redis_client.set(
+        REDIS_MODEL_INFO_KEY,
+        json.dumps({
+            "model": MODEL_PATH,
+            "version": model_version(),
+            "names": model.names,
+            "shm_ring": shm_ring.ring_id()
+        })
+    )
+
+async def collect_batch(worker_id: int) -> list[bytes]:
+    """Claim up to MODEL_BATCH_SIZE requests, waiting at most
+    MODEL_BATCH_MAX_WAIT_MS after the first one arrives.
+
+    Jobs are moved atomically into the worker's processing list so they
+    can be re-queued if the worker dies before answering them."""
+    processing = processing_key(worker_id)
+    item = await redis_client.blmove(
+        REDIS_MODEL_REQUEST_QUEUE,
+        processing,
+        timeout=5,
+        src="LEFT",
+        dest="RIGHT"
+    )
+    if not item:
+        return []
+
+    batch = [item]
+    deadline = time.monotonic() + MODEL_BATCH_MAX_WAIT_MS / 1000
+    while len(batch) < MODEL_BATCH_SIZE:
+        # Claim whatever is already waiting in a single round trip
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for _ in range(MODEL_BATCH_SIZE - len(batch)):
+                pipe.lmove(
+                    REDIS_MODEL_REQUEST_QUEUE,
+                    processing,
+                    "LEFT",
+                    "RIGHT"
+                )
+            pending = [p for p in await pipe.execute() if p is not None]
+        if pending:
+            batch.extend(pending)
+            continue
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        item = await redis_client.blmove(
             REDIS_MODEL_REQUEST_QUEUE,
-            timeout=5
+            processing,
+            timeout=remaining,
+            src="LEFT",
+            dest="RIGHT"
         )
         if not item:
+            break
+        batch.append(item)
+    return batch
+
+async def ack_batch(worker_id: int, batch: list[bytes]):
+    """Remove finished (or undeliverable) jobs from the processing list,
+    and forget the worker deaths they may have survived."""
+    processing = processing_key(worker_id)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for serialized in batch:
+            pipe.lrem(processing, 1, serialized)
+            pipe.hdel(REDIS_MODEL_ATTEMPTS_KEY, job_id(serialized))
+        pipe.delete(running_key(worker_id))
+        await pipe.execute()
+
+def job_id(serialized: bytes) -> str:
+    """Key of a job in the attempts hash: its request id, or a digest of
+    the message when it does not even parse."""
+    try:
+        return Frame.unpack(serialized).request_id
+    except Exception:
+        return hashlib.blake2b(serialized, digest_size=16).hexdigest()
+
+def decode_image(image_bytes: bytes) -> np.ndarray:
+    """Decode encoded image bytes straight into a BGR ndarray."""
+    # frombuffer wraps the bytes without copying them
+    buf = np.frombuffer(image_bytes, dtype=np.uint8)
+    image = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("could not decode image bytes")
+    return image
+
+def read_frame(frame: Frame) -> np.ndarray:
+    """Decode a frame's payload, mapping it from the shared-memory ring
+    without a copy when it was offloaded there."""
+    data = shm_ring.payload(frame)
+    if data is None:
+        raise ValueError("payload is in a shared-memory ring this host does not map")
+    image = decode_image(data)
+    if not shm_ring.is_current(frame):
+        raise ValueError("shared-memory slot was reused while decoding")
+    return image
+
+async def process_batch(batch: list[bytes]):
+    frames = []
+    images = []
+    decoded = []
+    for serialized in batch:
+        try:
+            frame = Frame.unpack(serialized)
+        except Exception as e:
+            logger.error(f"[{NAME}] Dropping malformed request: {e}")
+            FRAMES.labels("unknown", "dropped").inc()
+            continue
+        decoded.append(frame)
+        STAGE_SECONDS.labels("queue_wait").observe(time.time() - frame.enqueued_at)
+        frame.mark("model_dequeued")
+        try:
+            with STAGE_SECONDS.labels("decode").time():
+                images.append(read_frame(frame))
+        except Exception as e:
+            logger.error(f"[{NAME}] Dropping request {frame.request_id}: {e}")
+            FRAMES.labels(frame_source(frame), "dropped").inc()
+            continue
+        frame.mark("decoded")
+        frames.append(frame)
+
+    try:
+        if frames:
+            await infer_and_reply(frames, images)
+    finally:
+        # Our references to ring slots end once the results are out
+        for frame in decoded:
+            await shm_ring.release(frame)
+
+async def infer_and_reply(frames: list[Frame], images: list[np.ndarray]):
+    # Run YOLO detection once for the whole batch
+    BATCH_SIZE.observe(len(images))
+    with STAGE_SECONDS.labels("inference").time():
+        results = await asyncio.to_thread(
+            model,
+            images,
+            batch=len(images)
+        )
+    inferred_at = time.time()
+    logger.info(
+        f"[{NAME}] Batch filled {len(frames)}/{MODEL_BATCH_SIZE}"
+    )
+
+    # Send each result back to its own results queue
+    for frame, result in zip(frames, results):
+        boxes = result.boxes
+        trace = frame.trace()
+        detection = DetectionResult(
+            request_id=frame.request_id,
+            boxes=boxes.xyxy.cpu().numpy(),
+            classes=boxes.cls.cpu().numpy(),
+            confidences=boxes.conf.cpu().numpy(),
+            image_size=result.orig_shape,
+            inference_ms=result.speed.get("inference", 0.0),
+            trace=trace.mark("inferred", inferred_at) if trace else None
+        )
+        reply_to = frame.extensions.get(EXT_REPLY_TO)
+        result_key = (
+            reply_to.decode() if reply_to
+            else f"{REDIS_MODEL_RESULT_QUEUE}:{frame.request_id}"
+        )
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.rpush(result_key, detection.pack())
+            # Results nobody collects (e.g. the caller died) expire
+            pipe.expire(result_key, MODEL_RESULT_TTL)
+            await pipe.execute()
+
+        FRAMES.labels(frame_source(frame), "processed").inc()
+        logger.info(
+            f"[{NAME}] Processed {frame.filename}, results pushed to {result_key}"
+        )
+
+async def process_model_queue(worker_id: int):
+    logger.info(f"[{NAME}] Worker {worker_id} started, listening for model requests...")
+    while True:
+        batch = await collect_batch(worker_id)
+        if not batch:
             await asyncio.sleep(0.1)
             continue
 
-        _, serialized = item
-        try:
-            payload = pickle.loads(serialized)
-            image_bytes = payload["image_bytes"]
-            filename = payload.get("filename", "unknown.jpg")
-            request_id = payload["request_id"]
-
-            # Write image to temp file
-            with tempfile.NamedTemporaryFile(
-                delete=False,
-                suffix=".jpg"
-            ) as tmp:
-                tmp.write(image_bytes)
-                tmp.flush()
-                tmp_path = tmp.name
-
-            # Run YOLO detection
-            results = await asyncio.to_thread(model, tmp_path)
-            detection_data = json.loads(results[0].tojson())
-
-            # Send results back to results queue
-            result_key = f"{REDIS_MODEL_RESULT_QUEUE}:{request_id}"
-            result_payload = pickle.dumps({
-                "filename": filename,
-                "detection": detection_data
-            })
-            await redis_client.rpush(
-                result_key,
-                result_payload
+        # Jobs that were running when a worker died run on their own, so
+        # a frame that crashes the model takes no batch-mates down with it
+        attempts = await redis_client.hmget(
+            REDIS_MODEL_ATTEMPTS_KEY,
+            [job_id(serialized) for serialized in batch]
+        )
+        suspects = [s for s, tried in zip(batch, attempts) if tried]
+        clean = [s for s, tried in zip(batch, attempts) if not tried]
+        for group in ([clean] if clean else []) + [[s] for s in suspects]:
+            await redis_client.sadd(
+                running_key(worker_id),
+                *(job_id(serialized) for serialized in group)
             )
+            try:
+                await process_batch(group)
+            except Exception as e:
+                logger.error(f"[{NAME}] Error processing batch: {e}")
+            await ack_batch(worker_id, group)
 
-            logger.info(
-                f"[{NAME}] Processed {filename}, results pushed to {result_key}"
-            )
-            os.remove(tmp_path)
+def run_worker(worker_id: int, num_threads: int):
+    """Entry point of a model worker process."""
+    load_model(num_threads)
 
-        except Exception as e:
-            logger.error(f"[{NAME}] Error processing request: {e}")
+    async def serve():
+        await publish_model_info()
+        await process_model_queue(worker_id)
+
+    asyncio.run(serve())
+
+async def dead_letter(serialized: bytes, attempts: int):
+    """Park a job that keeps killing workers, with its payload inlined
+    so it can still be inspected once its ring slot is released."""
+    source = "unknown"
+    try:
+        frame = Frame.unpack(serialized)
+        source = frame_source(frame)
+        inline = shm_ring.inline(frame)
+        await shm_ring.release(frame)
+        if inline is not None:
+            serialized = inline.pack()
+    except Exception as e:
+        logger.warning(f"[{NAME}] Dead-lettering a job as is: {e}")
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.lpush(REDIS_MODEL_DEAD_LETTER_QUEUE, serialized)
+        pipe.ltrim(REDIS_MODEL_DEAD_LETTER_QUEUE, 0, MODEL_DEAD_LETTER_MAX - 1)
+        await pipe.execute()
+    FRAMES.labels(source, "dead_lettered").inc()
+    logger.error(
+        f"[{NAME}] Job {job_id(serialized)} was in flight on {attempts} dead "
+        f"worker(s), moved to {REDIS_MODEL_DEAD_LETTER_QUEUE}"
+    )
+
+async def requeue_claimed(worker_id: int):
+    """Put jobs claimed by a dead worker back at the head of the queue.
+
+    Jobs that were being inferred when the worker died get an attempt
+    counted; one that was running during MODEL_MAX_ATTEMPTS deaths is
+    dead-lettered instead, so a frame that crashes the model cannot take
+    every worker down forever. Claimed jobs that had not started yet go
+    back uncounted."""
+    processing = processing_key(worker_id)
+    running = {
+        member.decode() for member in await redis_client.smembers(running_key(worker_id))
+    }
+    requeued = 0
+    # Newest claim first, so the original order is kept at the head. Only
+    # the supervisor touches a dead worker's list, so peek-then-move is safe.
+    while True:
+        serialized = await redis_client.lindex(processing, -1)
+        if serialized is None:
+            break
+        key = job_id(serialized)
+        attempts = 0
+        if key in running:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.hincrby(REDIS_MODEL_ATTEMPTS_KEY, key, 1)
+                # Attempts of jobs nobody acknowledges do not pile up forever
+                pipe.expire(REDIS_MODEL_ATTEMPTS_KEY, 86400)
+                attempts = (await pipe.execute())[0]
+        if attempts >= MODEL_MAX_ATTEMPTS:
+            await dead_letter(serialized, attempts)
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.rpop(processing)
+                pipe.hdel(REDIS_MODEL_ATTEMPTS_KEY, key)
+                await pipe.execute()
+            continue
+        await redis_client.lmove(
+            processing,
+            REDIS_MODEL_REQUEST_QUEUE,
+            "RIGHT",
+            "LEFT"
+        )
+        requeued += 1
+    await redis_client.delete(running_key(worker_id))
+    if requeued:
+        logger.warning(
+            f"[{NAME}] Re-queued {requeued} job(s) claimed by worker {worker_id}"
+        )
+
+async def supervise():
+    """Run MODEL_WORKERS worker processes and restart any that die."""
+    num_threads = MODEL_THREADS_PER_WORKER or max(
+        1,
+        (os.cpu_count() or 1) // MODEL_WORKERS
+    )
+    # Inherited by the workers before torch/OpenMP initialise
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(num_threads)
+
+    ctx = multiprocessing.get_context("spawn")
+
+    if MODEL_METRICS_PORT:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(MODEL_METRICS_PORT, registry=registry)
+        logger.info(f"[{NAME}] Serving metrics on port {MODEL_METRICS_PORT}")
+
+    def start_worker(worker_id: int) -> multiprocessing.Process:
+        proc = ctx.Process(
+            target=run_worker,
+            args=(worker_id, num_threads),
+            name=f"model-worker-{worker_id}",
+            daemon=True
+        )
+        proc.start()
+        return proc
+
+    logger.info(
+        f"[{NAME}] Starting {MODEL_WORKERS} worker(s) with {num_threads} thread(s) each"
+    )
+    workers = {}
+    for worker_id in range(MODEL_WORKERS):
+        # Recover jobs left behind by a previous run of this worker
+        await requeue_claimed(worker_id)
+        workers[worker_id] = start_worker(worker_id)
+
+    while True:
+        await asyncio.sleep(1)
+        for worker_id, proc in workers.items():
+            if proc.is_alive():
+                continue
+            logger.error(
+                f"[{NAME}] Worker {worker_id} exited with code {proc.exitcode}, restarting"
+            )
+            multiprocess.mark_process_dead(proc.pid)
+            WORKER_RESTARTS.inc()
+            await requeue_claimed(worker_id)
+            workers[worker_id] = start_worker(worker_id)
 
 async def main():
-    await process_model_queue()
+    await supervise()
 
 if __name__ == "__main__":
     asyncio.run(main())